@@ -1,5 +1,7 @@
+import os
 from fastapi import APIRouter, Request, status
-from app.api.views.health_check.schema import HealthStatusResponse
+from app.api.views.health_check.schema import HealthStatusResponse, PoolStatusResponse
+from app.database.sessions import async_engine, replicas
 
 router = APIRouter()
 
@@ -7,5 +9,17 @@ router = APIRouter()
          status_code=status.HTTP_200_OK,
          response_model=HealthStatusResponse)
 async def get_health(request: Request):
-    return HealthStatusResponse()
+    replicas.check_if_stale()
+    return HealthStatusResponse(replicas=replicas.status())
 
+
+@router.get("/healthz/pool", 
+         status_code=status.HTTP_200_OK,
+         response_model=PoolStatusResponse)
+async def get_pool_status(request: Request):
+    pools = [{'name': 'primary', **async_engine.pool.snapshot()}]
+    pools += [
+        {'name': replica.engine.url.render_as_string(hide_password=True), **replica.engine.pool.snapshot()}
+        for replica in replicas.replicas
+    ]
+    return PoolStatusResponse(pid=os.getpid(), pools=pools)
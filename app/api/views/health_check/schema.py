@@ -1,8 +1,38 @@
+from typing import List
 from pydantic import BaseModel
 
 
+class ReplicaStatus(BaseModel):
+    url: str
+    lag: float | None = None
+    in_use: bool
+
+
 class HealthStatusResponse(BaseModel):
     status: str = "OK"
     healthy: bool = True
     message: str = "Server is running"
-    
\ No newline at end of file
+    replicas: List[ReplicaStatus] = []
+
+
+class PoolStatus(BaseModel):
+    name: str
+    size: int
+    max_overflow: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    checkouts: int
+    checkout_seconds_total: float
+    checkout_seconds_max: float
+    timeouts: int
+    connects: int
+    overflow_connects: int
+    invalidations: int
+    max_checked_out: int
+
+
+class PoolStatusResponse(BaseModel):
+    # Counters are per worker: each uvicorn worker process answers for itself
+    pid: int
+    pools: List[PoolStatus]
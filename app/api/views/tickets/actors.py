@@ -0,0 +1,127 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import date
+from itertools import groupby
+from typing import Any, Deque, Dict, Tuple
+from fastapi import HTTPException
+from app.api.views.tickets.schema import CreateBooking, CreateBookings
+from app.api.views.tickets.services import TicketService
+from app.conf.settings import settings
+from app.database.crud.tickets import TicketCrud, TrainRunCrud
+from app.database.sessions import AsyncSessionLocal
+
+
+BOOK = 'book'
+CANCEL = 'cancel'
+
+
+@dataclass
+class TrainWrite:
+    kind: str
+    payload: Any
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+    def resolve(self, result: Any = None) -> None:
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def fail(self, exc: BaseException) -> None:
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+class TrainWriter:
+    """
+    Single writer for one train run in this worker.
+
+    Writes are queued and applied in arrival order. Bookings waiting in the
+    queue together go through one ``book_tickets`` transaction, so a rush on
+    one run costs one lock wait and one commit per batch instead of per
+    request. Each transaction starts with the run's advisory lock, which
+    keeps the writers of other workers out meanwhile.
+    """
+    def __init__(self, train_id: int, journey_date: date, max_batch: int) -> None:
+        self.train_id = train_id
+        self.journey_date = journey_date
+        self.max_batch = max_batch
+        self.queue: Deque[TrainWrite] = deque()
+
+    async def run(self) -> None:
+        while self.queue:
+            batch = [self.queue.popleft() for _ in range(min(len(self.queue), self.max_batch))]
+            for kind, writes in groupby(batch, key=lambda write: write.kind):
+                writes = list(writes)
+                if kind == BOOK:
+                    await self._book(writes)
+                else:
+                    for write in writes:
+                        await self._cancel(write)
+
+    async def _book(self, writes) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                outcome = await TicketService(session).book_tickets(
+                    CreateBookings(bookings=[write.payload for write in writes]),
+                    lock_writes=True
+                )
+        except Exception as e:
+            for write in writes:
+                write.fail(e)
+            return
+
+        for write, result in zip(writes, outcome['results']):
+            if result['booked']:
+                write.resolve(result['ticket'])
+            else:
+                write.fail(HTTPException(status_code=result['status_code'], detail=result['detail']))
+
+    async def _cancel(self, write: TrainWrite) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                await TrainRunCrud(session).lock_writes(self.train_id, self.journey_date)
+                write.resolve(await TicketService(session).cancel_ticket(write.payload))
+        except Exception as e:
+            write.fail(e)
+
+
+class TrainWriters:
+    """Per-run writers of this worker, started on demand and dropped once idle."""
+    def __init__(self, max_batch: int) -> None:
+        self.max_batch = max_batch
+        self._writers: Dict[Tuple[int, date], TrainWriter] = {}
+        self._tasks: Dict[Tuple[int, date], asyncio.Task] = {}
+
+    async def book(self, payload: CreateBooking):
+        return await self._submit((payload.train_id, payload.journey_date), TrainWrite(BOOK, payload))
+
+    async def cancel(self, ticket_id: int):
+        # Short-lived session: no connection is held while the write waits in the queue
+        async with AsyncSessionLocal() as session:
+            ticket = await TicketCrud(session).get_ticket(ticket_id, load='bare')
+        return await self._submit((ticket.train_id, ticket.journey_date), TrainWrite(CANCEL, ticket_id))
+
+    async def _submit(self, run: Tuple[int, date], write: TrainWrite):
+        writer = self._writers.get(run)
+        if writer is None:
+            writer = self._writers[run] = TrainWriter(*run, self.max_batch)
+            # Scheduled, not started: writes submitted in the same tick join the first batch
+            self._tasks[run] = asyncio.create_task(self._run(writer))
+        writer.queue.append(write)
+        # Shielded, a client going away must not cancel a write the batch already holds
+        return await asyncio.shield(write.future)
+
+    async def _run(self, writer: TrainWriter) -> None:
+        try:
+            await writer.run()
+        finally:
+            # No await since the queue was last seen empty: only a crashed
+            # writer can leave writes behind
+            run = (writer.train_id, writer.journey_date)
+            self._writers.pop(run, None)
+            self._tasks.pop(run, None)
+            for write in writer.queue:
+                write.fail(RuntimeError(f"Writer of train {writer.train_id} on {writer.journey_date} stopped"))
+
+
+train_writers = TrainWriters(settings.BOOKING_ACTOR_BATCH_SIZE)
@@ -1,4 +1,7 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+from app.api.views.tickets.exceptions import InvalidJourney
+from app.database.models.tickets import TicketStatusEnum
 
 
 @dataclass
@@ -8,4 +11,82 @@ class CapacityCounts:
     total_waiting: int
     available_confirmed: int = 0
     available_rac: int = 0
-    available_waiting: int = 0
\ No newline at end of file
+    available_waiting: int = 0
+
+
+@dataclass
+class RouteCapacity:
+    """
+    Tickets held per status on each segment of a train's route. A journey
+    has room for a ticket when every segment it covers has; ``reserve``
+    books it on those segments and records the change in ``deltas``, ready
+    for ``TrainCounterCrud.apply_deltas``.
+    """
+    total_confirmed: int
+    total_rac: int
+    total_waiting: int
+    stations: List[str]
+    used: Dict[TicketStatusEnum, List[int]]
+    deltas: Dict[TicketStatusEnum, List[int]] = field(default_factory=dict)
+    
+    @property
+    def segments(self) -> int:
+        return len(self.used[TicketStatusEnum.CONFIRMED])
+    
+    @property
+    def limits(self) -> Dict[TicketStatusEnum, int]:
+        """Most tickets a segment holds per status, for ``TrainCounterCrud.apply_deltas``."""
+        return {
+            TicketStatusEnum.CONFIRMED: self.total_confirmed,
+            TicketStatusEnum.RAC: self.total_rac,
+            TicketStatusEnum.WAITING_LIST: self.total_waiting
+        }
+    
+    def journey(self, from_station: str | None = None, to_station: str | None = None) -> Tuple[int, int]:
+        """Stops of a journey between two stations, the route's ends by default."""
+        if not self.stations:
+            if from_station or to_station:
+                raise InvalidJourney(detail="This train has no stations, it only sells end to end journeys")
+            return 0, 1
+        try:
+            from_stop = self.stations.index(from_station) if from_station else 0
+            to_stop = self.stations.index(to_station) if to_station else len(self.stations) - 1
+        except ValueError:
+            raise InvalidJourney()
+        if from_stop >= to_stop:
+            raise InvalidJourney()
+        return from_stop, to_stop
+    
+    def counts(self, from_stop: int, to_stop: int) -> CapacityCounts:
+        # The busiest segment of the journey decides
+        peak = {status: max(used[from_stop:to_stop]) for status, used in self.used.items()}
+        return CapacityCounts(
+            total_confirmed = self.total_confirmed,
+            total_rac = self.total_rac,
+            total_waiting = self.total_waiting,
+            available_confirmed = max(0, self.total_confirmed - peak[TicketStatusEnum.CONFIRMED]),
+            available_rac = max(0, self.total_rac - peak[TicketStatusEnum.RAC]),
+            available_waiting = max(0, self.total_waiting - peak[TicketStatusEnum.WAITING_LIST])
+        )
+    
+    def reserve(self, status: TicketStatusEnum, from_stop: int, to_stop: int, count: int = 1):
+        if status not in self.used:
+            return
+        deltas = self.deltas.setdefault(status, [0] * self.segments)
+        for segment in range(from_stop, to_stop):
+            self.used[status][segment] += count
+            deltas[segment] += count
+
+
+@dataclass
+class PromotionPlan:
+    confirmed_ticket_ids: List[int] = field(default_factory=list)
+    rac_ticket_ids: List[int] = field(default_factory=list)
+    # passenger id -> berth id
+    berth_assignments: Dict[int, int] = field(default_factory=dict)
+    # berth id -> segments occupied and released on it
+    berth_claims: Dict[int, int] = field(default_factory=dict)
+    berth_releases: Dict[int, int] = field(default_factory=dict)
+    # Berths no longer, or now, free over the whole route
+    taken_berth_ids: List[int] = field(default_factory=list)
+    freed_berth_ids: List[int] = field(default_factory=list)
@@ -13,4 +13,35 @@ class NoTicketsAvailable(HTTPException):
             status_code,
             detail,
             headers
-        )
\ No newline at end of file
+        )
+
+class IdempotencyKeyReused(HTTPException):
+    def __init__(
+        self, 
+        status_code: int = status.HTTP_422_UNPROCESSABLE_ENTITY, 
+        detail: Any = "Idempotency-Key was already used for a different request", 
+        headers: Dict[str, str] | None = None
+        ) -> None:
+        super().__init__(
+            status_code,
+            detail,
+            headers
+        )
+
+class InvalidJourney(HTTPException):
+    def __init__(
+        self, 
+        status_code: int = status.HTTP_422_UNPROCESSABLE_ENTITY, 
+        detail: Any = "Stations are not on this train's route in running order", 
+        headers: Dict[str, str] | None = None
+        ) -> None:
+        super().__init__(
+            status_code,
+            detail,
+            headers
+        )
+
+class CapacityChanged(Exception):
+    # Counters filled up between reading and updating them: the write rolls
+    # back and starts over from fresh counts
+    pass
@@ -1,13 +1,22 @@
 from abc import ABC, abstractmethod
-import uuid
+from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.views.tickets.pnr import pnr_allocator
 
 
 class _TrainHelper(ABC):
     @abstractmethod
-    def generate_pnr(self):
+    async def generate_pnr(self, session: AsyncSession) -> str:
+        pass
+    
+    @abstractmethod
+    async def generate_pnrs(self, session: AsyncSession, count: int) -> List[str]:
         pass
     
 
 class TrainHelper(_TrainHelper):
-    def generate_pnr(self):
-        return str(uuid.uuid4()).replace('-', '').upper()[:8]
+    async def generate_pnr(self, session: AsyncSession) -> str:
+        return (await pnr_allocator.allocate(session))[0]
+    
+    async def generate_pnrs(self, session: AsyncSession, count: int) -> List[str]:
+        return await pnr_allocator.allocate(session, count)
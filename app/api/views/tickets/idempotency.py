@@ -0,0 +1,69 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import hashlib
+from weakref import WeakValueDictionary
+from pydantic import BaseModel
+from app.conf.settings import settings
+
+
+# Seconds a claim keeps other workers waiting if its request never finishes
+CLAIM_LEASE = 30
+# Seconds between looks at a claim held by another worker
+CLAIM_POLL_INTERVAL = 0.05
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    request_hash: str
+    status_code: int
+    body: bytes
+    expires_at: datetime
+
+
+class IdempotencyCache:
+    """
+    Stored booking responses of this worker, least recently used first, and
+    the per-key locks that keep duplicates of one request from running side
+    by side. A stored response never changes, so entries only leave on
+    expiry or eviction.
+    """
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._responses: OrderedDict[str, StoredResponse] = OrderedDict()
+        # A lock lives as long as someone holds or waits on it
+        self._locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+
+    def get(self, key: str) -> StoredResponse | None:
+        stored = self._responses.get(key)
+        if stored is None:
+            return None
+        if stored.expires_at <= datetime.now(timezone.utc):
+            del self._responses[key]
+            return None
+        self._responses.move_to_end(key)
+        return stored
+
+    def put(self, key: str, stored: StoredResponse) -> None:
+        if self.max_size <= 0:
+            return
+        self._responses[key] = stored
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.max_size:
+            self._responses.popitem(last=False)
+
+    def lock(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+
+def request_hash(payload: BaseModel) -> str:
+    # Fields as the client sent them: defaults such as today's journey date
+    # would change the hash of a retry made on another day
+    return hashlib.sha256(payload.model_dump_json(exclude_unset=True).encode()).hexdigest()
+
+
+idempotency_cache = IdempotencyCache(settings.IDEMPOTENCY_CACHE_SIZE)
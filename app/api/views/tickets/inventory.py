@@ -0,0 +1,200 @@
+from array import array
+from bisect import bisect_left
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Tuple
+from app.database.crud.tickets import BerthCrud, segment_mask
+from app.database.models.tickets import BerthTypeEnum
+
+
+BERTH_TYPES: List[BerthTypeEnum] = list(BerthTypeEnum)
+_TYPE_INDEX = {berth_type: index for index, berth_type in enumerate(BERTH_TYPES)}
+
+
+def segment_indexes(segments: int) -> Iterator[int]:
+    """Indexes of the bits set in ``segments``, lowest first."""
+    while segments:
+        lowest = segments & -segments
+        yield lowest.bit_length() - 1
+        segments ^= lowest
+
+
+class TrainBerthInventory:
+    """
+    Berth occupancy of one train, segment by segment.
+
+    Berths are addressed by their position in the sorted ``berth_ids`` array
+    and sets of berths are ints used as bitsets of positions: ``free`` holds
+    the berths free on each segment and ``type_masks`` the berths of each
+    type. The berths free for a journey are the AND of the free sets of its
+    segments, so a lookup costs one big-int AND per segment however many
+    berths the train has, and the lowest bit left is the lowest berth id.
+
+    Berths already sold on other segments are handed out before untouched
+    ones, which keeps whole berths for journeys that need more of the route.
+    On a single segment route that is plain lowest-id-first.
+    """
+    def __init__(self, berths: Iterable[Tuple[int, BerthTypeEnum, int]], segments: int = 1) -> None:
+        rows = sorted(berths, key=lambda row: row[0])
+        self.segments = segments
+        self.full_route = segment_mask(0, segments)
+        self.berth_ids = array('q', (berth_id for berth_id, _, _ in rows))
+        self.berth_types = bytearray(_TYPE_INDEX[berth_type] for _, berth_type, _ in rows)
+        self.occupied = array('q', (occupied & self.full_route for _, _, occupied in rows))
+
+        # Built as little-endian bitmaps, one pass over the berths
+        free = [bytearray((len(rows) + 7) // 8) for _ in range(segments)]
+        types = [bytearray((len(rows) + 7) // 8) for _ in BERTH_TYPES]
+        touched = bytearray((len(rows) + 7) // 8)
+        for position, occupied in enumerate(self.occupied):
+            byte, bit = position >> 3, 1 << (position & 7)
+            types[self.berth_types[position]][byte] |= bit
+            if occupied:
+                touched[byte] |= bit
+            for segment in range(segments):
+                if not occupied >> segment & 1:
+                    free[segment][byte] |= bit
+        self.free: List[int] = [int.from_bytes(bitmap, 'little') for bitmap in free]
+        self.type_masks: List[int] = [int.from_bytes(bitmap, 'little') for bitmap in types]
+        self.touched = int.from_bytes(touched, 'little')
+
+    def free_count(self, berth_type: BerthTypeEnum | None = None, segments: int | None = None) -> int:
+        return self._candidates([berth_type] if berth_type else BERTH_TYPES, segments).bit_count()
+
+    def take(self, berth_type: BerthTypeEnum | None = None, segments: int | None = None) -> int | None:
+        if berth_type:
+            return self.take_lowest([berth_type], segments)
+        return self.take_lowest(BERTH_TYPES, segments)
+
+    def take_lowest(self, berth_types: Iterable[BerthTypeEnum], segments: int | None = None) -> int | None:
+        """
+        Takes a berth of one of ``berth_types`` free over ``segments``, the
+        whole route by default, and returns its id.
+        """
+        segments = self.full_route if segments is None else segments
+        candidates = self._candidates(berth_types, segments)
+        if not candidates:
+            return None
+
+        candidates = (candidates & self.touched) or candidates
+        position = (candidates & -candidates).bit_length() - 1
+        self._occupy(position, segments)
+        return self.berth_ids[position]
+
+    def release(self, berth_id: int, segments: int | None = None) -> None:
+        position = self._position(berth_id)
+        if position is None:
+            return
+        segments = self.occupied[position] & (self.full_route if segments is None else segments)
+        if not segments:
+            return
+        bit = 1 << position
+        self.occupied[position] &= ~segments
+        for segment in segment_indexes(segments):
+            self.free[segment] |= bit
+        if not self.occupied[position]:
+            self.touched &= ~bit
+
+    def claim(self, berth_id: int, segments: int | None = None) -> None:
+        position = self._position(berth_id)
+        if position is None:
+            return
+        segments = ~self.occupied[position] & (self.full_route if segments is None else segments)
+        if segments:
+            self._occupy(position, segments)
+
+    def snapshot(self) -> array:
+        return array('q', self.occupied)
+
+    def changes(self, snapshot: array) -> Tuple[Dict[int, int], Dict[int, int], List[int], List[int]]:
+        """
+        Changes since ``snapshot``: the segments occupied and released per
+        berth id, then the berth ids taken and freed over the whole route.
+        """
+        claims, releases, taken, freed = {}, {}, [], []
+        for position, (before, after) in enumerate(zip(snapshot, self.occupied)):
+            if before == after:
+                continue
+            berth_id = self.berth_ids[position]
+            if after & ~before:
+                claims[berth_id] = after & ~before
+            if before & ~after:
+                releases[berth_id] = before & ~after
+            if not before:
+                taken.append(berth_id)
+            elif not after:
+                freed.append(berth_id)
+        return claims, releases, taken, freed
+
+    def _candidates(self, berth_types: Iterable[BerthTypeEnum], segments: int | None = None) -> int:
+        candidates = 0
+        for berth_type in berth_types:
+            candidates |= self.type_masks[_TYPE_INDEX[berth_type]]
+        for segment in segment_indexes(self.full_route if segments is None else segments):
+            candidates &= self.free[segment]
+            if not candidates:
+                break
+        return candidates
+
+    def _occupy(self, position: int, segments: int) -> None:
+        bit = 1 << position
+        self.occupied[position] |= segments
+        for segment in segment_indexes(segments):
+            self.free[segment] &= ~bit
+        self.touched |= bit
+
+    def _position(self, berth_id: int) -> int | None:
+        position = bisect_left(self.berth_ids, berth_id)
+        if position < len(self.berth_ids) and self.berth_ids[position] == berth_id:
+            return position
+        return None
+
+
+class BerthInventory:
+    """
+    Per-run berth inventories of this worker process, keyed by train and
+    journey date.
+
+    The database stays the source of truth: an inventory is loaded lazily from
+    ``berths``, every berth it hands out still has to be claimed in the DB, and
+    it is reloaded whenever it runs dry, which picks up berths freed by other
+    workers.
+    """
+    def __init__(self) -> None:
+        self._runs: Dict[Tuple[int, date], TrainBerthInventory] = {}
+
+    async def get(self, berth_crud: BerthCrud, train_id: int, journey_date: date, segments: int = 1) -> TrainBerthInventory:
+        inventory = self._runs.get((train_id, journey_date))
+        if inventory is None:
+            inventory = await self.reload(berth_crud, train_id, journey_date, segments)
+        return inventory
+
+    async def reload(self, berth_crud: BerthCrud, train_id: int, journey_date: date, segments: int = 1) -> TrainBerthInventory:
+        inventory = TrainBerthInventory(await berth_crud.get_berth_states(train_id, journey_date), segments)
+        self._runs[(train_id, journey_date)] = inventory
+        return inventory
+
+    def release(self, train_id: int, journey_date: date, berth_id: int, segments: int | None = None) -> None:
+        inventory = self._runs.get((train_id, journey_date))
+        if inventory is not None:
+            inventory.release(berth_id, segments)
+
+    def apply(self, train_id: int, journey_date: date, taken: Dict[int, int] | None = None, freed: Dict[int, int] | None = None) -> None:
+        """Applies a committed write: berth id to the segments taken or freed on it."""
+        inventory = self._runs.get((train_id, journey_date))
+        if inventory is None:
+            return
+        for berth_id, segments in (freed or {}).items():
+            inventory.release(berth_id, segments)
+        for berth_id, segments in (taken or {}).items():
+            inventory.claim(berth_id, segments)
+
+    def discard(self, train_id: int, journey_date: date | None = None) -> None:
+        """Drops the inventory of one run, or of every run of the train without ``journey_date``."""
+        if journey_date is not None:
+            self._runs.pop((train_id, journey_date), None)
+            return
+        for key in [key for key in self._runs if key[0] == train_id]:
+            del self._runs[key]
+
+
+berth_inventory = BerthInventory()
@@ -1,124 +1,359 @@
 from abc import ABC, abstractmethod
-from typing import List
-from sqlalchemy.orm import Session
-from app.api.views.tickets.data_types import CapacityCounts
+from collections import defaultdict
+from dataclasses import replace
+from datetime import date
+from itertools import groupby
+from typing import Dict, List, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.views.tickets.data_types import CapacityCounts, PromotionPlan, RouteCapacity
+from app.api.views.tickets.exceptions import CapacityChanged, NoTicketsAvailable
 from app.api.views.tickets.helpers import TrainHelper
+from app.api.views.tickets.inventory import TrainBerthInventory, berth_inventory
 from app.api.views.tickets.schema import CreateBooking, CreatePassenger, CreateTicket, TicketStatusEnum
-from app.database.crud.tickets import BerthCrud, PassengerCrud, TicketCrud, TrainCrud
+from app.database.crud.tickets import BerthCrud, PassengerCrud, TicketCrud, TrainCounterCrud, TrainCrud, segment_mask
 from app.database.models.tickets import BerthTypeEnum, GenderEnum
 
+
+CONFIRMED_BERTH_TYPES = [BerthTypeEnum.LOWER, BerthTypeEnum.MIDDLE, BerthTypeEnum.UPPER]
+
 class _TicketManager(ABC):
     @abstractmethod
-    async def get_capacity_counts(self, train_id: int):
+    async def get_capacity_counts(self, train_id: int, journey_date: date, lock: bool = False, from_station: str | None = None, to_station: str | None = None):
+        pass
+    
+    @abstractmethod
+    async def get_route_capacity(self, train_id: int, journey_date: date, lock: bool = False) -> RouteCapacity:
+        pass
+    
+    @abstractmethod
+    def get_booking_status(self, capacity: CapacityCounts, needed_berths: int):
+        pass
+    
+    @abstractmethod
+    def seat_booking(self, inventory: TrainBerthInventory, capacity: CapacityCounts, passengers: List[CreatePassenger], segments: int = 1) -> Tuple[TicketStatusEnum, List[int | None]]:
+        pass
+    
+    @abstractmethod
+    async def claim_bookings_berths(self, route: RouteCapacity, train_id: int, journey_date: date, bookings: List[Tuple[List[CreatePassenger], TicketStatusEnum, int, int, List[int | None]]]) -> List[Tuple[TicketStatusEnum | None, List[int | None]]]:
         pass
     
     @abstractmethod
-    async def available_berth(self, train_id: int, passenger: CreatePassenger, status: TicketStatusEnum):
+    async def available_berth(self, train_id: int, journey_date: date, passenger: CreatePassenger, status: TicketStatusEnum, segments: int | None = None, total_segments: int = 1):
         pass
     
     @abstractmethod
-    async def promote_rac_to_confirmed(self, train_id: int):
+    async def promote(self, train_id: int, journey_date: date) -> PromotionPlan:
         pass
     
 
 class TicketManager(_TicketManager):
-    def __init__(self, session: Session) -> None:
+    def __init__(self, session: AsyncSession) -> None:
         self.train_crud = TrainCrud(session)
+        self.counter_crud = TrainCounterCrud(session)
         self.ticket_crud = TicketCrud(session)
         self.berth_crud = BerthCrud(session)
         self.passenger_crud = PassengerCrud(session)
         self.train_helper = TrainHelper()
         self.session = session
     
-    async def get_capacity_counts(self, train_id: int):
-        
-        train = self.train_crud.get_train(train_id)
-        ticket_counts = self.ticket_crud.get_ticket_count_by_status(train_id)
+    async def get_capacity_counts(self, train_id: int, journey_date: date, lock: bool = False, from_station: str | None = None, to_station: str | None = None):
+        """Capacity left for a journey between two stations, end to end by default."""
+        route = await self.get_route_capacity(train_id, journey_date, lock)
+        return route.counts(*route.journey(from_station, to_station))
+    
+    async def get_route_capacity(self, train_id: int, journey_date: date, lock: bool = False) -> RouteCapacity:
         
-        confirmed_count = ticket_counts.get(TicketStatusEnum.CONFIRMED, 0)
-        rac_count = ticket_counts.get(TicketStatusEnum.RAC, 0)
-        waiting_count = ticket_counts.get(TicketStatusEnum.WAITING_LIST, 0)
+        # Locking the counters row makes the counts stable until commit
+        train, counters = await self.counter_crud.get_train_counters(train_id, journey_date, for_update=lock)
         
-        return CapacityCounts(
+        return RouteCapacity(
             total_confirmed = train.total_confirmed_berths,
             total_rac = train.total_rac_berths * 2,
             total_waiting = train.total_waiting_list,
-            available_confirmed= max(0, train.total_confirmed_berths - confirmed_count),
-            available_rac= max(0, (train.total_rac_berths * 2) - rac_count),
-            available_waiting= max(0, train.total_waiting_list - waiting_count)
+            stations = list(train.stations or ()),
+            used = {
+                status: list(getattr(counters, column))
+                for status, column in TrainCounterCrud.SEGMENT_COLUMNS.items()
+            }
         )
     
-    async def available_berth(self, train_id: int, passenger: CreatePassenger, status: TicketStatusEnum):
+    def get_booking_status(self, capacity: CapacityCounts, needed_berths: int):
+        if needed_berths <= capacity.available_confirmed:
+            return TicketStatusEnum.CONFIRMED
+        elif needed_berths <= capacity.available_confirmed + capacity.available_rac:
+            return TicketStatusEnum.RAC
+        elif needed_berths <= capacity.available_confirmed + capacity.available_rac + capacity.available_waiting:
+            return TicketStatusEnum.WAITING_LIST
+        raise NoTicketsAvailable()
+    
+    async def get_berth_inventory(self, train_id: int, journey_date: date, total_segments: int = 1) -> TrainBerthInventory:
+        return await berth_inventory.get(self.berth_crud, train_id, journey_date, total_segments)
+    
+    def seat_booking(self, inventory: TrainBerthInventory, capacity: CapacityCounts, passengers: List[CreatePassenger], segments: int = 1) -> Tuple[TicketStatusEnum, List[int | None]]:
+        """
+        Picks the booking's status and takes its berths over ``segments``
+        from ``inventory``. Returns the status with one berth id (or None)
+        per passenger, for ``claim_bookings_berths`` to claim.
+        
+        On a multi-stop route counts per segment can leave room on every
+        segment of a journey while no single berth is free over all of it,
+        so a booking there is only confirmed when the inventory can seat it;
+        otherwise it falls back to RAC or the waiting list. End to end
+        trains keep counting confirmed tickets alone.
+        """
+        needed_berths = len([p for p in passengers if p.age >= 5])
+        status = self.get_booking_status(capacity, needed_berths)
+        berth_ids = self.take_berths(inventory, passengers, status, segments, whole=inventory.segments > 1)
+        if berth_ids is None:
+            status = self.get_booking_status(replace(capacity, available_confirmed=0), needed_berths)
+            berth_ids = self.take_berths(inventory, passengers, status, segments)
+        return status, berth_ids
+    
+    def take_berths(self, inventory: TrainBerthInventory, passengers: List[CreatePassenger], status: TicketStatusEnum, segments: int = 1, whole: bool = False) -> List[int | None] | None:
+        """
+        Takes a berth per passenger that needs one. With ``whole``, returns
+        None for a confirmed booking the inventory cannot seat in full,
+        leaving the inventory untouched.
+        """
+        berth_ids = []
+        for passenger in passengers:
+            berth_id = None
+            if status in [TicketStatusEnum.CONFIRMED, TicketStatusEnum.RAC] and passenger.age >= 5:
+                preferred_type = self.preferred_berth_type(passenger, status)
+                berth_id = inventory.take(preferred_type, segments) if preferred_type else None
+                if berth_id is None:
+                    berth_id = inventory.take(None, segments)
+                if berth_id is None and whole and status == TicketStatusEnum.CONFIRMED:
+                    for taken in berth_ids:
+                        if taken is not None:
+                            inventory.release(taken, segments)
+                    return None
+            berth_ids.append(berth_id)
+        return berth_ids
+    
+    async def claim_bookings_berths(self, route: RouteCapacity, train_id: int, journey_date: date, bookings: List[Tuple[List[CreatePassenger], TicketStatusEnum, int, int, List[int | None]]]) -> List[Tuple[TicketStatusEnum | None, List[int | None]]]:
+        """
+        Claims the berths ``seat_booking`` took for several bookings of one
+        run, each with the stops of its journey, using a single claim
+        statement for all of them, in the current transaction. Bookings on
+        disjoint segments may share berths. Returns the status and the berth
+        ids claimed per booking.
+        
+        A confirmed booking is never left with a passenger unseated: when
+        the table has fewer berths left than the inventory thought, it drops
+        to RAC or the waiting list, ``route`` following, or to None when
+        neither has room, with the berths it did claim released.
+        """
+        claims = {}
+        for _, _, from_stop, to_stop, berth_ids in bookings:
+            for berth_id in berth_ids:
+                if berth_id is not None:
+                    claims[berth_id] = claims.get(berth_id, 0) | segment_mask(from_stop, to_stop)
+        claimed = set(await self.berth_crud.claim_berths(train_id, journey_date, claims=claims)) if claims else set()
+        
+        claimed_ids, unseated = [], defaultdict(list)
+        for booking, (passengers, status, from_stop, to_stop, berth_ids) in enumerate(bookings):
+            claimed_ids.append([berth_id if berth_id in claimed else None for berth_id in berth_ids])
+            if status not in [TicketStatusEnum.CONFIRMED, TicketStatusEnum.RAC]:
+                continue
+            for i, (passenger, berth_id) in enumerate(zip(passengers, berth_ids)):
+                if passenger.age >= 5 and berth_id not in claimed:
+                    unseated[segment_mask(from_stop, to_stop)].append((booking, i))
+        
+        if not unseated:
+            return [(status, berth_ids) for (_, status, _, _, _), berth_ids in zip(bookings, claimed_ids)]
         
+        # The inventory was stale, fall back to whatever the DB still has
+        # and reload the inventory on next use
+        berth_inventory.discard(train_id, journey_date)
+        for segments, passengers in unseated.items():
+            fallback = await self.berth_crud.claim_berths(train_id, journey_date, count=len(passengers), segments=segments)
+            for (booking, i), berth_id in zip(passengers, fallback):
+                claimed_ids[booking][i] = berth_id
+        
+        results, releases = [], {}
+        for (passengers, status, from_stop, to_stop, _), berth_ids in zip(bookings, claimed_ids):
+            needed_berths = len([p for p in passengers if p.age >= 5])
+            seated = len([berth_id for p, berth_id in zip(passengers, berth_ids) if p.age >= 5 and berth_id is not None])
+            if status != TicketStatusEnum.CONFIRMED or seated == needed_berths:
+                results.append((status, berth_ids))
+                continue
+            
+            route.reserve(status, from_stop, to_stop, -1)
+            try:
+                status = self.get_booking_status(replace(route.counts(from_stop, to_stop), available_confirmed=0), needed_berths)
+            except NoTicketsAvailable:
+                status = None
+            if status != TicketStatusEnum.RAC:
+                for berth_id in berth_ids:
+                    if berth_id is not None:
+                        releases[berth_id] = releases.get(berth_id, 0) | segment_mask(from_stop, to_stop)
+                berth_ids = [None] * len(berth_ids)
+            if status is not None:
+                route.reserve(status, from_stop, to_stop)
+            results.append((status, berth_ids))
+        
+        if releases:
+            await self.berth_crud.release_berths(releases, journey_date)
+        return results
+    
+    async def available_berth(self, train_id: int, journey_date: date, passenger: CreatePassenger, status: TicketStatusEnum, segments: int | None = None, total_segments: int = 1):
+        """
+        Claims a berth free over ``segments``, the whole route by default,
+        and commits. The inventory finds one in O(segments) big-int ANDs.
+        """
+        preferred_type = self.preferred_berth_type(passenger, status)
+        
+        for reload in (False, True):
+            if reload:
+                inventory = await berth_inventory.reload(self.berth_crud, train_id, journey_date, total_segments)
+            else:
+                inventory = await berth_inventory.get(self.berth_crud, train_id, journey_date, total_segments)
+            wanted = inventory.full_route if segments is None else segments
+            
+            for berth_type in (preferred_type, None):
+                while (berth_id := inventory.take(berth_type, wanted)) is not None:
+                    # Another worker may have sold this berth since the inventory was loaded
+                    berth = await self.berth_crud.claim_berth(berth_id, journey_date, wanted)
+                    if berth:
+                        return berth
+        return None
+    
+    def preferred_berth_type(self, passenger: CreatePassenger, status: TicketStatusEnum):
         if (status == TicketStatusEnum.CONFIRMED and 
             (passenger.age >= 60 or (
                 passenger.gender == GenderEnum.FEMALE and passenger.age < 5))):
-            
-            available_berths = self.berth_crud.get_available_berths(train_id, BerthTypeEnum.LOWER, limit=1)
-            if available_berths:
-                return available_berths[0]
+            return BerthTypeEnum.LOWER
         
         if status == TicketStatusEnum.RAC:
-            available_berths = self.berth_crud.get_available_berths(train_id, BerthTypeEnum.SIDE_LOWER, limit=1)
-            if available_berths:
-                return available_berths[0]
+            return BerthTypeEnum.SIDE_LOWER
         
-        available_berths = self.berth_crud.get_available_berths(train_id, limit=1)
-        return available_berths[0] if available_berths else None
+        return None
     
-    async def promote_rac_to_confirmed(self, train_id: int):
-        rac_tickets = self.ticket_crud.get_tickets_by_status(train_id, TicketStatusEnum.RAC)
-        if not rac_tickets:
-            return None
+    async def promote(self, train_id: int, journey_date: date) -> PromotionPlan:
+        """
+        Moves RAC tickets up to confirmed and waiting list tickets up to RAC,
+        in booking order, as far as free berths and capacity on the
+        segments of their journeys allow.
         
-        available_berths = self.berth_crud.get_available_berths(train_id)
-        if not available_berths:
-            return None
-
-        for i in range(len(available_berths)):
-            rac_ticket = rac_tickets[i]
-            self.ticket_crud.update_ticket_status(rac_ticket.id, TicketStatusEnum.CONFIRMED)
-
-            for passenger in rac_ticket.passengers:
-                if passenger.needs_berth and not passenger.berth_id:
-                    passenger_payload = CreatePassenger(
-                        name=passenger.name,
-                        age=passenger.age,
-                        gender=passenger.gender
-                    )
-                    berth = await self.available_berth(train_id, passenger_payload, TicketStatusEnum.CONFIRMED)
-                    
-                    if berth:
-                        passenger.berth_id = berth.id
-                        self.berth_crud.update_berth_availability(berth.id, False)
-            
-        self.session.commit()
-    
-    async def promote_waiting_to_rac(self, train_id: int):
-        waiting_tickets = self.ticket_crud.get_tickets_by_status(train_id, TicketStatusEnum.WAITING_LIST)
+        The whole plan is computed in memory from one read of the queue and
+        one read of the berths, then written with a fixed number of bulk
+        UPDATEs in the caller's transaction.
+        
+        The caller holds the run's advisory lock, which keeps cancellations
+        out; bookings are not, and may fill confirmed or RAC places meanwhile.
+        The berths are read unlocked, so bookings keep claiming them while the
+        plan is made; only the berths the plan changes are locked, before it
+        is written. When a booking changed one of them, or the counters
+        refuse the update, CapacityChanged rolls the pass back, to be retried
+        from fresh counts.
+        """
+        route = await self.get_route_capacity(train_id, journey_date)
+        queue = await self.ticket_crud.get_promotion_queue(train_id, journey_date)
+        if not queue:
+            return PromotionPlan()
         
-        if not waiting_tickets:
-            return None
+        # Berths held by RAC passengers are in the pool too, as occupied
+        # segments, so that the ones vacated on promotion can be reused
+        states = await self.berth_crud.get_berth_states(train_id, journey_date)
+        pool = TrainBerthInventory(states, route.segments)
+        snapshot = pool.snapshot()
         
-        available_rac_berths = self.berth_crud.get_available_berths(train_id, BerthTypeEnum.SIDE_LOWER)
-        if not available_rac_berths:
-            return None
+        plan = self.plan_promotions(queue, pool, route)
+        plan.berth_claims, plan.berth_releases, plan.taken_berth_ids, plan.freed_berth_ids = pool.changes(snapshot)
+        
+        changed = set(plan.berth_claims) | set(plan.berth_releases)
+        if changed:
+            read = {berth_id: occupied for berth_id, _, occupied in states}
+            locked = await self.berth_crud.lock_berths(sorted(changed), journey_date)
+            if any(occupied != read[berth_id] for berth_id, occupied in locked):
+                raise CapacityChanged(f"Bookings on train {train_id} on {journey_date} took berths promotions planned on")
+        
+        await self.ticket_crud.update_tickets_status(plan.confirmed_ticket_ids, TicketStatusEnum.CONFIRMED, journey_date)
+        await self.ticket_crud.update_tickets_status(plan.rac_ticket_ids, TicketStatusEnum.RAC, journey_date)
+        await self.passenger_crud.assign_berths(plan.berth_assignments, journey_date)
+        await self.berth_crud.occupy_berths(plan.berth_claims, journey_date)
+        await self.berth_crud.release_berths(plan.berth_releases, journey_date)
+        applied = await self.counter_crud.apply_deltas(train_id, journey_date, {
+            TicketStatusEnum.CONFIRMED: len(plan.confirmed_ticket_ids),
+            TicketStatusEnum.RAC: len(plan.rac_ticket_ids) - len(plan.confirmed_ticket_ids),
+            TicketStatusEnum.WAITING_LIST: -len(plan.rac_ticket_ids),
+        }, segment_deltas=route.deltas, taken_berth_ids=plan.taken_berth_ids, freed_berth_ids=plan.freed_berth_ids, limits=route.limits)
+        if not applied:
+            raise CapacityChanged(f"Bookings on train {train_id} on {journey_date} filled the places promotions planned on")
+        return plan
+    
+    def plan_promotions(self, queue, pool: TrainBerthInventory, route: RouteCapacity) -> PromotionPlan:
+        plan = PromotionPlan()
+        tickets = [
+            (ticket_id, status, from_stop, to_stop, list(passengers))
+            for (ticket_id, status, from_stop, to_stop), passengers in groupby(
+                queue, key=lambda row: (row.ticket_id, row.status, row.from_stop, row.to_stop)
+            )
+        ]
         
-        for i in range(len(available_rac_berths)):
-            waiting_ticket = waiting_tickets[i]
-            self.ticket_crud.update_ticket_status(waiting_ticket.id, TicketStatusEnum.RAC)
+        # A ticket is promoted only if all of its passengers get a berth. One
+        # that can't be holds back every later ticket sharing a segment with
+        # it, to keep the queue order; on a single segment route promotion
+        # stops at the first such ticket
+        for status, promoted_status, promoted in (
+            (TicketStatusEnum.RAC, TicketStatusEnum.CONFIRMED, plan.confirmed_ticket_ids),
+            (TicketStatusEnum.WAITING_LIST, TicketStatusEnum.RAC, plan.rac_ticket_ids),
+        ):
+            blocked = 0
+            for ticket_id, ticket_status, from_stop, to_stop, passengers in tickets:
+                if ticket_status != status:
+                    continue
+                if blocked == pool.full_route:
+                    break
+                segments = segment_mask(from_stop, to_stop)
+                if segments & blocked:
+                    continue
+                
+                capacity = route.counts(from_stop, to_stop)
+                slots = capacity.available_confirmed if promoted_status == TicketStatusEnum.CONFIRMED else capacity.available_rac
+                seats = self._seat_passengers(pool, passengers, promoted_status, segments) if slots else None
+                if seats is None:
+                    blocked |= segments
+                    continue
+                
+                promoted.append(ticket_id)
+                plan.berth_assignments.update(seats)
+                route.reserve(promoted_status, from_stop, to_stop)
+                route.reserve(status, from_stop, to_stop, -1)
+        
+        return plan
+    
+    def _seat_passengers(self, pool: TrainBerthInventory, passengers, status: TicketStatusEnum, segments: int) -> Dict[int, int] | None:
+        seats, vacated = {}, []
+        for passenger in passengers:
+            if not passenger.needs_berth:
+                continue
             
-            for passenger in waiting_ticket.passengers:
-                if passenger.needs_berth and not passenger.berth_id:
-                    passenger_payload = CreatePassenger(
-                        name=passenger.name,
-                        age=passenger.age,
-                        gender=passenger.gender
-                    )
-                    berth = await self.available_berth(train_id, passenger_payload, TicketStatusEnum.RAC)
-                    
-                    if berth:
-                        passenger.berth_id = berth.id
-                        self.berth_crud.update_berth_availability(berth.id, False)
+            if status == TicketStatusEnum.CONFIRMED:
+                # RAC passengers move off their shared side lower berth
+                if passenger.berth_id and passenger.berth_type != BerthTypeEnum.SIDE_LOWER:
+                    continue
+                preferred_type = self.preferred_berth_type(passenger, status)
+                berth_id = pool.take(preferred_type, segments) if preferred_type else None
+                if berth_id is None:
+                    berth_id = pool.take_lowest(CONFIRMED_BERTH_TYPES, segments)
+            else:
+                if passenger.berth_id:
+                    continue
+                berth_id = pool.take(BerthTypeEnum.SIDE_LOWER, segments)
+                if berth_id is None:
+                    berth_id = pool.take(None, segments)
             
-        self.session.commit()
\ No newline at end of file
+            if berth_id is None:
+                for seated_berth_id in seats.values():
+                    pool.release(seated_berth_id, segments)
+                return None
+            
+            if passenger.berth_id:
+                vacated.append(passenger.berth_id)
+            seats[passenger.passenger_id] = berth_id
+        
+        for berth_id in vacated:
+            pool.release(berth_id, segments)
+        return seats
@@ -0,0 +1,122 @@
+import asyncio
+from functools import lru_cache
+import hashlib
+from typing import List, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.conf.settings import settings
+from app.database.crud.tickets import TicketCrud
+
+
+CROCKFORD_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+_DECODE = {char: value for value, char in enumerate(CROCKFORD_ALPHABET)}
+
+PNR_LENGTH = 8
+BLOCK_BITS = 24
+OFFSET_BITS = 15
+BLOCK_SIZE = 1 << OFFSET_BITS
+# Set on every PNR: the first character is G or later, never a hex digit,
+# so these PNRs cannot collide with the older uuid4 hex ones
+MARKER_BIT = 1 << (BLOCK_BITS + OFFSET_BITS)
+
+_HALF_BITS = BLOCK_BITS // 2
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_OFFSET_MASK = BLOCK_SIZE - 1
+# Odd, hence invertible modulo 2 ** OFFSET_BITS
+_OFFSET_MULTIPLIER = 0x2E8B
+_OFFSET_INVERSE = pow(_OFFSET_MULTIPLIER, -1, BLOCK_SIZE)
+
+
+def _round_keys(secret: str, rounds: int = 4) -> List[bytes]:
+    return [hashlib.blake2b(f'{secret}:{index}'.encode(), digest_size=16).digest() for index in range(rounds)]
+
+
+_ROUND_KEYS = _round_keys(settings.PNR_KEY)
+
+
+def _round(half: int, key: bytes) -> int:
+    digest = hashlib.blake2b(half.to_bytes(2, 'big'), key=key, digest_size=4).digest()
+    return int.from_bytes(digest, 'big') & _HALF_MASK
+
+
+@lru_cache(maxsize=64)
+def permute_block(block: int) -> int:
+    """Keyed Feistel network over 24 bits: a bijection, undone by ``unpermute_block``."""
+    left, right = block >> _HALF_BITS, block & _HALF_MASK
+    for key in _ROUND_KEYS:
+        left, right = right, left ^ _round(right, key)
+    return (left << _HALF_BITS) | right
+
+
+def unpermute_block(permuted: int) -> int:
+    left, right = permuted >> _HALF_BITS, permuted & _HALF_MASK
+    for key in reversed(_ROUND_KEYS):
+        left, right = right ^ _round(left, key), left
+    return (left << _HALF_BITS) | right
+
+
+def _offset_key(permuted_block: int) -> int:
+    return (permuted_block * 0x9E37) & _OFFSET_MASK
+
+
+def encode_pnr(block: int, offset: int) -> str:
+    """
+    PNR of the ``offset``-th ticket of ``block``, 8 Crockford base32
+    characters. Blocks are permuted, so consecutive blocks look unrelated,
+    and offsets are scrambled within the block's own range, so the tickets
+    of one worker still land on a narrow slice of the pnr index.
+    """
+    permuted = permute_block(block)
+    scrambled = ((offset * _OFFSET_MULTIPLIER) & _OFFSET_MASK) ^ _offset_key(permuted)
+    value = MARKER_BIT | (permuted << OFFSET_BITS) | scrambled
+    chars = []
+    for _ in range(PNR_LENGTH):
+        value, digit = divmod(value, 32)
+        chars.append(CROCKFORD_ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def decode_pnr(pnr: str) -> Tuple[int, int]:
+    """Block and offset a PNR was allocated from. Raises ValueError for anything else."""
+    normalized = pnr.strip().upper().translate(str.maketrans('OIL', '011'))
+    if len(normalized) != PNR_LENGTH or any(char not in _DECODE for char in normalized):
+        raise ValueError(f"Not a PNR: {pnr!r}")
+    value = 0
+    for char in normalized:
+        value = value * 32 + _DECODE[char]
+    if not value & MARKER_BIT:
+        raise ValueError(f"Not a block-allocated PNR: {pnr!r}")
+    permuted = (value ^ MARKER_BIT) >> OFFSET_BITS
+    offset = (((value & _OFFSET_MASK) ^ _offset_key(permuted)) * _OFFSET_INVERSE) & _OFFSET_MASK
+    return unpermute_block(permuted), offset
+
+
+class PnrAllocator:
+    """
+    Hands out the PNRs of this worker. Each worker reserves a block of
+    BLOCK_SIZE PNRs from the ``pnr_blocks`` sequence and numbers its tickets
+    within it, so PNRs are unique by construction and cost one sequence call
+    per block. Sequences ignore rollbacks: a reserved block is never handed
+    to another worker, and a restart only leaves the rest of a block unused.
+    """
+    def __init__(self) -> None:
+        self.block: int | None = None
+        self.next_offset = BLOCK_SIZE
+        self._refill = asyncio.Lock()
+
+    async def allocate(self, session: AsyncSession, count: int = 1) -> List[str]:
+        pnrs = []
+        while len(pnrs) < count:
+            if self.next_offset >= BLOCK_SIZE:
+                async with self._refill:
+                    # Another booking may have refilled while this one waited
+                    if self.next_offset >= BLOCK_SIZE:
+                        self.block = await TicketCrud(session).reserve_pnr_block()
+                        self.next_offset = 0
+                continue
+            take = min(count - len(pnrs), BLOCK_SIZE - self.next_offset)
+            first, self.next_offset = self.next_offset, self.next_offset + take
+            pnrs.extend(encode_pnr(self.block, offset) for offset in range(first, first + take))
+        return pnrs
+
+
+pnr_allocator = PnrAllocator()
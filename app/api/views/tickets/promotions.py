@@ -0,0 +1,120 @@
+import asyncio
+from datetime import date
+import logging
+from typing import List
+from app.api.views.tickets.inventory import berth_inventory
+from app.api.views.tickets.managers import TicketManager
+from app.api.views.trains.cache import train_cache
+from app.conf.settings import settings
+from app.database.crud.tickets import PromotionEventCrud, TrainRunCrud
+from app.database.sessions import AsyncSessionLocal
+from app.metrics import PROMOTION_EVENTS_PER_PASS, PROMOTION_PASSES
+
+
+logger = logging.getLogger(__name__)
+
+
+class PromotionWorker:
+    """
+    Drains the promotion outbox written by cancellations.
+
+    Each due run gets one promotion pass for all of its pending events, so
+    a burst of cancellations on a run costs one pass rather than one each.
+    A pass and the deletion of the events it covers commit together: a pass
+    that fails leaves its events behind, pushed back for a retry, and
+    rerunning a pass is harmless since promotion works from the current
+    state of the run. Passes take the run's advisory lock, so workers of
+    several processes never promote the same run at once.
+
+    In the app it runs as a background task of each worker, started on app
+    startup or on the first cancellation, and woken up by the cancellations
+    of its own worker; it polls for the others.
+    """
+    def __init__(self, poll_interval: float, retry_delay: float, in_process: bool = True, batch_size: int = 100) -> None:
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.in_process = in_process
+        self.batch_size = batch_size
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self) -> None:
+        if self.in_process:
+            self.start()
+        self._wake.set()
+
+    async def run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                await self.drain()
+            except Exception:
+                logger.exception("Draining the promotion outbox failed")
+            try:
+                async with asyncio.timeout(self.poll_interval):
+                    await self._wake.wait()
+            except TimeoutError:
+                pass
+
+    async def drain(self) -> int:
+        """
+        Runs passes until no run has due events left, or only events held
+        by other workers. Returns the number of passes run.
+        """
+        passes = 0
+        while True:
+            async with AsyncSessionLocal() as session:
+                runs = await PromotionEventCrud(session).get_due_runs(self.batch_size)
+            covered = [await self.promote_run(train_id, journey_date) for train_id, journey_date in runs]
+            ran = sum(1 for events in covered if events)
+            passes += ran
+            if not ran:
+                return passes
+
+    async def promote_run(self, train_id: int, journey_date: date) -> int:
+        """Runs one promotion pass for a run and returns how many events it covered."""
+        async with AsyncSessionLocal() as session:
+            events = PromotionEventCrud(session)
+            event_ids: List[int] = []
+            try:
+                await TrainRunCrud(session).lock_writes(train_id, journey_date)
+                event_ids = await events.lock_due_events(train_id, journey_date)
+                if not event_ids:
+                    return 0
+                plan = await TicketManager(session).promote(train_id, journey_date)
+                await events.delete_events(event_ids)
+                await session.commit()
+            except Exception as e:
+                logger.exception("Promotion pass of train %s on %s failed", train_id, journey_date)
+                await session.rollback()
+                PROMOTION_PASSES.labels('failed').inc()
+                if event_ids:
+                    await events.defer_events(event_ids, repr(e)[:1000], self.retry_delay)
+                    await session.commit()
+                return 0
+
+        train_cache.discard(train_id, journey_date)
+        berth_inventory.apply(train_id, journey_date, taken=plan.berth_claims, freed=plan.berth_releases)
+        PROMOTION_PASSES.labels('done').inc()
+        PROMOTION_EVENTS_PER_PASS.observe(len(event_ids))
+        return len(event_ids)
+
+
+promotion_worker = PromotionWorker(
+    settings.PROMOTION_POLL_INTERVAL,
+    settings.PROMOTION_RETRY_DELAY,
+    in_process=settings.PROMOTION_WORKER
+)
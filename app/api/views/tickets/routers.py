@@ -1,43 +1,89 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import date
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
 from typing import List
-from app.api.views.tickets.schema import AvailableTicketsOut, BookedTicketsOut, CancelOut, CreateBooking, TicketOut
+from app.api.responses import FastJSONResponse
+from app.api.views.tickets.actors import train_writers
+from app.api.views.tickets.schema import AvailableTicketsOut, BookedTicketsOut, BookingsOut, CancelOut, CreateBooking, CreateBookings, TicketOut
 from app.api.views.tickets.services import TicketService
-from app.database.deps import db_dependency
+from app.conf.settings import settings
+from app.database.deps import db_dependency, read_db_dependency
 
 
 router = APIRouter()
 
 @router.get('/booked', status_code=status.HTTP_200_OK, response_model=BookedTicketsOut)
 async def get_booked_tickects(
-    session: db_dependency, 
+    session: read_db_dependency, 
     train_id: int, 
-    page: int = 1, 
-    page_size: int = 20
+    cursor: str | None = None, 
+    page_size: int = Query(20, ge=1, le=500),
+    with_total: bool = False,
+    journey_date: date | None = Query(None, description="Day of the run, today (UTC) by default")
     ):
     
     service = TicketService(session)
-    return await service.get_booked_tickets(train_id, page, page_size)
+    booked = await service.get_booked_tickets(train_id, cursor, page_size, with_total, as_rows=settings.FAST_SERIALIZATION, journey_date=journey_date)
+    if settings.FAST_SERIALIZATION:
+        # Already plain data shaped like BookedTicketsOut: skips re-validation
+        return FastJSONResponse(booked)
+    return booked
 
 
 @router.get('/available', status_code=status.HTTP_200_OK, response_model=AvailableTicketsOut)
 async def get_available_tickects(
-    session: db_dependency, 
+    session: read_db_dependency, 
     train_id: int, 
+    view: str = Query('full', pattern='^(counts|compact|full)$',
+                      description="counts: no berths; compact: free berths per coach as runs of layout positions; full: every free berth"),
+    from_station: str | None = None,
+    to_station: str | None = None,
+    journey_date: date | None = Query(None, description="Day of the run, today (UTC) by default")
     ):
     
     service = TicketService(session)
-    return await service.get_available_tickets(train_id)
+    if view != 'full':
+        # Built as plain data in the shape of AvailableCountsOut or AvailableCompactOut
+        return FastJSONResponse(await service.get_available_tickets(
+            train_id, view=view, from_station=from_station, to_station=to_station, journey_date=journey_date
+        ))
+    available = await service.get_available_tickets(
+        train_id, as_rows=settings.FAST_SERIALIZATION, from_station=from_station, to_station=to_station, journey_date=journey_date
+    )
+    if settings.FAST_SERIALIZATION:
+        return FastJSONResponse(available)
+    return available
 
 
 @router.post('/book', status_code=status.HTTP_201_CREATED, response_model=TicketOut)
 async def book_ticket(
     session: db_dependency,
-    payload: CreateBooking
+    payload: CreateBooking,
+    idempotency_key: str | None = Header(None, max_length=255)
 ):
     
     service = TicketService(session)
-    return await service.book_ticket(payload)
+    book = train_writers.book if settings.BOOKING_ACTORS else service.book_ticket
+    if idempotency_key:
+        # Retries with the same key get the first response back, byte for byte
+        stored, replayed = await service.book_ticket_once(idempotency_key, payload, book)
+        return Response(
+            stored.body,
+            status_code=stored.status_code,
+            media_type='application/json',
+            headers={'Idempotent-Replayed': str(replayed).lower()}
+        )
+    return await book(payload)
+
+
+@router.post('/book/batch', status_code=status.HTTP_200_OK, response_model=BookingsOut)
+async def book_tickets(
+    session: db_dependency,
+    payload: CreateBookings
+):
+    
+    service = TicketService(session)
+    return await service.book_tickets(payload)
 
 
 @router.patch('/cancel/{ticket_id}', status_code=status.HTTP_202_ACCEPTED, response_model=CancelOut)
@@ -46,6 +92,9 @@ async def cancel_booking(
     ticket_id: int
 ):
     
-    service = TicketService(session)
-    await service.cancel_ticket(ticket_id)
+    if settings.BOOKING_ACTORS:
+        await train_writers.cancel(ticket_id)
+    else:
+        service = TicketService(session)
+        await service.cancel_ticket(ticket_id)
     return {"message": "Ticket cancelled successfully"}
@@ -1,7 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime
 from app.api.views.trains.schemas import TrainOut
+from app.database.models.base import utc_today
 from app.database.models.tickets import GenderEnum, BerthTypeEnum, TicketStatusEnum
 
 
@@ -55,6 +56,10 @@ class TicketOut(TicketBase):
     id: int
     created_at: datetime
     train_id: int
+    journey_date: date
+    # Indexes into the train's stations
+    from_stop: int = 0
+    to_stop: int = 1
     passengers: List[PassengerOut]
 
     class Config:
@@ -64,6 +69,30 @@ class TicketOut(TicketBase):
 class CreateBooking(BaseModel):
     passengers: List[CreatePassenger]
     train_id: int
+    # Day the train leaves its first station, today (UTC) when left out
+    journey_date: date = Field(default_factory=utc_today)
+    # Station codes of the train's route, its two ends when left out
+    from_station: str | None = None
+    to_station: str | None = None
+
+
+class CreateBookings(BaseModel):
+    bookings: List[CreateBooking] = Field(min_length=1, max_length=1000)
+
+
+class BookingResultOut(BaseModel):
+    index: int
+    train_id: int
+    journey_date: date
+    booked: bool
+    ticket: TicketOut | None = None
+    detail: str | None = None
+
+
+class BookingsOut(BaseModel):
+    results: List[BookingResultOut]
+    booked: int = 0
+    failed: int = 0
 
 
 class CancelOut(BaseModel):
@@ -73,9 +102,26 @@ class CancelOut(BaseModel):
 class BookedTicketsOut(BaseModel):
     tickets: List[TicketOut]
     count: int = 0
+    next_cursor: str | None = None
+    total: int | None = None
 
 
-class AvailableTicketsOut(BaseModel):
+class AvailableCountsOut(BaseModel):
     available: dict
     total: dict
-    available_berths: List[BerthOut]
\ No newline at end of file
+
+
+class AvailableTicketsOut(AvailableCountsOut):
+    available_berths: List[BerthOut]
+
+
+class CoachAvailabilityOut(BaseModel):
+    coach: str
+    # Berths in the coach's layout, see app.api.views.tickets.serializers
+    size: int
+    # Free layout positions as comma separated runs, e.g. "0-5,9,12-26"
+    free: str
+
+
+class AvailableCompactOut(AvailableCountsOut):
+    coaches: List[CoachAvailabilityOut]
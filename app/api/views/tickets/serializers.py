@@ -0,0 +1,94 @@
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List
+import sqlalchemy as sa
+from app.database.crud.tickets import berth_layout
+
+
+# Plain-data builders for the fast serialization path. Keys follow the
+# field order of the matching response models in schema.py, so both paths
+# produce the same documents.
+
+def berth_dict(row: sa.Row) -> dict:
+    return {
+        'berth_number': row.berth_number,
+        'type': row.type,
+        'coach': row.coach,
+        'is_available': row.is_available,
+        'id': row.id,
+        'train_id': row.train_id
+    }
+
+
+def ticket_dicts(ticket_rows: Iterable[sa.Row], passenger_rows: Iterable[sa.Row]) -> List[dict]:
+    passengers = defaultdict(list)
+    for row in passenger_rows:
+        passengers[row.ticket_id].append({
+            'name': row.name,
+            'age': row.age,
+            'gender': row.gender,
+            'id': row.id,
+            'needs_berth': row.needs_berth,
+            'berth': {
+                'berth_number': row.berth_number,
+                'type': row.berth_type,
+                'coach': row.coach,
+                'is_available': row.is_available,
+                'id': row.berth_id,
+                'train_id': row.berth_train_id
+            } if row.berth_id is not None else None
+        })
+    
+    return [
+        {
+            'pnr': row.pnr,
+            'status': row.status,
+            'id': row.id,
+            'created_at': row.created_at,
+            'train_id': row.train_id,
+            'journey_date': row.journey_date,
+            'from_stop': row.from_stop,
+            'to_stop': row.to_stop,
+            'passengers': passengers[row.id]
+        }
+        for row in ticket_rows
+    ]
+
+
+# Compact availability: berths are numbered by their position in the
+# coach's layout as berth_layout lays it out, L1 M1 U1 L2 M2 U2 ... in the
+# sleeper coaches and RAC1 RAC2 ... in the RAC coach
+LAYOUT_OFFSETS = {'L': 0, 'M': 1, 'U': 2}
+
+
+def layout_position(coach: str, berth_number: str) -> int:
+    if coach == 'RAC':
+        return int(berth_number[len('RAC'):]) - 1
+    kind, number = berth_number[len(coach)], int(berth_number[len(coach) + 1:])
+    return (number - 1) * 3 + LAYOUT_OFFSETS[kind]
+
+
+@lru_cache(maxsize=256)
+def coach_sizes(total_confirmed_berths: int, total_rac_berths: int) -> Dict[str, int]:
+    return dict(Counter(coach for coach, _, _ in berth_layout(total_confirmed_berths, total_rac_berths)))
+
+
+def position_runs(positions: List[int]) -> str:
+    """``[0, 1, 2, 5, 7, 8]`` as ``"0-2,5,7-8"``. ``positions`` must be sorted."""
+    runs = []
+    for position in positions:
+        if runs and runs[-1][1] == position - 1:
+            runs[-1][1] = position
+        else:
+            runs.append([position, position])
+    return ','.join(str(first) if first == last else f'{first}-{last}' for first, last in runs)
+
+
+def coach_availability(berth_rows: Iterable[sa.Row], sizes: Dict[str, int]) -> List[dict]:
+    free = defaultdict(list)
+    for row in berth_rows:
+        free[row.coach].append(layout_position(row.coach, row.berth_number))
+    return [
+        {'coach': coach, 'size': size, 'free': position_runs(sorted(free[coach]))}
+        for coach, size in sizes.items()
+    ]
@@ -1,13 +1,37 @@
 from abc import ABC, abstractmethod
-import copy
-from typing import List
-from sqlalchemy.orm import Session
+import asyncio
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, timezone
+import logging
+from typing import Awaitable, Callable, List, Tuple
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from app.api.views.tickets.exceptions import NoTicketsAvailable
+from app.api.views.tickets.exceptions import CapacityChanged, IdempotencyKeyReused, NoTicketsAvailable
 from app.api.views.tickets.helpers import TrainHelper
+from app.api.views.tickets.idempotency import CLAIM_LEASE, CLAIM_POLL_INTERVAL, StoredResponse, idempotency_cache, request_hash
+from app.api.views.tickets.inventory import berth_inventory
 from app.api.views.tickets.managers import TicketManager
-from app.api.views.tickets.schema import CreateBooking, TicketStatusEnum
-from app.database.crud.tickets import BerthCrud, PassengerCrud, TicketCrud, TrainCrud
+from app.api.views.tickets.promotions import promotion_worker
+from app.api.views.tickets.schema import CreateBooking, CreateBookings, TicketOut, TicketStatusEnum
+from app.api.views.tickets.serializers import berth_dict, coach_availability, coach_sizes, ticket_dicts
+from app.api.views.trains.cache import train_cache
+from app.conf.settings import settings
+from app.database.crud.tickets import BerthCrud, IdempotencyKeyCrud, PassengerCrud, PromotionEventCrud, TicketCrud, TrainCounterCrud, TrainCrud, TrainRunCrud, segment_mask
+from app.database.models.base import utc_today
+from app.database.models.tickets import TicketModel
+from app.metrics import BOOKINGS
+
+
+logger = logging.getLogger(__name__)
+
+# Tries a booking gets when concurrent bookings keep filling its places
+# between its read of the counters and its update of them
+BOOKING_ATTEMPTS = 3
+
+
+def rejected_outcome(e: HTTPException) -> str:
+    return 'no_tickets' if isinstance(e, NoTicketsAvailable) else 'rejected'
 
 
 class _TicketService(ABC):
@@ -15,36 +39,71 @@ class _TicketService(ABC):
     async def book_ticket(self, payload: CreateBooking):
         pass
     
+    @abstractmethod
+    async def book_ticket_once(self, idempotency_key: str, payload: CreateBooking, book: Callable[[CreateBooking], Awaitable[TicketModel]] | None = None) -> Tuple[StoredResponse, bool]:
+        pass
+    
+    @abstractmethod
+    async def book_tickets(self, payload: CreateBookings, lock_writes: bool = False):
+        pass
+    
     @abstractmethod
     async def cancel_ticket(self, ticket_id: int):
         pass
     
     @abstractmethod
-    async def get_booked_tickets(self, train_id: int, page: int, page_size: int):
+    async def get_booked_tickets(self, train_id: int, cursor: str | None, page_size: int, with_total: bool = False, as_rows: bool = False, journey_date: date | None = None):
         pass
     
     @abstractmethod
-    async def get_available_tickets(self, train_id: int):
+    async def get_available_tickets(self, train_id: int, as_rows: bool = False, view: str = 'full', from_station: str | None = None, to_station: str | None = None, journey_date: date | None = None):
         pass
     
 
 class TicketService(_TicketService):
-    def __init__(self, session: Session) -> None:
+    def __init__(self, session: AsyncSession) -> None:
         self.train_crud = TrainCrud(session)
+        self.counter_crud = TrainCounterCrud(session)
         self.ticket_crud = TicketCrud(session)
         self.berth_crud = BerthCrud(session)
         self.passenger_crud = PassengerCrud(session)
+        self.idempotency_crud = IdempotencyKeyCrud(session)
+        self.promotion_crud = PromotionEventCrud(session)
+        self.run_crud = TrainRunCrud(session)
         self.train_helper = TrainHelper()
         self.manager = TicketManager(session)
         self.session = session
     
-    async def get_booked_tickets(self, train_id: int, page: int, page_size: int):
-        return self.ticket_crud.get_tickets(train_id, True, page, page_size)
+    async def get_booked_tickets(self, train_id: int, cursor: str | None, page_size: int, with_total: bool = False, as_rows: bool = False, journey_date: date | None = None):
+        journey_date = journey_date or utc_today()
+        if as_rows:
+            page = await self.ticket_crud.get_ticket_rows(train_id, journey_date, True, cursor, page_size)
+            tickets = ticket_dicts(page['tickets'], page['passengers'])
+            booked = {'tickets': tickets, 'count': len(tickets), 'next_cursor': page['next_cursor'], 'total': None}
+        else:
+            booked = await self.ticket_crud.get_tickets(train_id, journey_date, True, cursor, page_size)
+        
+        if with_total:
+            # Every non-cancelled ticket is counted in exactly one counter
+            _, counters = await self.counter_crud.get_train_counters(train_id, journey_date)
+            booked['total'] = counters.confirmed_used + counters.rac_used + counters.waiting_used
+        return booked
     
-    async def get_available_tickets(self, train_id: int):
-        capacity = await self.manager.get_capacity_counts(train_id)
-        available_berths = self.berth_crud.get_available_berths(train_id)
-        return {
+    async def get_available_tickets(self, train_id: int, as_rows: bool = False, view: str = 'full', from_station: str | None = None, to_station: str | None = None, journey_date: date | None = None):
+        """
+        Availability of a train run for a journey, end to end by default, in
+        one of three views: ``counts`` only, with no berth query at all;
+        ``compact``, the free berths of each coach as runs of layout
+        positions; or ``full``, every free berth. Only the full view depends
+        on ``as_rows``, the other two are plain data. Runs default to today's.
+        """
+        journey_date = journey_date or utc_today()
+        route = await self.manager.get_route_capacity(train_id, journey_date)
+        from_stop, to_stop = route.journey(from_station, to_station)
+        capacity = route.counts(from_stop, to_stop)
+        # Berths free end to end are the ones is_available flags
+        segments = None if (from_stop, to_stop) == (0, route.segments) else segment_mask(from_stop, to_stop)
+        counts = {
             "available": {
                 "confirmed": capacity.available_confirmed,
                 "rac": capacity.available_rac,
@@ -54,70 +113,313 @@ class TicketService(_TicketService):
                 "confirmed": capacity.total_confirmed,
                 "rac": capacity.total_rac,
                 "waiting_list": capacity.total_waiting
-            },
-            "available_berths": available_berths
+            }
         }
+        if view == 'counts':
+            return counts
+        
+        if view == 'compact':
+            rows = await self.berth_crud.get_available_berth_numbers(train_id, journey_date, segments)
+            # total_rac counts two tickets per RAC berth
+            sizes = coach_sizes(capacity.total_confirmed, capacity.total_rac // 2)
+            return {**counts, "coaches": coach_availability(rows, sizes)}
+        
+        if as_rows:
+            available_berths = [berth_dict(row) for row in await self.berth_crud.get_available_berth_rows(train_id, journey_date, segments)]
+        else:
+            available_berths = await self.berth_crud.get_available_berths(train_id, journey_date, segments=segments)
+        return {**counts, "available_berths": available_berths}
     
     async def book_ticket(self, payload: CreateBooking):
+        """
+        Books in one transaction that locks nothing up front: berths are
+        claimed with SKIP LOCKED, and the counters are checked and moved in
+        one conditional update just before commit, so concurrent bookings of
+        a run only wait on each other for that last statement. A booking
+        that finds its places taken meanwhile starts over from fresh counts;
+        the last of BOOKING_ATTEMPTS locks the counters first, so it cannot
+        lose again.
+        """
+        for attempt in range(BOOKING_ATTEMPTS):
+            try:
+                return await self._book_ticket(payload, lock=attempt == BOOKING_ATTEMPTS - 1)
+            except CapacityChanged:
+                await self.session.rollback()
+                berth_inventory.discard(payload.train_id, payload.journey_date)
+                if attempt == BOOKING_ATTEMPTS - 1:
+                    raise
+    
+    async def _book_ticket(self, payload: CreateBooking, lock: bool = False):
         try:
-            capacity = await self.manager.get_capacity_counts(payload.train_id)
+            route = await self.manager.get_route_capacity(payload.train_id, payload.journey_date, lock)
+            from_stop, to_stop = route.journey(payload.from_station, payload.to_station)
+            
+            segments = segment_mask(from_stop, to_stop)
             
-            passengers_needing_berth = [p for p in payload.passengers if p.age >= 5]
-            needed_berths = len(passengers_needing_berth)
+            inventory = await self.manager.get_berth_inventory(payload.train_id, payload.journey_date, route.segments)
+            status, berth_ids = self.manager.seat_booking(inventory, route.counts(from_stop, to_stop), payload.passengers, segments)
+            route.reserve(status, from_stop, to_stop)
             
-            if needed_berths <= capacity.available_confirmed:
-                status = TicketStatusEnum.CONFIRMED
-            elif needed_berths <= capacity.available_confirmed + capacity.available_rac:
-                status = TicketStatusEnum.RAC
-            elif needed_berths <= capacity.available_confirmed + capacity.available_rac + capacity.available_waiting:
-                status = TicketStatusEnum.WAITING_LIST
-            else:
+            (status, berth_ids), = await self.manager.claim_bookings_berths(
+                route, payload.train_id, payload.journey_date, [(payload.passengers, status, from_stop, to_stop, berth_ids)]
+            )
+            if status is None:
                 raise NoTicketsAvailable()
-
-            ticket = self.ticket_crud.create_ticket({
-                'pnr': self.train_helper.generate_pnr(),
+            
+            ticket = await self.ticket_crud.insert_ticket({
+                'pnr': await self.train_helper.generate_pnr(self.session),
                 'status': status,
-                'train_id': payload.train_id
+                'train_id': payload.train_id,
+                'journey_date': payload.journey_date,
+                'from_stop': from_stop,
+                'to_stop': to_stop
             })
             
-            for passenger in payload.passengers:
-                berth = None
-                if passenger.age >= 5 and status in [TicketStatusEnum.CONFIRMED, TicketStatusEnum.RAC]:
-                    berth = await self.manager.available_berth(payload.train_id, passenger, status)
-                    if berth:
-                        self.berth_crud.update_berth_availability(berth.id, False)
+            await self.passenger_crud.insert_passengers([
+                {**passenger.model_dump(exclude_none=True), 'ticket_id': ticket.id, 'journey_date': payload.journey_date, 'berth_id': berth_id}
+                for passenger, berth_id in zip(payload.passengers, berth_ids)
+            ])
+            applied = await self.counter_crud.apply_deltas(
+                payload.train_id, payload.journey_date, {status: 1}, route.deltas,
+                taken_berth_ids=[berth_id for berth_id in berth_ids if berth_id], limits=route.limits
+            )
+            if not applied:
+                raise CapacityChanged()
+            
+            await self.session.commit()
+            train_cache.discard(payload.train_id, payload.journey_date)
+            BOOKINGS.labels(status.value).inc()
+            return await self.ticket_crud.get_ticket(ticket.id, reload=True)
+        except HTTPException as e:
+            BOOKINGS.labels(rejected_outcome(e)).inc()
+            raise e
+        except SQLAlchemyError as e:
+            logger.exception("Booking on train %s on %s failed", payload.train_id, payload.journey_date)
+            BOOKINGS.labels('error').inc()
+            await self.session.rollback()
+            berth_inventory.discard(payload.train_id, payload.journey_date)
+            raise e
+    
+    async def book_ticket_once(self, idempotency_key: str, payload: CreateBooking, book: Callable[[CreateBooking], Awaitable[TicketModel]] | None = None) -> Tuple[StoredResponse, bool]:
+        """
+        Books at most once per ``idempotency_key`` and returns the stored
+        ``TicketOut`` response, with whether it is a replay. ``book`` makes
+        the booking, ``book_ticket`` of this service by default.
+        
+        Duplicates wait for the first request instead of booking alongside
+        it: in this worker on the key's lock, in other workers by polling its
+        claim. The booking commits before its response is stored, so a worker
+        dying in between leaves a claim that lapses after CLAIM_LEASE, and a
+        retry then books again.
+        """
+        fingerprint = request_hash(payload)
+        async with idempotency_cache.lock(idempotency_key):
+            stored, replayed = idempotency_cache.get(idempotency_key), True
+            if stored is None:
+                stored, replayed = await self._book_once(idempotency_key, fingerprint, payload, book or self.book_ticket)
+                idempotency_cache.put(idempotency_key, stored)
+        
+        if stored.request_hash != fingerprint:
+            raise IdempotencyKeyReused()
+        return stored, replayed
+    
+    async def _book_once(self, idempotency_key: str, fingerprint: str, payload: CreateBooking, book: Callable[[CreateBooking], Awaitable[TicketModel]]) -> Tuple[StoredResponse, bool]:
+        while True:
+            lease = datetime.now(timezone.utc) + timedelta(seconds=CLAIM_LEASE)
+            claimed = await self.idempotency_crud.claim_key(idempotency_key, fingerprint, lease)
+            row = None if claimed else await self.idempotency_crud.get_key(idempotency_key)
+            await self.session.commit()
+            if claimed:
+                break
+            if row is not None and row.request_hash != fingerprint:
+                raise IdempotencyKeyReused()
+            if row is not None and row.response is not None:
+                return StoredResponse(row.request_hash, row.status_code, row.response.encode(), row.expires_at), True
+            # Claimed by a request still booking in another worker
+            await asyncio.sleep(CLAIM_POLL_INTERVAL)
+        
+        try:
+            ticket = await book(payload)
+        except Exception:
+            # Nothing booked: the next retry may book afresh
+            await self.session.rollback()
+            await self.idempotency_crud.release_key(idempotency_key)
+            await self.session.commit()
+            raise
+        
+        stored = StoredResponse(
+            request_hash=fingerprint,
+            status_code=201,
+            body=TicketOut.model_validate(ticket, from_attributes=True).model_dump_json().encode(),
+            expires_at=datetime.now(timezone.utc) + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        )
+        await self.idempotency_crud.complete_key(idempotency_key, stored.status_code, stored.body.decode(), stored.expires_at)
+        await self.session.commit()
+        return stored, False
+    
+    async def book_tickets(self, payload: CreateBookings, lock_writes: bool = False):
+        """
+        Books a batch in one transaction, as ``book_ticket`` books one
+        booking, starting the whole batch over when the counters of any of
+        its runs filled up meanwhile.
+        
+        With ``lock_writes`` every attempt first takes the write lock of each
+        run of the batch: the rollback before a retry releases them.
+        """
+        runs = sorted({(booking.train_id, booking.journey_date) for booking in payload.bookings})
+        for attempt in range(BOOKING_ATTEMPTS):
+            try:
+                if lock_writes:
+                    for train_id, journey_date in runs:
+                        await self.run_crud.lock_writes(train_id, journey_date)
+                return await self._book_tickets(payload, lock=attempt == BOOKING_ATTEMPTS - 1)
+            except CapacityChanged:
+                await self.session.rollback()
+                for booking in payload.bookings:
+                    berth_inventory.discard(booking.train_id, booking.journey_date)
+                if attempt == BOOKING_ATTEMPTS - 1:
+                    raise
+    
+    async def _book_tickets(self, payload: CreateBookings, lock: bool = False):
+        results = [None] * len(payload.bookings)
+        bookings_by_run = defaultdict(list)
+        for index, booking in enumerate(payload.bookings):
+            bookings_by_run[(booking.train_id, booking.journey_date)].append(index)
+        
+        tickets_data, booked = [], []
+        counter_deltas = defaultdict(lambda: defaultdict(int))
+        routes, taken_berth_ids = {}, defaultdict(list)
+        # Counted once the batch commits, not on attempts that start over
+        rejected = Counter()
+        
+        def reject(index: int, e: HTTPException):
+            booking = payload.bookings[index]
+            results[index] = {'index': index, 'train_id': booking.train_id, 'journey_date': booking.journey_date, 'booked': False, 'detail': e.detail, 'status_code': e.status_code}
+            rejected[rejected_outcome(e)] += 1
+        
+        try:
+            # Runs are visited in (train id, date) order, so concurrent batches
+            # update, or lock, their counters in the same order and cannot deadlock
+            for run in sorted(bookings_by_run):
+                train_id, journey_date = run
+                try:
+                    route = routes[run] = await self.manager.get_route_capacity(train_id, journey_date, lock)
+                except HTTPException as e:
+                    for index in bookings_by_run[run]:
+                        reject(index, e)
+                    continue
                 
-                self.passenger_crud.create_passenger(passenger.model_dump(exclude_none=True), ticket.id, berth.id if berth else None)
+                inventory = await self.manager.get_berth_inventory(train_id, journey_date, route.segments)
+                accepted, seats = [], []
+                for index in bookings_by_run[run]:
+                    booking = payload.bookings[index]
+                    try:
+                        from_stop, to_stop = route.journey(booking.from_station, booking.to_station)
+                        segments = segment_mask(from_stop, to_stop)
+                        status, berth_ids = self.manager.seat_booking(inventory, route.counts(from_stop, to_stop), booking.passengers, segments)
+                    except HTTPException as e:
+                        reject(index, e)
+                        continue
+                    route.reserve(status, from_stop, to_stop)
+                    accepted.append((index, from_stop, to_stop))
+                    seats.append((booking.passengers, status, from_stop, to_stop, berth_ids))
+                
+                seated = await self.manager.claim_bookings_berths(route, train_id, journey_date, seats)
+                for (index, from_stop, to_stop), (status, booking_berth_ids) in zip(accepted, seated):
+                    if status is None:
+                        reject(index, NoTicketsAvailable())
+                        continue
+                    counter_deltas[run][status] += 1
+                    taken_berth_ids[run].extend(berth_id for berth_id in booking_berth_ids if berth_id)
+                    tickets_data.append({
+                        'status': status,
+                        'train_id': train_id,
+                        'journey_date': journey_date,
+                        'from_stop': from_stop,
+                        'to_stop': to_stop
+                    })
+                    booked.append((index, booking_berth_ids))
             
-            self.session.refresh(ticket)
-            return ticket
+            pnrs = await self.train_helper.generate_pnrs(self.session, len(tickets_data))
+            for ticket_data, pnr in zip(tickets_data, pnrs):
+                ticket_data['pnr'] = pnr
+            ticket_ids = await self.ticket_crud.insert_tickets(tickets_data)
+            await self.passenger_crud.insert_passengers([
+                {**passenger.model_dump(exclude_none=True), 'ticket_id': ticket_id, 'journey_date': payload.bookings[index].journey_date, 'berth_id': berth_id}
+                for ticket_id, (index, booking_berth_ids) in zip(ticket_ids, booked)
+                for passenger, berth_id in zip(payload.bookings[index].passengers, booking_berth_ids)
+            ])
+            for run, deltas in counter_deltas.items():
+                applied = await self.counter_crud.apply_deltas(
+                    *run, deltas, routes[run].deltas, taken_berth_ids=taken_berth_ids[run], limits=routes[run].limits
+                )
+                if not applied:
+                    raise CapacityChanged()
+            await self.session.commit()
+            for run, deltas in counter_deltas.items():
+                train_cache.discard(*run)
+                for status, count in deltas.items():
+                    BOOKINGS.labels(status.value).inc(count)
+            for outcome, count in rejected.items():
+                BOOKINGS.labels(outcome).inc(count)
         except SQLAlchemyError as e:
-            print(e)
-            self.session.rollback()
+            logger.exception("Batch of %s bookings failed", len(payload.bookings))
+            BOOKINGS.labels('error').inc(len(payload.bookings))
+            await self.session.rollback()
+            for run in bookings_by_run:
+                berth_inventory.discard(*run)
             raise e
+        
+        tickets = {ticket.id: ticket for ticket in await self.ticket_crud.get_tickets_by_ids(ticket_ids)}
+        for ticket_id, (index, _) in zip(ticket_ids, booked):
+            results[index] = {
+                'index': index,
+                'train_id': payload.bookings[index].train_id,
+                'journey_date': payload.bookings[index].journey_date,
+                'booked': True,
+                'ticket': tickets[ticket_id]
+            }
+        
+        return {'results': results, 'booked': len(booked), 'failed': len(results) - len(booked)}
     
     async def cancel_ticket(self, ticket_id: int):
         try:
-            ticket = self.ticket_crud.get_ticket(ticket_id)
-            ticket_ref = copy.deepcopy(ticket)
+            ticket = await self.ticket_crud.get_ticket(ticket_id, load='bare')
+            train_id, journey_date = ticket.train_id, ticket.journey_date
+            
+            # Take the run's advisory lock before touching berths, as
+            # promotion passes do, then re-read the ticket in case it changed
+            # meanwhile. Bookings take no lock: they only meet this write on
+            # the counters row, when both update it
+            await self.run_crud.lock_writes(train_id, journey_date)
+            route = await self.manager.get_route_capacity(train_id, journey_date)
+            ticket = await self.ticket_crud.get_ticket(ticket_id, reload=True, load='passengers')
+            previous_status = ticket.status
             
             if ticket.status == TicketStatusEnum.CANCELLED:
                 return  None
             
-            for passenger in ticket.passengers:
-                if passenger.berth_id:
-                    self.berth_crud.update_berth_availability(passenger.berth_id, True)
+            segments = segment_mask(ticket.from_stop, ticket.to_stop)
+            released = {passenger.berth_id: segments for passenger in ticket.passengers if passenger.berth_id}
+            freed_berth_ids = await self.berth_crud.release_berths(released, journey_date)
+            await self.ticket_crud.update_tickets_status([ticket_id], TicketStatusEnum.CANCELLED, journey_date)
+            route.reserve(previous_status, ticket.from_stop, ticket.to_stop, -1)
+            await self.counter_crud.apply_deltas(train_id, journey_date, {previous_status: -1}, route.deltas, freed_berth_ids=freed_berth_ids)
             
-            self.ticket_crud.update_ticket_status(ticket_id, TicketStatusEnum.CANCELLED)
+            # Promotions are owed, not run: the outbox event commits with the
+            # cancellation and the promotion worker settles it
+            promotion_owed = previous_status in [TicketStatusEnum.CONFIRMED, TicketStatusEnum.RAC]
+            if promotion_owed:
+                await self.promotion_crud.add_event(train_id, journey_date, ticket_id)
+            
+            await self.session.commit()
+            train_cache.discard(train_id, journey_date)
+            
+            berth_inventory.apply(train_id, journey_date, freed=released)
+            if promotion_owed:
+                promotion_worker.wake()
             
-            if ticket_ref.status == TicketStatusEnum.CONFIRMED:
-                await self.manager.promote_rac_to_confirmed(ticket.train_id)
-                await self.manager.promote_waiting_to_rac(ticket.train_id)
-            elif ticket_ref.status == TicketStatusEnum.RAC:
-                await self.manager.promote_waiting_to_rac(ticket.train_id)
-                
         except SQLAlchemyError as e:
-            print(e)
-            self.session.rollback()
+            logger.exception("Cancelling ticket %s failed", ticket_id)
+            await self.session.rollback()
             raise e
-        
\ No newline at end of file
@@ -0,0 +1,115 @@
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import date
+import json
+import logging
+from typing import AsyncIterator, Dict, Set, Tuple
+import asyncpg
+from app.conf.settings import settings
+from app.database.crud.tickets import AVAILABILITY_CHANNEL
+
+
+logger = logging.getLogger(__name__)
+
+# Queued to a subscriber in place of changes it can no longer follow: it
+# fell too far behind, or the LISTEN connection was lost
+RESYNC = None
+
+
+def availability_delta(change: dict, total: dict) -> dict:
+    """
+    Client-facing delta of a published ``change``, with end to end counts
+    shaped like /available's: what the busiest segment leaves.
+    """
+    return {
+        'version': change['version'],
+        'available': {
+            'confirmed': max(0, total['confirmed'] - max(change['confirmed_segments'])),
+            'rac': max(0, total['rac'] - max(change['rac_segments'])),
+            'waiting_list': max(0, total['waiting_list'] - max(change['waiting_segments']))
+        },
+        'taken': change['taken'],
+        'freed': change['freed']
+    }
+
+
+class AvailabilityHub:
+    """
+    Fans the availability changes of every worker out to the streams of
+    this one. Writers publish on AVAILABILITY_CHANNEL when they commit; the
+    hub holds a single LISTEN connection per worker, opened on the first
+    subscription, and hands each change to the subscribers of its run.
+    """
+    def __init__(self, queue_size: int = 256) -> None:
+        self.queue_size = queue_size
+        self._subscribers: Dict[Tuple[int, date], Set[asyncio.Queue]] = defaultdict(set)
+        self._connection: asyncpg.Connection | None = None
+        self._connecting = asyncio.Lock()
+
+    async def listen(self) -> None:
+        if self._connection is not None and not self._connection.is_closed():
+            return
+        async with self._connecting:
+            if self._connection is not None and not self._connection.is_closed():
+                return
+            # Outside the pool: a LISTEN connection is held for good
+            connection = await asyncpg.connect(
+                user=settings.POSTGRES_USER,
+                password=settings.POSTGRES_PASSWORD,
+                host=settings.POSTGRES_HOST,
+                port=settings.POSTGRES_PORT,
+                database=settings.POSTGRES_DB
+            )
+            await connection.add_listener(AVAILABILITY_CHANNEL, self._on_change)
+            connection.add_termination_listener(self._on_lost)
+            self._connection = connection
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    @asynccontextmanager
+    async def subscribe(self, train_id: int, journey_date: date) -> AsyncIterator[asyncio.Queue]:
+        """Queue of the changes to a run committed from now on, until exit."""
+        await self.listen()
+        run = (train_id, journey_date)
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers[run].add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(run)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[run]
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def _on_change(self, connection, pid: int, channel: str, payload: str) -> None:
+        change = json.loads(payload)
+        run = (change['train_id'], date.fromisoformat(change['journey_date']))
+        for queue in self._subscribers.get(run, ()):
+            self._put(queue, change)
+
+    def _on_lost(self, connection) -> None:
+        logger.warning("Availability LISTEN connection lost, subscribers resync")
+        self._connection = None
+        for subscribers in self._subscribers.values():
+            for queue in subscribers:
+                self._put(queue, RESYNC)
+
+    @staticmethod
+    def _put(queue: asyncio.Queue, change: dict | None) -> None:
+        if queue.full():
+            # Whatever is queued is superseded by a fresh snapshot
+            while not queue.empty():
+                queue.get_nowait()
+            change = RESYNC
+        queue.put_nowait(change)
+
+
+availability_hub = AvailabilityHub()
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Tuple
+from app.conf.settings import settings
+
+
+@dataclass(frozen=True)
+class CachedTrain:
+    version: int | None
+    body: bytes
+    etag: str | None
+
+
+class TrainCache:
+    """
+    Serialized ``TrainOut`` bodies of this worker, one per run, least
+    recently used first.
+
+    Entries are tagged with the ``train_counters.version`` of their run they
+    were built at. Every booking, cancellation and promotion bumps that
+    version in its own transaction, so an entry is only served while it
+    still matches the database, whichever worker made the write.
+    """
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._runs: OrderedDict[Tuple[int, date], CachedTrain] = OrderedDict()
+
+    def get(self, train_id: int, journey_date: date, version: int) -> CachedTrain | None:
+        cached = self._runs.get((train_id, journey_date))
+        if cached is None or cached.version != version:
+            return None
+        self._runs.move_to_end((train_id, journey_date))
+        return cached
+
+    def put(self, train_id: int, journey_date: date, version: int, body: bytes) -> CachedTrain:
+        cached = CachedTrain(version=version, body=body, etag=f'"{train_id}-{journey_date.isoformat()}-{version}"')
+        if self.max_size <= 0:
+            return cached
+        self._runs[(train_id, journey_date)] = cached
+        self._runs.move_to_end((train_id, journey_date))
+        while len(self._runs) > self.max_size:
+            self._runs.popitem(last=False)
+        return cached
+
+    def discard(self, train_id: int, journey_date: date | None = None) -> None:
+        """Drops the body of one run, or of every run of the train without ``journey_date``."""
+        if journey_date is not None:
+            self._runs.pop((train_id, journey_date), None)
+            return
+        for key in [key for key in self._runs if key[0] == train_id]:
+            del self._runs[key]
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
+train_cache = TrainCache(settings.TRAIN_CACHE_SIZE)
@@ -0,0 +1,16 @@
+from fastapi import status, HTTPException
+from typing import Any, Dict
+
+
+class InvalidFleetFile(HTTPException):
+    def __init__(
+        self, 
+        status_code: int = status.HTTP_400_BAD_REQUEST, 
+        detail: Any = "Fleet file could not be parsed", 
+        headers: Dict[str, str] | None = None
+        ) -> None:
+        super().__init__(
+            status_code,
+            detail,
+            headers
+        )
@@ -0,0 +1,72 @@
+import csv
+from datetime import datetime
+from enum import Enum
+import io
+import json
+import os
+from typing import Any, Iterable, Iterator, Sequence, TextIO, Union
+import orjson
+
+
+FLEET_FORMATS = {'.csv': 'csv', '.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+MANIFEST_COLUMNS = ['pnr', 'status', 'created_at', 'name', 'age', 'gender', 'coach', 'berth_number', 'berth_type', 'from_stop', 'to_stop']
+
+
+def fleet_format(filename: str | None, format: str | None = None) -> str:
+    if format:
+        return format
+    extension = os.path.splitext(filename or '')[1].lower()
+    return FLEET_FORMATS.get(extension, 'ndjson')
+
+
+def iter_fleet_rows(file: TextIO, format: str) -> Iterator[Union[dict, str]]:
+    """
+    Yields one train per row of a fleet file. CSV and NDJSON are read line by
+    line, NDJSON lines are yielded raw for the schema to parse. A JSON
+    document has to be a list of trains and is parsed whole, so prefer NDJSON
+    for very large fleets.
+    """
+    if format == 'csv':
+        for row in csv.DictReader(file):
+            # Empty cells fall back to the schema defaults
+            yield {key: value for key, value in row.items() if value not in ('', None)}
+    elif format == 'json':
+        yield from json.load(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield line
+
+
+def manifest_value(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def manifest_ndjson(rows: Iterable[Sequence]) -> str:
+    return ''.join(
+        json.dumps(dict(zip(MANIFEST_COLUMNS, map(manifest_value, row)))) + '\n'
+        for row in rows
+    )
+
+
+def manifest_csv(rows: Iterable[Sequence], header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(MANIFEST_COLUMNS)
+    writer.writerows([manifest_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+def sse_event(event: str, data: Any, id: int | None = None) -> str:
+    """One Server-Sent Events message; ``data`` is sent as a single JSON line."""
+    lines = [f'event: {event}']
+    if id is not None:
+        lines.append(f'id: {id}')
+    lines.append(f"data: {orjson.dumps(data).decode()}")
+    return '\n'.join(lines) + '\n\n'
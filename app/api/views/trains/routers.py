@@ -1,31 +1,88 @@
+from datetime import date
 from typing import List
-from fastapi import APIRouter, status
-from app.api.views.trains.schemas import CreateTrain, TrainOut, AllTrainOut
+import io
+from fastapi import APIRouter, Header, Query, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
+from app.api.views.trains.cache import etag_matches
+from app.api.views.trains.helpers import fleet_format, iter_fleet_rows
+from app.api.views.trains.schemas import CreateTrain, FleetImportOut, OpenRuns, OpenRunsOut, TrainOut, AllTrainOut
 from app.api.views.trains.services import TrainService
-from app.database.deps import db_dependency
+from app.database.deps import db_dependency, read_db_dependency
 
 
 router = APIRouter()
 
 @router.get('', status_code=status.HTTP_200_OK, response_model=List[AllTrainOut])
 async def get_trains(
-    session: db_dependency, 
-    page: int = 1, 
-    page_size: int = 10
+    session: read_db_dependency, 
+    response: Response,
+    cursor: str | None = None, 
+    page_size: int = Query(10, ge=1, le=500),
+    with_total: bool = False
     ):
     
     service = TrainService(session)
-    return await service.get_trains(page, page_size)
+    trains, next_cursor, total = await service.get_trains(cursor, page_size, with_total)
+    # The body stays a plain list, paging details travel in headers
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    if total is not None:
+        response.headers['X-Total-Count'] = str(total)
+    return trains
 
 
 @router.get('/{train_id}', status_code=status.HTTP_200_OK, response_model=TrainOut)
 async def get_train(
-    session: db_dependency, 
-    train_id: int
+    session: read_db_dependency, 
+    train_id: int,
+    journey_date: date | None = Query(None, description="Day of the run, today (UTC) by default"),
+    if_none_match: str | None = Header(None)
+    ):
+    
+    service = TrainService(session)
+    cached = await service.get_train(train_id, journey_date)
+    # Clients must revalidate, but an unchanged train costs them a 304 only
+    headers = {'Cache-Control': 'no-cache'}
+    if cached.etag is not None:
+        headers['ETag'] = cached.etag
+    if cached.etag is not None and etag_matches(if_none_match, cached.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=cached.body, media_type='application/json', headers=headers)
+
+
+@router.get('/{train_id}/manifest', status_code=status.HTTP_200_OK)
+async def get_manifest(
+    session: read_db_dependency, 
+    train_id: int,
+    format: str = Query('ndjson', pattern='^(ndjson|csv)$'),
+    include_cancelled: bool = False,
+    journey_date: date | None = Query(None, description="Day of the run, today (UTC) by default")
     ):
     
     service = TrainService(session)
-    return await service.get_train(train_id)
+    chunks = await service.get_manifest(train_id, format, include_cancelled, journey_date)
+    return StreamingResponse(
+        chunks,
+        media_type='text/csv' if format == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="train-{train_id}-manifest.{format}"'}
+    )
+
+
+@router.get('/{train_id}/availability/stream', status_code=status.HTTP_200_OK)
+async def stream_availability(
+    session: read_db_dependency, 
+    train_id: int,
+    journey_date: date | None = Query(None, description="Day of the run, today (UTC) by default")
+    ):
+    
+    service = TrainService(session)
+    events = await service.stream_availability(train_id, journey_date=journey_date)
+    return StreamingResponse(
+        events,
+        media_type='text/event-stream',
+        # Proxies must pass events on as they come
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 
 @router.post('', status_code=status.HTTP_201_CREATED, response_model=TrainOut)
@@ -38,6 +95,31 @@ async def create_train(
     return await service.create_train(payload)
 
 
+@router.post('/import', status_code=status.HTTP_200_OK, response_model=FleetImportOut)
+async def import_fleet(
+    session: db_dependency,
+    file: UploadFile,
+    format: str | None = Query(None, pattern='^(csv|json|ndjson)$'),
+    chunk_size: int = Query(500, ge=1, le=10000)
+    ):
+    
+    service = TrainService(session)
+    # The upload is spooled to disk and parsed row by row
+    rows = iter_fleet_rows(io.TextIOWrapper(file.file, encoding='utf-8'), fleet_format(file.filename, format))
+    return await service.import_fleet(rows, chunk_size)
+
+
+@router.post('/runs', status_code=status.HTTP_200_OK, response_model=OpenRunsOut)
+async def open_runs(
+    session: db_dependency,
+    payload: OpenRuns,
+    chunk_size: int = Query(100, ge=1, le=10000)
+    ):
+    
+    service = TrainService(session)
+    return await service.open_runs(payload, chunk_size)
+
+
 @router.delete('/{train_id}', status_code=status.HTTP_204_NO_CONTENT)
 async def delete_train(
     session: db_dependency, 
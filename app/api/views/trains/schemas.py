@@ -1,6 +1,8 @@
+from datetime import date
 from typing import List
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 
+from app.database.crud.tickets import MAX_SEGMENTS
 from app.database.models.tickets import BerthTypeEnum
 
 
@@ -9,6 +11,32 @@ class CreateTrain(BaseModel):
     total_confirmed_berths: int = 63
     total_rac_berths: int = 9
     total_waiting_list: int = 10
+    # Station codes in running order; without them only end to end
+    # journeys are sold
+    stations: List[str] = Field(default_factory=list, max_length=MAX_SEGMENTS + 1)
+    
+    @field_validator('stations')
+    @classmethod
+    def check_stations(cls, stations: List[str]) -> List[str]:
+        if len(stations) == 1:
+            raise ValueError("A route needs at least two stations")
+        if len(set(stations)) != len(stations):
+            raise ValueError("A route cannot call at a station twice")
+        return stations
+
+
+class ImportTrain(CreateTrain):
+    total_confirmed_berths: int = Field(63, ge=0)
+    total_rac_berths: int = Field(9, ge=1)
+    total_waiting_list: int = Field(10, ge=0)
+    
+    @field_validator('stations', mode='before')
+    @classmethod
+    def split_stations(cls, stations):
+        # CSV cells hold the route as NDLS|CNB|PRYJ
+        if isinstance(stations, str):
+            return [station.strip() for station in stations.split('|') if station.strip()]
+        return stations
 
 
 class AllTrainOut(CreateTrain):
@@ -25,6 +53,8 @@ class BerthOut(BaseModel):
 
 class TrainOut(CreateTrain):
     id: int
+    # The run the berths belong to
+    journey_date: date
     berths: List[BerthOut]
     
 
@@ -32,4 +62,34 @@ class UpdateTrain(BaseModel):
     name: str | None
     total_confirmed_berths: int | None
     total_rac_berths: int | None
-    total_waiting_list: int | None
\ No newline at end of file
+    total_waiting_list: int | None
+
+
+class FleetImportError(BaseModel):
+    row: int
+    detail: str
+
+
+class FleetImportOut(BaseModel):
+    trains: int = 0
+    berths: int = 0
+    skipped: int = 0
+    errors: List[FleetImportError] = []
+    seconds: float = 0
+    rows_per_second: float = 0
+
+
+class OpenRuns(BaseModel):
+    # Booking opens on ``days`` days in a row from ``start_date``, today (UTC)
+    # when left out, for ``train_ids`` or every train
+    days: int = Field(30, ge=1, le=366)
+    start_date: date | None = None
+    train_ids: List[int] | None = None
+
+
+class OpenRunsOut(BaseModel):
+    runs: int = 0
+    berths: int = 0
+    partitions: List[str] = []
+    seconds: float = 0
+    rows_per_second: float = 0
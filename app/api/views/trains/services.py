@@ -1,40 +1,261 @@
 from abc import ABC, abstractmethod
-from sqlalchemy.orm import Session
-from app.api.views.trains.schemas import CreateTrain
-from app.database.crud.tickets import TrainCrud
+import asyncio
+import csv
+from datetime import date, timedelta
+import time
+from typing import AsyncIterator, Iterable, Union
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.views.tickets.inventory import berth_inventory
+from app.api.views.tickets.services import TicketService
+from app.api.views.trains.availability import RESYNC, availability_delta, availability_hub
+from app.api.views.trains.cache import CachedTrain, train_cache
+from app.api.views.trains.exceptions import InvalidFleetFile
+from app.api.views.trains.helpers import manifest_csv, manifest_ndjson, sse_event
+from app.api.views.trains.schemas import AllTrainOut, CreateTrain, ImportTrain, OpenRuns, TrainOut
+from app.database.crud.tickets import TicketCrud, TrainCounterCrud, TrainCrud, TrainRunCrud
+from app.database.models.base import utc_today
+from app.database.models.tickets import TrainRunModel
+from app.database.partitions import ensure_partitions
+from app.database.sessions import AsyncSessionLocal
+
+
+def train_out(run: TrainRunModel) -> TrainOut:
+    """The train of ``run`` with the berths of that run."""
+    return TrainOut.model_validate({
+        **AllTrainOut.model_validate(run.train, from_attributes=True).model_dump(),
+        'journey_date': run.journey_date,
+        'berths': run.berths
+    }, from_attributes=True)
 
 
 class _TrainService(ABC):
     @abstractmethod
-    async def get_trains(self, page: int = 1, page_size: int = 10):
+    async def get_trains(self, cursor: str | None = None, page_size: int = 10, with_total: bool = False):
         pass
     
     @abstractmethod
-    async def get_train(self, train_id: int):
+    async def get_train(self, train_id: int, journey_date: date | None = None) -> CachedTrain:
         pass
     
     @abstractmethod
     async def create_train(self, payload: CreateTrain):
         pass
     
+    @abstractmethod
+    async def get_manifest(self, train_id: int, format: str = 'ndjson', include_cancelled: bool = False, journey_date: date | None = None) -> AsyncIterator[str]:
+        pass
+    
+    @abstractmethod
+    async def stream_availability(self, train_id: int, heartbeat: float = 15, journey_date: date | None = None) -> AsyncIterator[str]:
+        pass
+    
+    @abstractmethod
+    async def import_fleet(self, rows: Iterable[Union[dict, str]], chunk_size: int = 500):
+        pass
+    
+    @abstractmethod
+    async def open_runs(self, payload: OpenRuns, chunk_size: int = 100):
+        pass
+    
     @abstractmethod
     async def delete_train(self, train_id: int):
         pass
     
 
 class TrainService(_TrainService):
-    def __init__(self, session: Session) -> None:
+    def __init__(self, session: AsyncSession) -> None:
         self.crud = TrainCrud(session)
+        self.run_crud = TrainRunCrud(session)
+        self.counter_crud = TrainCounterCrud(session)
         self.session = session
     
-    async def get_train(self, train_id: int):
-        return self.crud.get_train(train_id)
+    async def get_train(self, train_id: int, journey_date: date | None = None) -> CachedTrain:
+        journey_date = journey_date or utc_today()
+        version = await self.counter_crud.get_version(train_id, journey_date)
+        if version is None:
+            # Missing run (404) or a run without a counters row yet, which
+            # the first write creates: served untagged and uncached meanwhile
+            run = await self.run_crud.get_run(train_id, journey_date, with_berths=True)
+            return CachedTrain(version=None, body=train_out(run).model_dump_json().encode(), etag=None)
+        
+        cached = train_cache.get(train_id, journey_date, version)
+        if cached is None:
+            # Read after the version: the body is never older than its tag
+            run = await self.run_crud.get_run(train_id, journey_date, with_berths=True)
+            body = train_out(run).model_dump_json().encode()
+            cached = train_cache.put(train_id, journey_date, version, body)
+        return cached
     
-    async def get_trains(self, page: int = 1, page_size: int = 10):
-        return self.crud.get_trains(page, page_size)
+    async def get_trains(self, cursor: str | None = None, page_size: int = 10, with_total: bool = False):
+        trains, next_cursor = await self.crud.get_trains(cursor, page_size)
+        total = await self.crud.estimated_count() if with_total else None
+        return trains, next_cursor, total
     
     async def create_train(self, payload: CreateTrain):
-        return self.crud.create_train(payload.model_dump())
+        return train_out(await self.crud.create_train(payload.model_dump()))
+    
+    async def get_manifest(self, train_id: int, format: str = 'ndjson', include_cancelled: bool = False, journey_date: date | None = None) -> AsyncIterator[str]:
+        journey_date = journey_date or utc_today()
+        # Checked up front, so a missing run is a 404 rather than an empty stream
+        await self.run_crud.get_run(train_id, journey_date)
+        return self._stream_manifest(train_id, journey_date, format, include_cancelled)
+    
+    async def _stream_manifest(self, train_id: int, journey_date: date, format: str, include_cancelled: bool) -> AsyncIterator[str]:
+        # The request session is closed before a streamed body is sent, so the
+        # export reads through a session of its own, from a replica if any
+        async with AsyncSessionLocal(info={'read_only': True}) as session:
+            if format == 'csv':
+                yield manifest_csv([], header=True)
+            async for rows in TicketCrud(session).stream_manifest(train_id, journey_date, include_cancelled):
+                yield manifest_csv(rows) if format == 'csv' else manifest_ndjson(rows)
+    
+    async def stream_availability(self, train_id: int, heartbeat: float = 15, journey_date: date | None = None) -> AsyncIterator[str]:
+        """
+        Server-Sent Events of the availability of a run: a ``snapshot``
+        shaped like /available's response plus its version, then a ``delta``
+        per committed change, with the new counts and the berths taken and
+        freed. Event ids are versions. A delta that does not follow on from
+        the last version sent is replaced by a fresh snapshot, so clients
+        only ever apply deltas in order. Comments keep idle streams open.
+        """
+        journey_date = journey_date or utc_today()
+        await self.run_crud.get_run(train_id, journey_date)
+        return self._stream_availability(train_id, journey_date, heartbeat)
+    
+    async def _stream_availability(self, train_id: int, journey_date: date, heartbeat: float) -> AsyncIterator[str]:
+        # Subscribed before the snapshot is read, so no change falls in between
+        async with availability_hub.subscribe(train_id, journey_date) as changes:
+            snapshot = await self._availability_snapshot(train_id, journey_date)
+            version = snapshot['version']
+            yield sse_event('snapshot', snapshot, version)
+            
+            while True:
+                try:
+                    async with asyncio.timeout(heartbeat):
+                        change = await changes.get()
+                except TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                
+                if change is not RESYNC and change['version'] <= version:
+                    # Already in the snapshot
+                    continue
+                if change is RESYNC or change['version'] > version + 1 or change['taken'] is None:
+                    await availability_hub.listen()
+                    snapshot = await self._availability_snapshot(train_id, journey_date)
+                    version = snapshot['version']
+                    yield sse_event('snapshot', snapshot, version)
+                    continue
+                
+                version = change['version']
+                yield sse_event('delta', availability_delta(change, snapshot['total']), version)
+    
+    async def _availability_snapshot(self, train_id: int, journey_date: date) -> dict:
+        # The request session is closed before a streamed body is sent. The
+        # version is read first: the counts may be newer than it but never
+        # older, and replaying a delta over newer counts changes nothing
+        async with AsyncSessionLocal() as session:
+            version = await TrainCounterCrud(session).get_version(train_id, journey_date)
+            available = await TicketService(session).get_available_tickets(train_id, as_rows=True, journey_date=journey_date)
+        return {'version': version or 0, **available}
+    
+    async def import_fleet(self, rows: Iterable[Union[dict, str]], chunk_size: int = 500):
+        """
+        Imports trains from ``rows`` in chunks of ``chunk_size``, each COPYed
+        and committed in its own transaction. Invalid rows are skipped and
+        reported; chunks committed before a database error stay imported.
+        """
+        report = {'trains': 0, 'berths': 0, 'skipped': 0, 'errors': []}
+        started = time.perf_counter()
+        chunk = []
+        
+        async def flush():
+            try:
+                trains, berths = await self.crud.copy_trains(chunk)
+                await self.session.commit()
+            except Exception:
+                await self.session.rollback()
+                raise
+            report['trains'] += trains
+            report['berths'] += berths
+            chunk.clear()
+        
+        rows, end = iter(rows), object()
+        index = 0
+        while True:
+            try:
+                row = next(rows, end)
+            except (ValueError, csv.Error) as e:
+                # Malformed JSON document, CSV or encoding: nothing more can be read
+                raise InvalidFleetFile(detail=f"Fleet file could not be parsed after row {index}: {e}")
+            if row is end:
+                break
+            index += 1
+            
+            try:
+                if isinstance(row, str):
+                    train = ImportTrain.model_validate_json(row)
+                else:
+                    train = ImportTrain.model_validate(row)
+            except ValidationError as e:
+                report['skipped'] += 1
+                if len(report['errors']) < 100:
+                    error = e.errors()[0]
+                    location = '.'.join(str(part) for part in error['loc'])
+                    report['errors'].append({'row': index, 'detail': f"{location}: {error['msg']}" if location else error['msg']})
+                continue
+            
+            chunk.append(train.model_dump())
+            if len(chunk) >= chunk_size:
+                await flush()
+        if chunk:
+            await flush()
+        
+        report['seconds'] = round(time.perf_counter() - started, 3)
+        # Trains, runs, berths and counters rows
+        rows_written = report['trains'] * 3 + report['berths']
+        report['rows_per_second'] = round(rows_written / report['seconds'], 1) if report['seconds'] else 0
+        return report
+    
+    async def open_runs(self, payload: OpenRuns, chunk_size: int = 100):
+        """
+        Opens booking on ``payload.days`` days in a row. The monthly
+        partitions those days fall in are created and committed first, so
+        the parent tables are only locked for as long as that takes; then
+        runs are opened a date and ``chunk_size`` trains at a time, each
+        chunk COPYed and committed in its own transaction. Runs already open
+        are skipped, so a rerun picks up where a failed one stopped.
+        """
+        first = payload.start_date or utc_today()
+        journey_dates = [first + timedelta(days=day) for day in range(payload.days)]
+        report = {'runs': 0, 'berths': 0}
+        started = time.perf_counter()
+        
+        report['partitions'] = await ensure_partitions(self.session, journey_dates[0], journey_dates[-1])
+        await self.session.commit()
+        
+        after_id = 0
+        while trains := await self.crud.get_train_layouts(payload.train_ids, after_id, chunk_size):
+            after_id = trains[-1][0]
+            for journey_date in journey_dates:
+                try:
+                    runs, berths = await self.run_crud.open_runs(trains, [journey_date])
+                    await self.session.commit()
+                except Exception:
+                    await self.session.rollback()
+                    raise
+                report['runs'] += runs
+                report['berths'] += berths
+        
+        report['seconds'] = round(time.perf_counter() - started, 3)
+        # Runs, counters and berths rows
+        rows_written = report['runs'] * 2 + report['berths']
+        report['rows_per_second'] = round(rows_written / report['seconds'], 1) if report['seconds'] else 0
+        return report
     
     async def delete_train(self, train_id: int):
-        return self.crud.delete_train(train_id)
\ No newline at end of file
+        deleted = await self.crud.delete_train(train_id)
+        berth_inventory.discard(train_id)
+        train_cache.discard(train_id)
+        return deleted
\ No newline at end of file
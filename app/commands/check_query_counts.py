@@ -0,0 +1,89 @@
+"""
+Query budget check for the ticket endpoints.
+
+Drives the API in-process against the configured database, inside a
+transaction that is rolled back at the end, and counts the statements each
+request sends. Reads must stay within a fixed number of queries whatever the
+page or batch size, so a lazy load sneaking into serialization shows up as a
+failure here (exit status 1).
+
+    python -m app.commands.check_query_counts
+"""
+import asyncio
+import sys
+import httpx
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.deps import get_db, get_read_db
+from app.database.query_counter import QueryCounter
+from app.database.sessions import async_engine
+from app.main import app
+
+
+# Statements per request, with the train's berth inventory already loaded
+QUERY_BUDGETS = {
+    'GET /v1/tickets/booked': 2,
+    'GET /v1/tickets/booked?with_total': 3,
+    'POST /v1/tickets/book': 9,
+    'POST /v1/tickets/book/batch': 9,
+    'GET /v1/trains/{train_id}': 3,
+    'GET /v1/trains/{train_id} (cached)': 1,
+}
+
+
+def passengers(count: int):
+    return [{'name': f"Passenger {index}", 'age': 30, 'gender': 'male'} for index in range(count)]
+
+
+async def check_query_counts() -> int:
+    failures = 0
+    async with async_engine.connect() as connection:
+        transaction = await connection.begin()
+        session = AsyncSession(bind=connection, join_transaction_mode="create_savepoint", expire_on_commit=False)
+        app.dependency_overrides[get_db] = lambda: session
+        app.dependency_overrides[get_read_db] = lambda: session
+
+        async def measure(label: str, variants: dict, request):
+            nonlocal failures
+            counts = {}
+            for variant, argument in variants.items():
+                with QueryCounter(connection) as queries:
+                    response = await request(argument)
+                response.raise_for_status()
+                counts[variant] = queries.count
+
+            budget = QUERY_BUDGETS[label]
+            failed = any(count > budget for count in counts.values())
+            failures += failed
+            print(f"{'FAIL' if failed else 'ok  '} {label}: budget {budget}, " + ", ".join(f"{variant}: {count}" for variant, count in counts.items()))
+
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://check/api") as client:
+                train = (await client.post('/v1/trains', json={'name': 'Query budget express'})).json()
+                train_id = train['id']
+                for _ in range(30):
+                    await client.post('/v1/tickets/book', json={'train_id': train_id, 'passengers': passengers(1)})
+
+                await measure('GET /v1/tickets/booked', {'page_size=1': 1, 'page_size=5': 5, 'page_size=30': 30},
+                              lambda size: client.get('/v1/tickets/booked', params={'train_id': train_id, 'page_size': size}))
+                await measure('GET /v1/tickets/booked?with_total', {'page_size=1': 1, 'page_size=30': 30},
+                              lambda size: client.get('/v1/tickets/booked', params={'train_id': train_id, 'page_size': size, 'with_total': True}))
+                await measure('POST /v1/tickets/book', {'1 passenger': 1, '4 passengers': 4},
+                              lambda count: client.post('/v1/tickets/book', json={'train_id': train_id, 'passengers': passengers(count)}))
+                await measure('POST /v1/tickets/book/batch', {'1 booking': 1, '10 bookings': 10},
+                              lambda count: client.post('/v1/tickets/book/batch', json={'bookings': [
+                                  {'train_id': train_id, 'passengers': passengers(1)} for _ in range(count)
+                              ]}))
+                await measure('GET /v1/trains/{train_id}', {'train': train_id},
+                              lambda train_id: client.get(f'/v1/trains/{train_id}'))
+                await measure('GET /v1/trains/{train_id} (cached)', {'train': train_id},
+                              lambda train_id: client.get(f'/v1/trains/{train_id}'))
+        finally:
+            app.dependency_overrides.pop(get_db, None)
+            app.dependency_overrides.pop(get_read_db, None)
+            await session.close()
+            await transaction.rollback()
+    return failures
+
+
+if __name__ == '__main__':
+    sys.exit(1 if asyncio.run(check_query_counts()) else 0)
@@ -0,0 +1,38 @@
+"""
+Archives past runs. The monthly partitions of passengers, tickets and
+berths wholly before --before are detached, which is a catalog change
+however many rows they hold, then the runs of those months are deleted
+along with their counters and promotion events. Detached tables stay in
+the database, under their partition names, unless --drop is given:
+
+    python -m app.commands.detach_runs --before 2024-05-01
+    python -m app.commands.detach_runs --before 2024-05-01 --drop
+"""
+import argparse
+import asyncio
+from datetime import date
+import sqlalchemy as sa
+from app.database.models.tickets import TrainRunModel
+from app.database.partitions import detach_partitions, month_start
+from app.database.sessions import AsyncSessionLocal
+
+
+async def detach_runs(before: date, drop: bool = False):
+    async with AsyncSessionLocal() as session:
+        detached = await detach_partitions(session, before)
+        deleted = await session.execute(
+            sa.delete(TrainRunModel).where(TrainRunModel.journey_date < month_start(before))
+        )
+        for name in detached if drop else ():
+            await session.execute(sa.text(f"DROP TABLE {name}"))
+        await session.commit()
+    return detached, deleted.rowcount
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Detach the partitions of past runs")
+    parser.add_argument('--before', type=date.fromisoformat, required=True)
+    parser.add_argument('--drop', action='store_true')
+    args = parser.parse_args()
+    detached, runs = asyncio.run(detach_runs(args.before, args.drop))
+    print(f"{'Dropped' if args.drop else 'Detached'} {len(detached)} partitions: {', '.join(detached) or 'none'}; deleted {runs} runs")
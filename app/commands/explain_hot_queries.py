@@ -0,0 +1,166 @@
+"""
+Query plan regression check for the booking hot path.
+
+Seeds a train run with tickets inside a transaction, runs every CRUD method the
+booking, cancellation and listing flows use, and EXPLAINs each statement they
+send with sequential scans disabled. A ``Seq Scan`` (or an unbounded index scan
+with no index condition) on a hot table means the query has no usable index,
+so the command exits non-zero. Everything is rolled back afterwards.
+
+    python -m app.commands.explain_hot_queries
+    python -m app.commands.explain_hot_queries --verbose   # print every plan
+"""
+import argparse
+import asyncio
+from datetime import date
+import json
+import sys
+from typing import List, Tuple
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from app.database.crud.tickets import BerthCrud, PassengerCrud, TicketCrud, TrainCounterCrud, TrainCrud, TrainRunCrud
+from app.database.models.tickets import BerthTypeEnum, GenderEnum, TicketStatusEnum
+from app.database.partitions import PARTITION_NAME
+from app.database.sessions import async_engine
+
+
+HOT_TABLES = {'berths', 'tickets', 'passengers', 'train_counters', 'train_runs'}
+FULL_SCAN_NODES = {'Index Scan', 'Index Only Scan'}
+
+
+class StatementRecorder:
+    """Collects the SQL a connection sends while ``recording`` is set."""
+    def __init__(self, connection: AsyncConnection) -> None:
+        self.recording: str | None = None
+        self.statements: List[Tuple[str, str, tuple]] = []
+        event.listen(connection.sync_connection, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if self.recording and not executemany:
+            self.statements.append((self.recording, statement, tuple(parameters or ())))
+
+
+def full_scans(plan: dict) -> List[str]:
+    """Hot-table scan nodes of ``plan`` that read the whole relation."""
+    found = []
+    relation = plan.get('Relation Name')
+    # Partitions are scanned in place of their table
+    partition = PARTITION_NAME.match(relation or '')
+    if partition:
+        relation = partition[1]
+    if relation in HOT_TABLES:
+        if plan['Node Type'] == 'Seq Scan':
+            found.append(f"Seq Scan on {relation}")
+        elif plan['Node Type'] in FULL_SCAN_NODES and 'Index Cond' not in plan:
+            found.append(f"{plan['Node Type']} using {plan['Index Name']} without an index condition")
+    for child in plan.get('Plans', ()):
+        found.extend(full_scans(child))
+    return found
+
+
+async def seed(session: AsyncSession):
+    run = await TrainCrud(session).create_train({
+        'name': 'Plan check express',
+        'total_confirmed_berths': 63,
+        'total_rac_berths': 9,
+        'total_waiting_list': 10
+    })
+    ticket_ids = await TicketCrud(session).insert_tickets([
+        {'pnr': f"PLAN{index:04d}", 'status': status, 'train_id': run.train_id, 'journey_date': run.journey_date}
+        for index, status in enumerate([TicketStatusEnum.CONFIRMED, TicketStatusEnum.RAC, TicketStatusEnum.WAITING_LIST] * 4)
+    ])
+    await PassengerCrud(session).insert_passengers([
+        {'name': f"Passenger {ticket_id}", 'age': 30, 'gender': GenderEnum.MALE, 'ticket_id': ticket_id, 'journey_date': run.journey_date, 'berth_id': None}
+        for ticket_id in ticket_ids
+    ])
+    await TrainCounterCrud(session).recompute(run.train_id, run.journey_date)
+    await session.flush()
+    return run, ticket_ids
+
+
+async def drain(batches):
+    async for _ in batches:
+        pass
+
+
+async def run_hot_queries(session: AsyncSession, recorder: StatementRecorder, train_id: int, journey_date: date, ticket_ids: List[int]):
+    run_crud = TrainRunCrud(session)
+    counter_crud = TrainCounterCrud(session)
+    berth_crud = BerthCrud(session)
+    ticket_crud = TicketCrud(session)
+    passenger_crud = PassengerCrud(session)
+
+    berth_states = await berth_crud.get_berth_states(train_id, journey_date)
+    berth_id = berth_states[0][0]
+
+    calls = [
+        ('TrainRunCrud.get_run', run_crud.get_run(train_id, journey_date, with_berths=True)),
+        ('TrainRunCrud.lock_writes', run_crud.lock_writes(train_id, journey_date)),
+        ('TrainCounterCrud.get_train_counters', counter_crud.get_train_counters(train_id, journey_date, for_update=True)),
+        ('TrainCounterCrud.apply_deltas', counter_crud.apply_deltas(train_id, journey_date, {TicketStatusEnum.CONFIRMED: 1})),
+        ('TrainCounterCrud.apply_deltas(limits)', counter_crud.apply_deltas(
+            train_id, journey_date, {TicketStatusEnum.CONFIRMED: 1}, {TicketStatusEnum.CONFIRMED: [1]}, limits={TicketStatusEnum.CONFIRMED: 1000}
+        )),
+        ('TrainCounterCrud.recompute', counter_crud.recompute(train_id, journey_date)),
+        ('BerthCrud.get_berth_states', berth_crud.get_berth_states(train_id, journey_date)),
+        ('BerthCrud.get_available_berths', berth_crud.get_available_berths(train_id, journey_date, BerthTypeEnum.LOWER, limit=1)),
+        ('BerthCrud.lock_berths', berth_crud.lock_berths([berth_id], journey_date)),
+        ('BerthCrud.claim_berths(count)', berth_crud.claim_berths(train_id, journey_date, count=2, segments=1)),
+        ('BerthCrud.claim_berths(claims)', berth_crud.claim_berths(train_id, journey_date, claims={berth_id: 1})),
+        ('BerthCrud.release_berths', berth_crud.release_berths({berth_id: 1}, journey_date)),
+        ('TicketCrud.get_ticket', ticket_crud.get_ticket(ticket_ids[0], reload=True)),
+        ('TicketCrud.get_tickets', ticket_crud.get_tickets(train_id, journey_date)),
+        ('TicketCrud.get_tickets_by_ids', ticket_crud.get_tickets_by_ids(ticket_ids[:3])),
+        ('TicketCrud.get_tickets_by_status', ticket_crud.get_tickets_by_status(train_id, journey_date, TicketStatusEnum.RAC)),
+        ('TicketCrud.get_promotion_queue', ticket_crud.get_promotion_queue(train_id, journey_date)),
+        ('TicketCrud.stream_manifest', drain(ticket_crud.stream_manifest(train_id, journey_date))),
+        ('TicketCrud.update_tickets_status', ticket_crud.update_tickets_status(ticket_ids[:1], TicketStatusEnum.CONFIRMED, journey_date)),
+    ]
+    for name, call in calls:
+        recorder.recording = name
+        await call
+    recorder.recording = None
+
+    passengers = (await ticket_crud.get_ticket(ticket_ids[0], load='passengers')).passengers
+    recorder.recording = 'PassengerCrud.assign_berths'
+    await passenger_crud.assign_berths({passengers[0].id: berth_id}, journey_date)
+    recorder.recording = None
+
+
+async def explain_hot_queries(verbose: bool = False) -> int:
+    failures = 0
+    async with async_engine.connect() as connection:
+        transaction = await connection.begin()
+        # CRUD commits only release savepoints, the outer transaction is rolled back
+        session = AsyncSession(bind=connection, join_transaction_mode="create_savepoint", expire_on_commit=False)
+        try:
+            run, ticket_ids = await seed(session)
+
+            recorder = StatementRecorder(connection)
+            await run_hot_queries(session, recorder, run.train_id, run.journey_date, ticket_ids)
+
+            raw_connection = (await connection.get_raw_connection()).driver_connection
+            await raw_connection.execute("SET LOCAL enable_seqscan = off")
+            for name, statement, parameters in recorder.statements:
+                plan = await raw_connection.fetchval(f"EXPLAIN (FORMAT JSON) {statement}", *parameters)
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                problems = full_scans(plan[0]['Plan'])
+                failures += bool(problems)
+
+                print(f"{'FAIL' if problems else 'ok  '} {name}")
+                for problem in problems:
+                    print(f"       {problem}")
+                if verbose or problems:
+                    print(f"       {' '.join(statement.split())}")
+        finally:
+            await session.close()
+            await transaction.rollback()
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="EXPLAIN the booking hot path and fail on full table scans")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(explain_hot_queries(args.verbose)) else 0)
@@ -0,0 +1,31 @@
+"""
+Bulk imports trains and their berth layouts from a fleet file, through COPY.
+
+    python -m app.commands.import_fleet fleet.ndjson
+    python -m app.commands.import_fleet fleet.csv --chunk-size 2000
+
+CSV files need a ``name`` column and may have ``total_confirmed_berths``,
+``total_rac_berths`` and ``total_waiting_list`` columns; JSON rows take the
+same keys. The format follows the file extension unless ``--format`` is given.
+"""
+import argparse
+import asyncio
+import json
+from app.api.views.trains.helpers import fleet_format, iter_fleet_rows
+from app.api.views.trains.services import TrainService
+from app.database.sessions import AsyncSessionLocal
+
+
+async def import_fleet(path: str, format: str | None = None, chunk_size: int = 500):
+    async with AsyncSessionLocal() as session:
+        with open(path, encoding='utf-8', newline='') as file:
+            return await TrainService(session).import_fleet(iter_fleet_rows(file, fleet_format(path, format)), chunk_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import trains from a CSV, JSON or NDJSON fleet file")
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=['csv', 'json', 'ndjson'], default=None)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(import_fleet(args.path, args.format, args.chunk_size)), indent=2))
@@ -0,0 +1,31 @@
+"""
+Opens booking on the coming days: one run per train and day, with its
+berths and counters, and the monthly partitions those days need. Runs
+already open are left as they are, so it is safe to run daily from cron:
+
+    python -m app.commands.open_runs --days 120
+    python -m app.commands.open_runs --days 7 --start-date 2024-06-01 --train-id 7 --train-id 9
+"""
+import argparse
+import asyncio
+from datetime import date
+import json
+from app.api.views.trains.schemas import OpenRuns
+from app.api.views.trains.services import TrainService
+from app.database.sessions import AsyncSessionLocal
+
+
+async def open_runs(payload: OpenRuns, chunk_size: int = 100):
+    async with AsyncSessionLocal() as session:
+        return await TrainService(session).open_runs(payload, chunk_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Open train runs for the next days")
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--start-date', type=date.fromisoformat, default=None)
+    parser.add_argument('--train-id', type=int, action='append', dest='train_ids', default=None)
+    parser.add_argument('--chunk-size', type=int, default=100)
+    args = parser.parse_args()
+    payload = OpenRuns(days=args.days, start_date=args.start_date, train_ids=args.train_ids)
+    print(json.dumps(asyncio.run(open_runs(payload, args.chunk_size)), indent=2))
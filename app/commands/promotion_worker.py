@@ -0,0 +1,30 @@
+"""
+Applies the promotions owed after cancellations, outside the app. Run it
+with PROMOTION_WORKER=false on the app workers, or alongside them: passes
+on the same train never overlap.
+
+    python -m app.commands.promotion_worker
+    python -m app.commands.promotion_worker --once
+"""
+import argparse
+import asyncio
+import logging
+from app.api.views.tickets.promotions import PromotionWorker
+from app.conf.settings import settings
+
+
+async def run_promotion_worker(once: bool = False) -> int | None:
+    worker = PromotionWorker(settings.PROMOTION_POLL_INTERVAL, settings.PROMOTION_RETRY_DELAY, in_process=False)
+    if once:
+        return await worker.drain()
+    await worker.run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply promotions owed after cancellations")
+    parser.add_argument('--once', action='store_true', help="Drain the outbox once and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    passes = asyncio.run(run_promotion_worker(args.once))
+    if args.once:
+        print(f"Ran {passes} promotion passes")
@@ -0,0 +1,30 @@
+"""
+Deletes expired idempotency keys. Expired keys are never replayed, so this
+only reclaims space; run it from cron as often as the table grows:
+
+    python -m app.commands.purge_idempotency_keys
+    python -m app.commands.purge_idempotency_keys --batch-size 5000
+"""
+import argparse
+import asyncio
+from app.database.crud.tickets import IdempotencyKeyCrud
+from app.database.sessions import AsyncSessionLocal
+
+
+async def purge_idempotency_keys(batch_size: int = 10000) -> int:
+    deleted = 0
+    async with AsyncSessionLocal() as session:
+        crud = IdempotencyKeyCrud(session)
+        while True:
+            count = await crud.delete_expired(batch_size)
+            await session.commit()
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Delete expired idempotency keys")
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+    print(f"Deleted {asyncio.run(purge_idempotency_keys(args.batch_size))} expired idempotency keys")
@@ -0,0 +1,26 @@
+"""
+Rebuilds the per-run ticket counters from the tickets table.
+
+    python -m app.commands.recompute_counters                                   # every run
+    python -m app.commands.recompute_counters --train-id 7                      # every run of a train
+    python -m app.commands.recompute_counters --train-id 7 --date 2024-05-01    # a single run
+"""
+import argparse
+import asyncio
+from datetime import date
+from app.database.crud.tickets import TrainCounterCrud
+from app.database.sessions import AsyncSessionLocal
+
+
+async def recompute_counters(train_id: int | None = None, journey_date: date | None = None):
+    async with AsyncSessionLocal() as session:
+        await TrainCounterCrud(session).recompute(train_id, journey_date)
+        await session.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild train_counters from tickets")
+    parser.add_argument('--train-id', type=int, default=None)
+    parser.add_argument('--date', type=date.fromisoformat, default=None, dest='journey_date')
+    args = parser.parse_args()
+    asyncio.run(recompute_counters(args.train_id, args.journey_date))
@@ -12,6 +12,12 @@ class Settings(BaseSettings):
         default=os.getenv("SECRET_KEY", "fallback-secret-key"),
     )
     
+    # Keys the PNR encoding. Never change it once tickets exist: PNRs issued
+    # under another key are not guaranteed to differ from new ones
+    PNR_KEY: str = Field(
+        default=os.getenv("PNR_KEY", "railway-pnr"),
+    )
+    
     ENV: str = Field(
         default=os.getenv("ENV", "development"),
     )
@@ -40,6 +46,96 @@ class Settings(BaseSettings):
         default=int(os.getenv("POSTGRES_PORT", "5432")),
     )
     
+    # Per engine and per worker: a worker may open up to DB_POOL_SIZE +
+    # DB_MAX_OVERFLOW connections to the primary and as many to each replica,
+    # so max_connections must cover that times the uvicorn --workers count
+    DB_POOL_SIZE: int = Field(
+        default=int(os.getenv("DB_POOL_SIZE", "10")),
+    )
+    
+    DB_MAX_OVERFLOW: int = Field(
+        default=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    )
+    
+    # Seconds a request waits for a free connection before failing
+    DB_POOL_TIMEOUT: float = Field(
+        default=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    )
+    
+    # Seconds after which a connection is replaced, -1 to keep it forever
+    DB_POOL_RECYCLE: int = Field(
+        default=int(os.getenv("DB_POOL_RECYCLE", "-1")),
+    )
+    
+    # Pings every connection on checkout, an extra round trip each time. With
+    # it off, a connection broken by a database restart fails one request
+    # and is then replaced
+    DB_POOL_PRE_PING: bool = Field(
+        default=os.getenv("DB_POOL_PRE_PING", "True").lower() == "true",
+    )
+    
+    # Streaming replicas for read-only routes, comma separated host[:port].
+    # Same database and credentials as the primary
+    POSTGRES_REPLICAS: str = Field(
+        default=os.getenv("POSTGRES_REPLICAS", ""),
+    )
+    
+    # Replicas further behind than this, in seconds, are skipped
+    REPLICA_MAX_LAG: float = Field(
+        default=float(os.getenv("REPLICA_MAX_LAG", "5")),
+    )
+    
+    REPLICA_CHECK_INTERVAL: float = Field(
+        default=float(os.getenv("REPLICA_CHECK_INTERVAL", "1")),
+    )
+    
+    # Hot read endpoints build plain rows and encode them with orjson instead
+    # of validating ORM objects through their response models
+    FAST_SERIALIZATION: bool = Field(
+        default=os.getenv("FAST_SERIALIZATION", "False").lower() == "true",
+    )
+    
+    # Bookings and cancellations of a train are queued and applied by a single
+    # writer per train, in micro-batches of up to BOOKING_ACTOR_BATCH_SIZE
+    BOOKING_ACTORS: bool = Field(
+        default=os.getenv("BOOKING_ACTORS", "False").lower() == "true",
+    )
+    
+    BOOKING_ACTOR_BATCH_SIZE: int = Field(
+        default=int(os.getenv("BOOKING_ACTOR_BATCH_SIZE", "100")),
+    )
+    
+    # Promotions owed after cancellations are applied by a background worker
+    # in every app worker; turn it off when running
+    # python -m app.commands.promotion_worker instead
+    PROMOTION_WORKER: bool = Field(
+        default=os.getenv("PROMOTION_WORKER", "True").lower() == "true",
+    )
+    
+    # Seconds between outbox polls, for events this worker was not told about
+    PROMOTION_POLL_INTERVAL: float = Field(
+        default=float(os.getenv("PROMOTION_POLL_INTERVAL", "1")),
+    )
+    
+    # Seconds before a failed promotion is retried, doubled per attempt
+    PROMOTION_RETRY_DELAY: float = Field(
+        default=float(os.getenv("PROMOTION_RETRY_DELAY", "1")),
+    )
+    
+    # Bookings sent with an Idempotency-Key header are answered from the
+    # stored first response for this long, in seconds
+    IDEMPOTENCY_KEY_TTL: int = Field(
+        default=int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400")),
+    )
+    
+    IDEMPOTENCY_CACHE_SIZE: int = Field(
+        default=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "1024")),
+    )
+    
+    TRAIN_CACHE_SIZE: int = Field(
+        default=int(os.getenv("TRAIN_CACHE_SIZE", "256")),
+    )
+    
     CLIENT_ORIGIN: str = Field(
         default=os.getenv("CLIENT_ORIGIN", "http://localhost:3000"),
     )
@@ -59,6 +155,19 @@ class Settings(BaseSettings):
             port=self.POSTGRES_PORT,
             database=self.POSTGRES_DB,
         )
+    
+    @property
+    def SQLALCHEMY_ASYNC_DATABASE_URL(self) -> URL:
+        return self.SQLALCHEMY_DATABASE_URL.set(drivername="postgresql+asyncpg")
+    
+    @property
+    def SQLALCHEMY_ASYNC_REPLICA_URLS(self) -> List[URL]:
+        urls = []
+        for replica in self.POSTGRES_REPLICAS.split(","):
+            host, _, port = replica.strip().partition(":")
+            if host:
+                urls.append(self.SQLALCHEMY_ASYNC_DATABASE_URL.set(host=host, port=int(port or self.POSTGRES_PORT)))
+        return urls
 
 
 settings = Settings()
\ No newline at end of file
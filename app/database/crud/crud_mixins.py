@@ -1,3 +1,7 @@
+import base64
+from datetime import datetime
+import json
+from typing import List, Sequence, Tuple
 from fastapi import HTTPException
 import sqlalchemy as sa
 
@@ -13,12 +17,12 @@ class BaseCrudMixin:
             detail = "Object with ID: {_id} not found!" if not detail else detail
             raise HTTPException(detail=detail.format(_id=_id), status_code=404)
         
-    def pagination(self, query, page:int = 0, page_size:int = 10):
+    async def pagination(self, stmt: sa.Select, page:int = 0, page_size:int = 10):
         if page_size:
-            query = query.limit(page_size)
+            stmt = stmt.limit(page_size)
         if page:
-            query = query.offset(page*page_size)
-        return query.all()
+            stmt = stmt.offset(page*page_size)
+        return (await self.session.execute(stmt)).scalars().all()
 
     def pagination_query(self, stmt: sa.Select, page: int = 1, page_size: int = 20):
         if page_size:
@@ -26,5 +30,45 @@ class BaseCrudMixin:
         if page - 1:
             stmt = stmt.offset((page - 1)  * page_size)
         return stmt
-            
-            
\ No newline at end of file
+
+    async def keyset_pagination(
+        self,
+        stmt: sa.Select,
+        columns: Sequence[sa.ColumnElement],
+        cursor: str | None = None,
+        page_size: int = 20,
+        scalars: bool = True
+        ) -> Tuple[List, str | None]:
+        """
+        Pages ``stmt`` on the unique ordering ``columns`` instead of OFFSET, so
+        every page costs the same no matter how deep it is. Returns the page
+        and the cursor of the next one (None on the last page). With
+        ``scalars=False`` the page holds rows, which must include ``columns``.
+        """
+        if cursor:
+            stmt = stmt.where(sa.tuple_(*columns) > sa.tuple_(*self.decode_cursor(cursor, columns)))
+        # One extra row tells whether there is a next page
+        stmt = stmt.order_by(*columns).limit(page_size + 1)
+        result = await self.session.execute(stmt)
+        items = result.scalars().all() if scalars else result.all()
+        
+        if len(items) <= page_size:
+            return items, None
+        items = items[:page_size]
+        return items, self.encode_cursor([getattr(items[-1], column.key) for column in columns])
+
+    def encode_cursor(self, values: Sequence) -> str:
+        values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor: str, columns: Sequence[sa.ColumnElement]) -> List:
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            if not isinstance(values, list) or len(values) != len(columns):
+                raise ValueError(cursor)
+            return [
+                datetime.fromisoformat(value) if column.type.python_type is datetime else column.type.python_type(value)
+                for value, column in zip(values, columns)
+            ]
+        except (ValueError, TypeError):
+            raise HTTPException(detail="Invalid pagination cursor", status_code=400)
@@ -1,180 +1,758 @@
+from datetime import date, datetime
 from enum import Enum
 import string
-from typing import List
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Sequence, Tuple
 import sqlalchemy as sa
-from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 from app.database.crud.base import BaseCrud
-from app.database.models.tickets import BerthModel, PassengerModel, TicketModel, TrainModel, GenderEnum, TicketStatusEnum, BerthTypeEnum
+from app.database.models.base import utc_now, utc_today
+from app.database.models.tickets import pnr_blocks, BerthModel, PassengerModel, TicketModel, TrainCounterModel, TrainModel, TrainRunModel, IdempotencyKeyModel, PromotionEventModel, GenderEnum, TicketStatusEnum, BerthTypeEnum
+from app.database.partitions import ensure_partitions
 from abc import ABC, abstractmethod
 
 
+# Namespace of the per-run advisory locks, first key of pg_advisory_xact_lock
+RUN_WRITES_LOCK = 1
+
+# NOTIFY channel of availability changes, see TrainCounterCrud.apply_deltas
+AVAILABILITY_CHANNEL = 'train_availability'
+
+# Segments a route may have: one bit each in berths.occupied_segments
+MAX_SEGMENTS = 63
+
+
+def segment_mask(from_stop: int, to_stop: int) -> int:
+    """Bits of the segments covered by a journey from ``from_stop`` to ``to_stop``."""
+    return ((1 << (to_stop - from_stop)) - 1) << from_stop
+
+
+def berth_layout(total_confirmed_berths: int, total_rac_berths: int) -> Iterator[Tuple[str, str, BerthTypeEnum]]:
+    """
+    Yields ``(coach, berth_number, type)`` for every berth of a train: lower,
+    middle and upper berths coach by coach until the confirmed berths are
+    laid out, then the side lower berths of the RAC coach.
+    """
+    coaches = list(string.ascii_uppercase)[:total_confirmed_berths // total_rac_berths]
+    berth_count = 1
+    
+    for coach in coaches:
+        for i in range(1, total_rac_berths + 1):
+            yield coach, f"{coach}L{i}", BerthTypeEnum.LOWER
+            yield coach, f"{coach}M{i}", BerthTypeEnum.MIDDLE
+            yield coach, f"{coach}U{i}", BerthTypeEnum.UPPER
+            
+            berth_count += 3
+            if berth_count > total_confirmed_berths:
+                break
+        if berth_count > total_confirmed_berths:
+            break
+    
+    for i in range(1, total_rac_berths + 1):
+        yield 'RAC', f"RAC{i}", BerthTypeEnum.SIDE_LOWER
+
+
 class _TrainCrud(ABC):
     @abstractmethod
-    def get_train(self, train_id: int) -> TrainModel | None:
+    async def get_train(self, train_id: int) -> TrainModel | None:
+        pass
+    
+    @abstractmethod
+    async def get_trains(self, cursor: str | None = None, page_size: int = 10):
         pass
     
     @abstractmethod
-    def get_trains(self, page: int, page_size: int):
+    async def get_train_layouts(self, train_ids: List[int] | None = None, after_id: int = 0, limit: int = 100) -> List[Tuple[int, int, int, List[str]]]:
         pass
     
     @abstractmethod
-    def create_train(self, data: dict):
+    async def create_train(self, data: dict):
         pass
     
     @abstractmethod
-    def delete_train(self, train_id: int):
+    async def copy_trains(self, trains: List[dict]) -> Tuple[int, int]:
+        pass
+    
+    @abstractmethod
+    async def delete_train(self, train_id: int):
+        pass
+    
+
+class _TrainRunCrud(ABC):
+    @abstractmethod
+    async def get_run(self, train_id: int, journey_date: date, with_berths: bool = False) -> TrainRunModel:
+        pass
+    
+    @abstractmethod
+    async def open_runs(self, trains: Sequence[Tuple[int, int, int, List[str]]], journey_dates: Sequence[date]) -> Tuple[int, int]:
+        pass
+    
+    @abstractmethod
+    async def lock_writes(self, train_id: int, journey_date: date):
+        pass
+    
+
+class _TrainCounterCrud(ABC):
+    @abstractmethod
+    async def get_train_counters(self, train_id: int, journey_date: date, for_update: bool = False):
+        pass
+    
+    @abstractmethod
+    async def get_version(self, train_id: int, journey_date: date) -> int | None:
+        pass
+    
+    @abstractmethod
+    async def apply_deltas(self, train_id: int, journey_date: date, deltas: Dict[TicketStatusEnum, int], segment_deltas: Dict[TicketStatusEnum, List[int]] | None = None, taken_berth_ids: Iterable[int] = (), freed_berth_ids: Iterable[int] = (), limits: Dict[TicketStatusEnum, int] | None = None) -> bool:
+        pass
+    
+    @abstractmethod
+    async def recompute(self, train_id: int | None = None, journey_date: date | None = None):
         pass
     
 
 class _BerthCrud(ABC):
     @abstractmethod
-    def get_berth(self, berth_id: int) -> BerthModel | None:
+    async def get_berth(self, berth_id: int) -> BerthModel | None:
         pass
     
     @abstractmethod
-    def get_available_berths(self, train_id: int, berth_type: BerthTypeEnum | None = None):
+    async def get_available_berths(self, train_id: int, journey_date: date, berth_type: BerthTypeEnum | None = None, limit: int = 0, segments: int | None = None):
         pass
     
     @abstractmethod
-    def update_berth_availability(self, berth_id: int, is_available: bool):
+    async def get_available_berth_rows(self, train_id: int, journey_date: date, segments: int | None = None):
+        pass
+    
+    @abstractmethod
+    async def get_available_berth_numbers(self, train_id: int, journey_date: date, segments: int | None = None):
+        pass
+    
+    @abstractmethod
+    async def get_berth_states(self, train_id: int, journey_date: date):
+        pass
+    
+    @abstractmethod
+    async def update_berth_availability(self, berth_id: int, is_available: bool):
+        pass
+    
+    @abstractmethod
+    async def claim_berth(self, berth_id: int, journey_date: date, segments: int) -> BerthModel | None:
+        pass
+    
+    @abstractmethod
+    async def claim_berths(self, train_id: int, journey_date: date, count: int = 0, segments: int = 0, claims: Dict[int, int] | None = None) -> List[int]:
+        pass
+    
+    @abstractmethod
+    async def lock_berths(self, berth_ids: List[int], journey_date: date):
+        pass
+    
+    @abstractmethod
+    async def occupy_berths(self, claims: Dict[int, int], journey_date: date | None = None):
+        pass
+    
+    @abstractmethod
+    async def release_berths(self, releases: Dict[int, int], journey_date: date | None = None) -> List[int]:
         pass
 
 
 class _TicketCrud(ABC):
     @abstractmethod
-    def get_ticket(self, ticket_id: int) -> TicketModel | None:
+    async def get_ticket(self, ticket_id: int, reload: bool = False, load: str = 'full') -> TicketModel | None:
+        pass
+    
+    @abstractmethod
+    async def get_tickets(self, train_id: int, journey_date: date, only_booked_tickets: bool = True, cursor: str | None = None, page_size: int = 20, load: str = 'full'):
+        pass
+    
+    @abstractmethod
+    async def get_ticket_rows(self, train_id: int, journey_date: date, only_booked_tickets: bool = True, cursor: str | None = None, page_size: int = 20):
+        pass
+    
+    @abstractmethod
+    async def update_ticket_status(self, ticket_id: int, status: TicketStatusEnum):
+        pass
+    
+    @abstractmethod
+    async def update_tickets_status(self, ticket_ids: List[int], status: TicketStatusEnum, journey_date: date | None = None):
+        pass
+    
+    @abstractmethod
+    async def get_promotion_queue(self, train_id: int, journey_date: date):
+        pass
+    
+    @abstractmethod
+    async def stream_manifest(self, train_id: int, journey_date: date, include_cancelled: bool = False, batch_size: int = 1000) -> AsyncIterator[List[sa.Row]]:
+        pass
+    
+    @abstractmethod
+    async def get_ticket_count_by_status(self, train_id: int, journey_date: date):
+        pass
+    
+    @abstractmethod
+    async def get_tickets_by_status(self, train_id: int, journey_date: date, status: TicketStatusEnum, load: str = 'passengers'):
         pass
     
     @abstractmethod
-    def get_tickets(self, train_id: int, page: int = 1 , page_size: int = 20):
+    async def create_ticket(self, data:dict):
         pass
     
     @abstractmethod
-    def update_ticket_status(self, ticket_id: int, status: TicketStatusEnum):
+    async def insert_ticket(self, data: dict) -> TicketModel:
         pass
     
     @abstractmethod
-    def get_ticket_count_by_status(self, train_id: int):
+    async def insert_tickets(self, tickets_data: List[dict]) -> List[int]:
         pass
     
     @abstractmethod
-    def get_tickets_by_status(self, train_id: int, status: TicketStatusEnum):
+    async def get_tickets_by_ids(self, ticket_ids: List[int], load: str = 'full') -> List[TicketModel]:
         pass
     
     @abstractmethod
-    def create_ticket(self, data:dict):
+    async def reserve_pnr_block(self) -> int:
         pass
     
 
 class _PassengerCrud(ABC):
     @abstractmethod
-    def create_passenger(self, passenger_data: dict, ticket_id: int, berth_id: int | None = None):
+    async def create_passenger(self, passenger_data: dict, ticket_id: int, berth_id: int | None = None):
+        pass
+    
+    @abstractmethod
+    async def insert_passengers(self, passengers_data: List[dict]):
+        pass
+    
+    @abstractmethod
+    async def assign_berths(self, berth_assignments: Dict[int, int], journey_date: date | None = None):
+        pass
+
+
+class _IdempotencyKeyCrud(ABC):
+    @abstractmethod
+    async def claim_key(self, key: str, request_hash: str, expires_at: datetime) -> bool:
+        pass
+    
+    @abstractmethod
+    async def get_key(self, key: str) -> IdempotencyKeyModel | None:
+        pass
+    
+    @abstractmethod
+    async def complete_key(self, key: str, status_code: int, response: str, expires_at: datetime):
+        pass
+    
+    @abstractmethod
+    async def release_key(self, key: str):
+        pass
+    
+    @abstractmethod
+    async def delete_expired(self, batch_size: int = 10000) -> int:
+        pass
+
+
+class _PromotionEventCrud(ABC):
+    @abstractmethod
+    async def add_event(self, train_id: int, journey_date: date, ticket_id: int):
+        pass
+    
+    @abstractmethod
+    async def get_due_runs(self, limit: int = 100) -> List[Tuple[int, date]]:
+        pass
+    
+    @abstractmethod
+    async def lock_due_events(self, train_id: int, journey_date: date) -> List[int]:
+        pass
+    
+    @abstractmethod
+    async def delete_events(self, event_ids: List[int]):
+        pass
+    
+    @abstractmethod
+    async def defer_events(self, event_ids: List[int], error: str, retry_delay: float):
         pass
 
 
 class TrainCrud(BaseCrud, _TrainCrud):
-    def __init__(self, session: Session, Model = TrainModel):
+    def __init__(self, session: AsyncSession, Model = TrainModel):
         super().__init__(session, Model)
     
-    def get_train(self, train_id: int) -> TrainModel | None:
+    async def get_train(self, train_id: int) -> TrainModel | None:
         stmt = sa.select(TrainModel).where(
             TrainModel.id == train_id
         )
-        train = self.session.execute(stmt).scalar_one_or_none()
+        train = (await self.session.execute(stmt)).scalar_one_or_none()
         self.missing_obj(train, detail = f"Train with ID: {train_id} not found!")
         return train
     
-    def get_trains(self, page: int, page_size: int):
+    async def get_trains(self, cursor: str | None = None, page_size: int = 10):
         stmt = sa.select(TrainModel)
-        stmt = self.pagination_query(stmt, page, page_size)
-        trains = self.session.execute(stmt).scalars().all()
-        print(trains)
-        return trains
-    
-    def create_train(self, data: dict):
-        train: TrainModel = super().create(data)
-        
-        coaches = list(string.ascii_uppercase)[:train.total_coaches]
-        berth_count = 1
-        
-        berths = []
-        berth_data = {
-                    'train_id': train.id,
-                    'is_available': True
-                }
-        for coach in coaches:
-            berth_data['coach'] = coach
-            
-            for i in range(1, train.total_rac_berths + 1):  
-                
-                lower_berth_data = {**berth_data,
-                                    'berth_number': f"{coach}L{i}",
-                                    'type': BerthTypeEnum.LOWER
-                                    }
-                
-                middle_berth_data = {**berth_data,
-                                    'berth_number': f"{coach}M{i}",
-                                    'type': BerthTypeEnum.MIDDLE
-                                    }
-                
-                upper_berth_data = {**berth_data,
-                                    'berth_number': f"{coach}U{i}",
-                                    'type': BerthTypeEnum.UPPER
-                                    }
-                
-                berths.extend([lower_berth_data, middle_berth_data, upper_berth_data])
-                
-                berth_count += 3
-                if berth_count > train.total_confirmed_berths:
-                    break
-            if berth_count > train.total_confirmed_berths:
-                break
+        return await self.keyset_pagination(stmt, [TrainModel.id], cursor, page_size)
+    
+    async def get_train_layouts(self, train_ids: List[int] | None = None, after_id: int = 0, limit: int = 100) -> List[Tuple[int, int, int, List[str]]]:
+        """
+        ``(train_id, total_confirmed_berths, total_rac_berths, stations)``
+        rows for ``TrainRunCrud.open_runs``, in id order from ``after_id``,
+        of ``train_ids`` or of every train.
+        """
+        stmt = sa.select(
+            TrainModel.id,
+            TrainModel.total_confirmed_berths,
+            TrainModel.total_rac_berths,
+            TrainModel.stations
+        ).where(
+            TrainModel.id > after_id
+        ).order_by(
+            TrainModel.id
+        ).limit(
+            limit
+        )
         
-        berth_data['coach'] = 'RAC'
-        for i in range(1, train.total_rac_berths + 1):
-            middle_lower_berth_data = {**berth_data,
-                                    'berth_number': f"RAC{i}",
-                                    'type': BerthTypeEnum.SIDE_LOWER
-                                    }
-            berths.append(middle_lower_berth_data)
+        if train_ids is not None:
+            stmt = stmt.where(TrainModel.id.in_(train_ids))
         
-        self.session.execute(
-            sa.insert(BerthModel),
-            berths,
+        return (await self.session.execute(stmt)).tuples().all()
+    
+    async def create_train(self, data: dict) -> TrainRunModel:
+        """Creates the train and opens its run of today, returned with its berths."""
+        train: TrainModel = await super().create(data)
+        journey_date = utc_today()
+        
+        run_crud = TrainRunCrud(self.session)
+        if await ensure_partitions(self.session, journey_date, journey_date):
+            await self.session.commit()
+        await run_crud.open_runs(
+            [(train.id, train.total_confirmed_berths, train.total_rac_berths, train.stations)],
+            [journey_date]
         )
-        self.session.commit()
-        # self.session.refresh(train)
-        return train
+        await self.session.commit()
+        return await run_crud.get_run(train.id, journey_date, with_berths=True)
+        
+    async def copy_trains(self, trains: List[dict]) -> Tuple[int, int]:
+        """
+        Loads ``trains`` through COPY and opens their runs of today, in the
+        current transaction. Train ids are reserved up front from the
+        sequence, so runs can reference them without a round trip per train.
+        Missing partitions of today are created and committed first, before
+        anything is written. Returns the number of trains and berths written.
+        """
+        if not trains:
+            return 0, 0
+        journey_date = utc_today()
+        if await ensure_partitions(self.session, journey_date, journey_date):
+            await self.session.commit()
+        
+        stmt = sa.select(
+            sa.func.nextval(sa.func.pg_get_serial_sequence(TrainModel.__tablename__, 'id'))
+        ).select_from(
+            sa.func.generate_series(1, len(trains))
+        )
+        train_ids = (await self.session.execute(stmt)).scalars().all()
+        
+        connection = await (await self.session.connection()).get_raw_connection()
+        now = utc_now()
+        await connection.driver_connection.copy_records_to_table(
+            TrainModel.__tablename__,
+            columns=['id', 'name', 'total_confirmed_berths', 'total_rac_berths', 'total_waiting_list', 'stations', 'created_at', 'updated_at'],
+            records=[
+                (train_id, train['name'], train['total_confirmed_berths'], train['total_rac_berths'], train['total_waiting_list'], train.get('stations') or [], now, now)
+                for train_id, train in zip(train_ids, trains)
+            ]
+        )
+        
+        _, berth_count = await TrainRunCrud(self.session).open_runs(
+            [
+                (train_id, train['total_confirmed_berths'], train['total_rac_berths'], train.get('stations') or [])
+                for train_id, train in zip(train_ids, trains)
+            ],
+            [journey_date]
+        )
+        return len(train_ids), berth_count
+    
+    async def delete_train(self, train_id: int):
+        return await super().delete(train_id)
+        
+
+class TrainRunCrud(BaseCrud, _TrainRunCrud):
+    def __init__(self, session: AsyncSession, Model = TrainRunModel):
+        super().__init__(session, Model)
+    
+    async def get_run(self, train_id: int, journey_date: date, with_berths: bool = False) -> TrainRunModel:
+        stmt = sa.select(TrainRunModel).where(
+            TrainRunModel.train_id == train_id,
+            TrainRunModel.journey_date == journey_date
+        ).options(
+            joinedload(TrainRunModel.train)
+        )
+        
+        if with_berths:
+            stmt = stmt.options(selectinload(TrainRunModel.berths))
+        
+        run = (await self.session.execute(stmt)).scalar_one_or_none()
+        self.missing_obj(run, detail = f"Train with ID: {train_id} does not run on {journey_date}!")
+        return run
+    
+    async def open_runs(self, trains: Sequence[Tuple[int, int, int, List[str]]], journey_dates: Sequence[date]) -> Tuple[int, int]:
+        """
+        Opens the runs of ``trains`` on ``journey_dates`` that are not open
+        yet, in the current transaction: runs are inserted in one statement,
+        their berths and counters rows written through COPY. ``trains`` are
+        ``(train_id, total_confirmed_berths, total_rac_berths, stations)``
+        rows, and the partitions of the dates must exist already. Returns
+        the number of runs opened and berths written.
+        """
+        if not trains or not journey_dates:
+            return 0, 0
+        layouts = {train_id: (confirmed, rac, stations or []) for train_id, confirmed, rac, stations in trains}
+        train_ids = sa.func.unnest(sa.literal(list(layouts), ARRAY(sa.Integer))).table_valued('train_id').render_derived()
+        dates = sa.func.unnest(sa.literal(list(journey_dates), ARRAY(sa.Date))).table_valued('journey_date').render_derived()
+        
+        stmt = pg_insert(TrainRunModel).from_select(
+            ['train_id', 'journey_date', 'created_at', 'updated_at'],
+            sa.select(
+                train_ids.c.train_id,
+                dates.c.journey_date,
+                sa.func.timezone('utc', sa.func.now()),
+                sa.func.timezone('utc', sa.func.now())
+            ).select_from(
+                train_ids.join(dates, sa.true())
+            )
+        ).on_conflict_do_nothing().returning(
+            TrainRunModel.train_id,
+            TrainRunModel.journey_date
+        )
+        # Runs already open are left as they are, berths and all
+        runs = (await self.session.execute(stmt)).all()
+        if not runs:
+            return 0, 0
+        
+        connection = await (await self.session.connection()).get_raw_connection()
+        driver_connection = connection.driver_connection
+        now = utc_now()
+        berth_count = 0
+        
+        def berth_records():
+            nonlocal berth_count
+            for train_id, journey_date in runs:
+                confirmed, rac, _ = layouts[train_id]
+                for coach, berth_number, berth_type in berth_layout(confirmed, rac):
+                    berth_count += 1
+                    yield train_id, journey_date, berth_number, berth_type.name, coach, True, 0, now, now
+        
+        def counter_record(train_id: int, journey_date: date):
+            segments = [0] * max(1, len(layouts[train_id][2]) - 1)
+            return train_id, journey_date, 0, 0, 0, segments, segments, segments, 0, now, now
+        
+        await driver_connection.copy_records_to_table(
+            BerthModel.__tablename__,
+            columns=['train_id', 'journey_date', 'berth_number', 'type', 'coach', 'is_available', 'occupied_segments', 'created_at', 'updated_at'],
+            records=berth_records()
+        )
+        await driver_connection.copy_records_to_table(
+            TrainCounterModel.__tablename__,
+            columns=['train_id', 'journey_date', 'confirmed_used', 'rac_used', 'waiting_used', 'confirmed_segments', 'rac_segments', 'waiting_segments', 'version', 'created_at', 'updated_at'],
+            records=[counter_record(train_id, journey_date) for train_id, journey_date in runs]
+        )
+        return len(runs), berth_count
+    
+    async def lock_writes(self, train_id: int, journey_date: date):
+        # Transaction-scoped advisory lock: one writer per run across workers
+        await self.session.execute(
+            sa.select(
+                sa.func.pg_advisory_xact_lock(RUN_WRITES_LOCK, TrainRunModel.id)
+            ).where(
+                TrainRunModel.train_id == train_id,
+                TrainRunModel.journey_date == journey_date
+            )
+        )
+        
+
+class TrainCounterCrud(BaseCrud, _TrainCounterCrud):
+    COLUMNS = {
+        TicketStatusEnum.CONFIRMED: 'confirmed_used',
+        TicketStatusEnum.RAC: 'rac_used',
+        TicketStatusEnum.WAITING_LIST: 'waiting_used',
+    }
+    SEGMENT_COLUMNS = {
+        TicketStatusEnum.CONFIRMED: 'confirmed_segments',
+        TicketStatusEnum.RAC: 'rac_segments',
+        TicketStatusEnum.WAITING_LIST: 'waiting_segments',
+    }
+    # NOTIFY payloads are capped at 8000 bytes: changes to more berths than
+    # this are published without berth lists
+    NOTIFY_MAX_BERTHS = 500
+    
+    def __init__(self, session: AsyncSession, Model = TrainCounterModel):
+        super().__init__(session, Model)
+    
+    async def get_train_counters(self, train_id: int, journey_date: date, for_update: bool = False):
+        """
+        Returns the train together with the counters of its run on
+        ``journey_date``. With ``for_update`` the counters row stays locked
+        until the transaction ends.
+        """
+        stmt = sa.select(
+            TrainModel,
+            TrainCounterModel
+        ).join(
+            TrainCounterModel, TrainCounterModel.train_id == TrainModel.id
+        ).where(
+            TrainModel.id == train_id,
+            TrainCounterModel.journey_date == journey_date
+        )
+        
+        if for_update:
+            stmt = stmt.with_for_update(of=TrainCounterModel)
+        
+        row = (await self.session.execute(stmt)).one_or_none()
+        if row is None:
+            # Runs without a counters row get one on first use
+            await self.recompute(train_id, journey_date)
+            row = (await self.session.execute(stmt)).one_or_none()
+        
+        self.missing_obj(row, detail = f"Train with ID: {train_id} does not run on {journey_date}!")
+        return tuple(row)
+    
+    async def get_version(self, train_id: int, journey_date: date) -> int | None:
+        stmt = sa.select(
+            TrainCounterModel.version
+        ).where(
+            TrainCounterModel.train_id == train_id,
+            TrainCounterModel.journey_date == journey_date
+        )
+        return (await self.session.execute(stmt)).scalar_one_or_none()
+    
+    async def apply_deltas(self, train_id: int, journey_date: date, deltas: Dict[TicketStatusEnum, int], segment_deltas: Dict[TicketStatusEnum, List[int]] | None = None, taken_berth_ids: Iterable[int] = (), freed_berth_ids: Iterable[int] = (), limits: Dict[TicketStatusEnum, int] | None = None) -> bool:
+        """
+        Moves the ticket counters by ``deltas`` and the per-segment counters
+        by ``segment_deltas``, one delta per segment, then publishes the
+        change on AVAILABILITY_CHANNEL, in the same statement. NOTIFY is
+        delivered on commit only, so listeners never hear of a write that
+        rolled back. The payload carries the new counters and version, with
+        the berths taken and freed over the whole route, or no berth lists
+        when there are too many to fit.
+        
+        With ``limits``, the most tickets a segment may hold per status, the
+        update only applies if no segment a delta adds to goes past its
+        limit. Check and update are one statement, so a booking needs no
+        lock on the counters before it, and holds the row lock from here to
+        its commit only. Returns whether the counters were updated.
+        """
+        def segment_pairs(column, delta: List[int]):
+            # Element by element: unnest zips the two arrays
+            return sa.func.unnest(column, sa.literal(list(delta), ARRAY(sa.Integer))).table_valued(
+                'used', 'delta', with_ordinality='segment'
+            ).render_derived()
+        
+        values = {
+            self.COLUMNS[status]: getattr(TrainCounterModel, self.COLUMNS[status]) + delta
+            for status, delta in deltas.items()
+            if status in self.COLUMNS and delta
+        }
+        within_limits = []
+        for status, delta in (segment_deltas or {}).items():
+            if status in self.SEGMENT_COLUMNS and any(delta):
+                column = getattr(TrainCounterModel, self.SEGMENT_COLUMNS[status])
+                pairs = segment_pairs(column, delta)
+                values[self.SEGMENT_COLUMNS[status]] = sa.func.array(
+                    sa.select(pairs.c.used + pairs.c.delta).order_by(pairs.c.segment).scalar_subquery()
+                )
+                if limits is not None and status in limits and any(change > 0 for change in delta):
+                    pairs = segment_pairs(column, delta)
+                    within_limits.append(~sa.exists().where(
+                        pairs.c.delta > 0,
+                        pairs.c.used + pairs.c.delta > limits[status]
+                    ))
+        if not values:
+            return True
+        changed = sa.update(
+            TrainCounterModel
+        ).where(
+            TrainCounterModel.train_id == train_id,
+            TrainCounterModel.journey_date == journey_date,
+            *within_limits
+        ).values(
+            **values,
+            # Every write that moves tickets also flips berths: readers compare
+            # versions to tell whether a cached train is stale
+            version = TrainCounterModel.version + 1
+        ).returning(
+            TrainCounterModel.train_id,
+            TrainCounterModel.journey_date,
+            TrainCounterModel.version,
+            *[getattr(TrainCounterModel, column) for column in self.COLUMNS.values()],
+            *[getattr(TrainCounterModel, column) for column in self.SEGMENT_COLUMNS.values()]
+        ).cte('changed')
+        
+        taken_berth_ids, freed_berth_ids = list(taken_berth_ids), list(freed_berth_ids)
+        berths_listed = len(taken_berth_ids) + len(freed_berth_ids) <= self.NOTIFY_MAX_BERTHS
         
-    def delete_train(self, train_id: int):
-        return super().delete(train_id)
+        def berth_list(berth_ids: List[int]):
+            return sa.literal(berth_ids, ARRAY(sa.Integer)) if berths_listed else sa.null()
+        
+        payload = sa.func.json_build_object(
+            'train_id', changed.c.train_id,
+            'journey_date', changed.c.journey_date,
+            'version', changed.c.version,
+            *[part for column in self.COLUMNS.values() for part in (column, changed.c[column])],
+            *[part for column in self.SEGMENT_COLUMNS.values() for part in (column, changed.c[column])],
+            'taken', berth_list(taken_berth_ids),
+            'freed', berth_list(freed_berth_ids)
+        )
+        # A row per counters row updated, none when a limit was hit
+        notified = await self.session.execute(
+            sa.select(sa.func.pg_notify(AVAILABILITY_CHANNEL, sa.cast(payload, sa.Text)))
+        )
+        return notified.first() is not None
+    
+    async def recompute(self, train_id: int | None = None, journey_date: date | None = None):
+        """
+        Rebuilds counters from the tickets table, run by run, for the runs
+        of one train, one date or both, or all of them. Existing counter rows
+        are locked first, so bookings that commit meanwhile are included in
+        the recount rather than overwritten.
+        """
+        lock = sa.select(TrainCounterModel.id).with_for_update()
+        
+        def segment_counts(status: TicketStatusEnum):
+            series = sa.func.generate_series(
+                0, sa.func.greatest(sa.func.cardinality(TrainModel.stations) - 1, 1) - 1
+            ).table_valued('segment').render_derived()
+            held = sa.select(
+                sa.func.count(TicketModel.id)
+            ).where(
+                TicketModel.train_id == TrainRunModel.train_id,
+                TicketModel.journey_date == TrainRunModel.journey_date,
+                TicketModel.status == status,
+                TicketModel.from_stop <= series.c.segment,
+                TicketModel.to_stop > series.c.segment
+            ).correlate(TrainRunModel, series).scalar_subquery()
+            return sa.func.array(
+                sa.select(held).select_from(series).order_by(series.c.segment).correlate(TrainModel, TrainRunModel).scalar_subquery()
+            )
+        
+        counts = sa.select(
+            TrainRunModel.train_id,
+            TrainRunModel.journey_date,
+            *[
+                sa.func.count(TicketModel.id).filter(TicketModel.status == status)
+                for status in self.COLUMNS
+            ],
+            *[segment_counts(status) for status in self.SEGMENT_COLUMNS],
+            sa.func.timezone('utc', sa.func.now()),
+            sa.func.timezone('utc', sa.func.now())
+        ).select_from(
+            TrainRunModel
+        ).join(
+            TrainModel, TrainModel.id == TrainRunModel.train_id
+        ).outerjoin(
+            TicketModel, (TicketModel.train_id == TrainRunModel.train_id) & (TicketModel.journey_date == TrainRunModel.journey_date)
+        ).group_by(
+            TrainRunModel.train_id,
+            TrainRunModel.journey_date,
+            TrainModel.id
+        )
+        
+        if train_id is not None:
+            lock = lock.where(TrainCounterModel.train_id == train_id)
+            counts = counts.where(TrainRunModel.train_id == train_id)
+        if journey_date is not None:
+            lock = lock.where(TrainCounterModel.journey_date == journey_date)
+            counts = counts.where(TrainRunModel.journey_date == journey_date)
+        
+        await self.session.execute(lock)
+        
+        stmt = pg_insert(TrainCounterModel).from_select(
+            ['train_id', 'journey_date', *self.COLUMNS.values(), *self.SEGMENT_COLUMNS.values(), 'created_at', 'updated_at'],
+            counts
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[TrainCounterModel.train_id, TrainCounterModel.journey_date],
+            set_={
+                **{column: stmt.excluded[column] for column in [*self.COLUMNS.values(), *self.SEGMENT_COLUMNS.values()]},
+                'version': TrainCounterModel.version + 1,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        await self.session.execute(stmt)
         
 
 class BerthCrud(BaseCrud, _BerthCrud):
-    def __init__(self, session: Session, Model = BerthModel):
+    def __init__(self, session: AsyncSession, Model = BerthModel):
         super().__init__(session, Model)
         
-    def get_berth(self, berth_id: int) -> BerthModel | None:
-        return super().get(berth_id)
+    async def get_berth(self, berth_id: int) -> BerthModel | None:
+        return await super().get(berth_id)
+    
+    @staticmethod
+    def free_for(segments: int | None = None):
+        # Free over the whole route is what is_available, and its partial
+        # index, track; a part of the route needs the occupancy bits
+        if segments is None:
+            return BerthModel.is_available == True
+        return BerthModel.occupied_segments.bitwise_and(segments) == 0
     
-    def get_available_berths(self, train_id: int, berth_type: BerthTypeEnum | None = None, limit: int = 0):
+    async def get_available_berths(self, train_id: int, journey_date: date, berth_type: BerthTypeEnum | None = None, limit: int = 0, segments: int | None = None):
         stmt = sa.select(
             BerthModel
         ).where(
             BerthModel.train_id == train_id,
-            BerthModel.is_available == True
+            BerthModel.journey_date == journey_date,
+            self.free_for(segments)
+        ).order_by(
+            BerthModel.id
         )
         
         if berth_type:
-            stmt.where(BerthModel.type == berth_type)
+            stmt = stmt.where(BerthModel.type == berth_type)
         
         if limit:
-            stmt.limit(limit)
+            stmt = stmt.limit(limit)
         
-        berths = self.session.execute(stmt).scalars().all()
+        berths = (await self.session.execute(stmt)).scalars().all()
         return berths
     
-    def update_berth_availability(self, berth_id: int, is_available: bool):
+    async def get_available_berth_rows(self, train_id: int, journey_date: date, segments: int | None = None):
+        stmt = sa.select(
+            BerthModel.berth_number,
+            BerthModel.type,
+            BerthModel.coach,
+            BerthModel.is_available,
+            BerthModel.id,
+            BerthModel.train_id
+        ).where(
+            BerthModel.train_id == train_id,
+            BerthModel.journey_date == journey_date,
+            self.free_for(segments)
+        ).order_by(
+            BerthModel.id
+        )
+        return (await self.session.execute(stmt)).all()
+    
+    async def get_available_berth_numbers(self, train_id: int, journey_date: date, segments: int | None = None):
+        # Just enough for the compact view, unordered
+        stmt = sa.select(
+            BerthModel.coach,
+            BerthModel.berth_number
+        ).where(
+            BerthModel.train_id == train_id,
+            BerthModel.journey_date == journey_date,
+            self.free_for(segments)
+        )
+        return (await self.session.execute(stmt)).all()
+    
+    async def get_berth_states(self, train_id: int, journey_date: date):
+        stmt = sa.select(
+            BerthModel.id,
+            BerthModel.type,
+            BerthModel.occupied_segments
+        ).where(
+            BerthModel.train_id == train_id,
+            BerthModel.journey_date == journey_date
+        )
+        return (await self.session.execute(stmt)).tuples().all()
+    
+    async def update_berth_availability(self, berth_id: int, is_available: bool):
         try:
             stmt = sa.update(
             BerthModel
@@ -185,61 +763,256 @@ class BerthCrud(BaseCrud, _BerthCrud):
             ).returning(
                 BerthModel
             )
-            ticket = self.session.execute(stmt).scalar_one()
-            self.session.commit()
+            ticket = (await self.session.execute(stmt)).scalar_one()
+            await self.session.commit()
             return ticket
         except Exception:
-            self.session.rollback()
+            await self.session.rollback()
+    
+    async def claim_berth(self, berth_id: int, journey_date: date, segments: int) -> BerthModel | None:
+        try:
+            stmt = sa.update(
+            BerthModel
+            ).where(
+                BerthModel.id == berth_id,
+                BerthModel.journey_date == journey_date,
+                self.free_for(segments)
+            ).values(
+                is_available = False,
+                occupied_segments = BerthModel.occupied_segments.bitwise_or(segments)
+            ).returning(
+                BerthModel
+            )
+            berth = (await self.session.execute(stmt)).scalar_one_or_none()
+            await self.session.commit()
+            return berth
+        except Exception:
+            await self.session.rollback()
+    
+    async def claim_berths(self, train_id: int, journey_date: date, count: int = 0, segments: int = 0, claims: Dict[int, int] | None = None) -> List[int]:
+        """
+        Marks berths of the run as taken over some segments, without
+        committing.
+        
+        Claims ``claims``, berth id to the segments wanted on it, if passed:
+        a berth is claimed only if all of those are still free. Otherwise
+        claims up to ``count`` berths free over ``segments``, in berth order.
+        Rows locked by concurrent bookings are skipped instead of waited on,
+        so a berth segment is never handed out twice.
+        """
+        claimable = sa.select(
+            BerthModel.id
+        ).where(
+            BerthModel.train_id == train_id,
+            BerthModel.journey_date == journey_date
+        )
+        
+        if claims is not None:
+            if not claims:
+                return []
+            wanted = sa.values(
+                sa.column('id', sa.Integer),
+                sa.column('segments', sa.BigInteger),
+                name='wanted'
+            ).data(list(claims.items()))
+            claimable = claimable.where(BerthModel.id.in_(list(claims)))
+            segments = wanted.c.segments
+        else:
+            claimable = claimable.where(
+                self.free_for(segments)
+            ).order_by(BerthModel.id).limit(count)
+        
+        claimable = claimable.with_for_update(skip_locked=True)
+        
+        stmt = sa.update(
+            BerthModel
+        ).where(
+            BerthModel.id.in_(claimable.scalar_subquery()),
+            BerthModel.journey_date == journey_date,
+            self.free_for(segments)
+        ).values(
+            is_available = False,
+            occupied_segments = BerthModel.occupied_segments.bitwise_or(segments)
+        ).returning(
+            BerthModel.id
+        )
+        if claims is not None:
+            stmt = stmt.where(BerthModel.id == wanted.c.id)
+        return (await self.session.execute(stmt)).scalars().all()
+    
+    async def lock_berths(self, berth_ids: List[int], journey_date: date):
+        """
+        Locks the given berths of a run until commit, in id order, and
+        returns their id and occupied segments.
+        """
+        stmt = sa.select(
+            BerthModel.id,
+            BerthModel.occupied_segments
+        ).where(
+            BerthModel.id.in_(berth_ids),
+            BerthModel.journey_date == journey_date
+        ).order_by(
+            BerthModel.id
+        ).with_for_update()
+        return (await self.session.execute(stmt)).tuples().all()
+    
+    async def occupy_berths(self, claims: Dict[int, int], journey_date: date | None = None):
+        await self._set_berth_segments(claims, occupy=True, journey_date=journey_date)
+    
+    async def release_berths(self, releases: Dict[int, int], journey_date: date | None = None) -> List[int]:
+        """
+        Frees the given segments of each berth, berth id to segments, and
+        returns the berths now free over the whole route. With the
+        ``journey_date`` of the berths only their partition is searched.
+        """
+        return await self._set_berth_segments(releases, occupy=False, journey_date=journey_date)
+    
+    async def _set_berth_segments(self, changes: Dict[int, int], occupy: bool, journey_date: date | None = None) -> List[int]:
+        if not changes:
+            return []
+        # UPDATE .. FROM (VALUES ..): one statement for any number of berths
+        changed = sa.values(
+            sa.column('id', sa.Integer),
+            sa.column('segments', sa.BigInteger),
+            name='changed'
+        ).data(list(changes.items()))
+        if occupy:
+            occupied = BerthModel.occupied_segments.bitwise_or(changed.c.segments)
+        else:
+            occupied = BerthModel.occupied_segments.bitwise_and(changed.c.segments.bitwise_not())
+        stmt = sa.update(
+            BerthModel
+        ).where(
+            BerthModel.id == changed.c.id
+        ).values(
+            occupied_segments = occupied,
+            is_available = occupied == 0
+        ).returning(
+            BerthModel.id,
+            BerthModel.is_available
+        ).execution_options(
+            synchronize_session=False
+        )
+        if journey_date is not None:
+            stmt = stmt.where(BerthModel.journey_date == journey_date)
+        return [berth_id for berth_id, is_available in (await self.session.execute(stmt)).tuples() if is_available]
         
     
 class TicketCrud(BaseCrud, _TicketCrud):
-    def __init__(self, session: Session, Model = TicketModel):
+    # Loader options per response shape. Berths are many-to-one, so they are
+    # joined onto the passengers SELECT: 'full' costs two queries however many
+    # tickets are loaded.
+    LOAD_PROFILES = {
+        'full': (selectinload(TicketModel.passengers).joinedload(PassengerModel.berth),),
+        'passengers': (selectinload(TicketModel.passengers),),
+        'bare': (),
+    }
+    
+    def __init__(self, session: AsyncSession, Model = TicketModel):
         super().__init__(session, Model)
         
-    def get_ticket(self, ticket_id: int) -> TicketModel | None:
-        return super().get(ticket_id)
+    async def get_ticket(self, ticket_id: int, reload: bool = False, load: str = 'full') -> TicketModel | None:
+        return await super().get(ticket_id, options=self.LOAD_PROFILES[load], populate_existing=reload)
     
-    def get_tickets(self, train_id: int, only_booked_tickets: bool = True, page: int = 1, page_size: int = 20):
+    async def get_tickets(self, train_id: int, journey_date: date, only_booked_tickets: bool = True, cursor: str | None = None, page_size: int = 20, load: str = 'full'):
         
         stmt = sa.select(
             TicketModel
         ).where(
             TicketModel.train_id == train_id,
+            TicketModel.journey_date == journey_date
+        ).options(
+            *self.LOAD_PROFILES[load]
+        )
+        
+        if only_booked_tickets:
+            stmt = stmt.where(TicketModel.status != TicketStatusEnum.CANCELLED)
+        
+        tickets, next_cursor = await self.keyset_pagination(
+            stmt, [TicketModel.created_at, TicketModel.id], cursor, page_size
+        )
+        return {'tickets': tickets, 'count': len(tickets), 'next_cursor': next_cursor}
+    
+    async def get_ticket_rows(self, train_id: int, journey_date: date, only_booked_tickets: bool = True, cursor: str | None = None, page_size: int = 20):
+        """
+        The page ``get_tickets`` returns, as plain rows: the tickets, then
+        their passengers joined to their berths. No ORM objects are built.
+        """
+        stmt = sa.select(
+            TicketModel.pnr,
+            TicketModel.status,
+            TicketModel.id,
+            TicketModel.created_at,
+            TicketModel.train_id,
+            TicketModel.journey_date,
+            TicketModel.from_stop,
+            TicketModel.to_stop
+        ).where(
+            TicketModel.train_id == train_id,
+            TicketModel.journey_date == journey_date
         )
         
         if only_booked_tickets:
-            stmt.where(TicketModel.status != TicketStatusEnum.CANCELLED)
+            stmt = stmt.where(TicketModel.status != TicketStatusEnum.CANCELLED)
+        
+        tickets, next_cursor = await self.keyset_pagination(
+            stmt, [TicketModel.created_at, TicketModel.id], cursor, page_size, scalars=False
+        )
+        
+        passengers = []
+        if tickets:
+            stmt = sa.select(
+                PassengerModel.ticket_id,
+                PassengerModel.name,
+                PassengerModel.age,
+                PassengerModel.gender,
+                PassengerModel.id,
+                PassengerModel.needs_berth,
+                PassengerModel.berth_id,
+                BerthModel.berth_number,
+                BerthModel.type.label('berth_type'),
+                BerthModel.coach,
+                BerthModel.is_available,
+                BerthModel.train_id.label('berth_train_id')
+            ).outerjoin(
+                BerthModel, (BerthModel.id == PassengerModel.berth_id) & (BerthModel.journey_date == PassengerModel.journey_date)
+            ).where(
+                PassengerModel.ticket_id.in_([ticket.id for ticket in tickets]),
+                PassengerModel.journey_date == journey_date
+            ).order_by(
+                PassengerModel.id
+            )
+            passengers = (await self.session.execute(stmt)).all()
         
-        stmt = self.pagination_query(stmt, page, page_size)
-        tickets = self.session.execute(stmt).scalars().all()
-         
-        return {'tickets': tickets, 'count': len(tickets)}
+        return {'tickets': tickets, 'passengers': passengers, 'next_cursor': next_cursor}
 
-    def get_ticket_count_by_status(self, train_id: int):
+    async def get_ticket_count_by_status(self, train_id: int, journey_date: date):
         stmt = sa.select(
             TicketModel.status,
             sa.func.count(TicketModel.id)
         ).where(
             TicketModel.train_id == train_id,
+            TicketModel.journey_date == journey_date,
             TicketModel.status != TicketStatusEnum.CANCELLED
         ).group_by(
             TicketModel.status
         )
-        result = self.session.execute(stmt).all()
+        result = (await self.session.execute(stmt)).all()
         return {status: count for status, count in result}
     
-    def get_tickets_by_status(self, train_id: int, status: TicketStatusEnum):
+    async def get_tickets_by_status(self, train_id: int, journey_date: date, status: TicketStatusEnum, load: str = 'passengers'):
         stmt = sa.select(TicketModel).where(
             TicketModel.train_id == train_id,
+            TicketModel.journey_date == journey_date,
             TicketModel.status == status
         ).order_by(
             TicketModel.created_at
+        ).options(
+            *self.LOAD_PROFILES[load]
         )
-        tickets = self.session.execute(stmt).scalars().all()
-        print(tickets)
-        return tickets
+        return (await self.session.execute(stmt)).scalars().all()
         
-    def update_ticket_status(self, ticket_id: int, status: TicketStatusEnum):
+    async def update_ticket_status(self, ticket_id: int, status: TicketStatusEnum):
         try:
             stmt = sa.update(
             TicketModel
@@ -250,25 +1023,323 @@ class TicketCrud(BaseCrud, _TicketCrud):
             ).returning(
                 TicketModel
             )
-            ticket = self.session.execute(stmt).scalar_one()
-            self.session.commit()
+            ticket = (await self.session.execute(stmt)).scalar_one()
+            await self.session.commit()
             return ticket
         except Exception:
-            self.session.rollback()
+            await self.session.rollback()
             
-    def create_ticket(self, data: dict) -> TicketModel | None:
-        return super().create(data)
+    async def update_tickets_status(self, ticket_ids: List[int], status: TicketStatusEnum, journey_date: date | None = None):
+        if not ticket_ids:
+            return
+        stmt = sa.update(
+            TicketModel
+        ).where(
+            TicketModel.id.in_(ticket_ids)
+        ).values(
+            status=status
+        ).execution_options(
+            synchronize_session=False
+        )
+        if journey_date is not None:
+            # Only that date's partition is searched
+            stmt = stmt.where(TicketModel.journey_date == journey_date)
+        await self.session.execute(stmt)
+    
+    async def get_promotion_queue(self, train_id: int, journey_date: date):
+        """
+        Passengers of the run's RAC and waiting list tickets, in booking
+        order, along with their journey and the type of the berth they
+        currently hold.
+        """
+        stmt = sa.select(
+            TicketModel.id.label('ticket_id'),
+            TicketModel.status,
+            TicketModel.from_stop,
+            TicketModel.to_stop,
+            PassengerModel.id.label('passenger_id'),
+            PassengerModel.age,
+            PassengerModel.gender,
+            PassengerModel.needs_berth,
+            PassengerModel.berth_id,
+            BerthModel.type.label('berth_type')
+        ).join(
+            PassengerModel, (PassengerModel.ticket_id == TicketModel.id) & (PassengerModel.journey_date == TicketModel.journey_date)
+        ).outerjoin(
+            BerthModel, (BerthModel.id == PassengerModel.berth_id) & (BerthModel.journey_date == PassengerModel.journey_date)
+        ).where(
+            TicketModel.train_id == train_id,
+            TicketModel.journey_date == journey_date,
+            TicketModel.status.in_([TicketStatusEnum.RAC, TicketStatusEnum.WAITING_LIST])
+        ).order_by(
+            TicketModel.created_at,
+            TicketModel.id,
+            PassengerModel.id
+        )
+        return (await self.session.execute(stmt)).all()
+    
+    async def stream_manifest(self, train_id: int, journey_date: date, include_cancelled: bool = False, batch_size: int = 1000) -> AsyncIterator[List[sa.Row]]:
+        """
+        Yields the passengers of a run, one row each with their ticket and
+        berth, in batches of ``batch_size``. Rows come from a server-side
+        cursor, so memory stays flat however big the train is.
+        """
+        stmt = sa.select(
+            TicketModel.pnr,
+            TicketModel.status,
+            TicketModel.created_at,
+            PassengerModel.name,
+            PassengerModel.age,
+            PassengerModel.gender,
+            BerthModel.coach,
+            BerthModel.berth_number,
+            BerthModel.type.label('berth_type'),
+            TicketModel.from_stop,
+            TicketModel.to_stop
+        ).join(
+            PassengerModel, (PassengerModel.ticket_id == TicketModel.id) & (PassengerModel.journey_date == TicketModel.journey_date)
+        ).outerjoin(
+            BerthModel, (BerthModel.id == PassengerModel.berth_id) & (BerthModel.journey_date == PassengerModel.journey_date)
+        ).where(
+            TicketModel.train_id == train_id,
+            TicketModel.journey_date == journey_date
+        ).order_by(
+            TicketModel.created_at,
+            TicketModel.id,
+            PassengerModel.id
+        ).execution_options(
+            yield_per=batch_size
+        )
+        
+        if not include_cancelled:
+            stmt = stmt.where(TicketModel.status != TicketStatusEnum.CANCELLED)
+        
+        result = await self.session.stream(stmt)
+        async for rows in result.partitions():
+            yield rows
+    
+    async def create_ticket(self, data: dict) -> TicketModel | None:
+        return await super().create(data)
+    
+    async def insert_ticket(self, data: dict) -> TicketModel:
+        stmt = sa.insert(TicketModel).values(data).returning(TicketModel)
+        return (await self.session.execute(stmt)).scalar_one()
+    
+    async def insert_tickets(self, tickets_data: List[dict]) -> List[int]:
+        if not tickets_data:
+            return []
+        # Batched into multi-row INSERTs, ids come back in parameter order
+        stmt = sa.insert(TicketModel).returning(TicketModel.id, sort_by_parameter_order=True)
+        return (await self.session.execute(stmt, tickets_data)).scalars().all()
+    
+    async def get_tickets_by_ids(self, ticket_ids: List[int], load: str = 'full') -> List[TicketModel]:
+        stmt = sa.select(
+            TicketModel
+        ).where(
+            TicketModel.id.in_(ticket_ids)
+        ).options(
+            *self.LOAD_PROFILES[load]
+        ).execution_options(
+            populate_existing=True
+        )
+        return (await self.session.execute(stmt)).scalars().all()
+    
+    async def reserve_pnr_block(self) -> int:
+        return (await self.session.execute(sa.select(pnr_blocks.next_value()))).scalar_one()
     
             
 class PassengerCrud(BaseCrud, _PassengerCrud):
-    def __init__(self, session: Session, Model = PassengerModel):
+    def __init__(self, session: AsyncSession, Model = PassengerModel):
         super().__init__(session, Model)
     
-    def create_passenger(self, passenger_data: dict, ticket_id: int, berth_id: int | None = None):
+    async def create_passenger(self, passenger_data: dict, ticket_id: int, berth_id: int | None = None):
         
         passenger_data['ticket_id'] = ticket_id
         passenger_data['berth_id'] = berth_id
         passenger_data['needs_berth'] = passenger_data['age'] >= 5
         
-        return super().create(passenger_data)
+        return await super().create(passenger_data)
+    
+    async def insert_passengers(self, passengers_data: List[dict]):
+        if not passengers_data:
+            return
+        for passenger_data in passengers_data:
+            passenger_data['needs_berth'] = passenger_data['age'] >= 5
         
+        # A single multi-row INSERT .. VALUES statement
+        await self.session.execute(sa.insert(PassengerModel).values(passengers_data))
+    
+    async def assign_berths(self, berth_assignments: Dict[int, int], journey_date: date | None = None):
+        if not berth_assignments:
+            return
+        # UPDATE .. FROM (VALUES ..): one statement for any number of passengers
+        assignments = sa.values(
+            sa.column('id', sa.Integer),
+            sa.column('berth_id', sa.Integer),
+            name='assignments'
+        ).data(list(berth_assignments.items()))
+        stmt = sa.update(
+            PassengerModel
+        ).where(
+            PassengerModel.id == assignments.c.id
+        ).values(
+            berth_id=assignments.c.berth_id
+        ).execution_options(
+            synchronize_session=False
+        )
+        if journey_date is not None:
+            stmt = stmt.where(PassengerModel.journey_date == journey_date)
+        await self.session.execute(stmt)
+        
+
+
+
+class IdempotencyKeyCrud(BaseCrud, _IdempotencyKeyCrud):
+    def __init__(self, session: AsyncSession, Model = IdempotencyKeyModel):
+        super().__init__(session, Model)
+    
+    async def claim_key(self, key: str, request_hash: str, expires_at: datetime) -> bool:
+        """
+        Inserts a claim on ``key`` and returns whether it was taken. A live
+        row, claim or response, wins; an expired one is taken over.
+        """
+        now = utc_now()
+        stmt = pg_insert(IdempotencyKeyModel).values(
+            key=key, request_hash=request_hash, expires_at=expires_at, created_at=now, updated_at=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IdempotencyKeyModel.key],
+            set_={
+                'request_hash': stmt.excluded.request_hash,
+                'status_code': None,
+                'response': None,
+                'expires_at': stmt.excluded.expires_at,
+                'created_at': now,
+                'updated_at': now
+            },
+            where=IdempotencyKeyModel.expires_at <= sa.func.now()
+        ).returning(IdempotencyKeyModel.id)
+        return (await self.session.execute(stmt)).scalar_one_or_none() is not None
+    
+    async def get_key(self, key: str) -> IdempotencyKeyModel | None:
+        stmt = sa.select(
+            IdempotencyKeyModel
+        ).where(
+            IdempotencyKeyModel.key == key,
+            IdempotencyKeyModel.expires_at > sa.func.now()
+        ).execution_options(
+            populate_existing=True
+        )
+        return (await self.session.execute(stmt)).scalar_one_or_none()
+    
+    async def complete_key(self, key: str, status_code: int, response: str, expires_at: datetime):
+        stmt = sa.update(
+            IdempotencyKeyModel
+        ).where(
+            IdempotencyKeyModel.key == key
+        ).values(
+            status_code=status_code,
+            response=response,
+            expires_at=expires_at,
+            updated_at=utc_now()
+        ).execution_options(
+            synchronize_session=False
+        )
+        await self.session.execute(stmt)
+    
+    async def release_key(self, key: str):
+        stmt = sa.delete(
+            IdempotencyKeyModel
+        ).where(
+            IdempotencyKeyModel.key == key,
+            IdempotencyKeyModel.response.is_(None)
+        )
+        await self.session.execute(stmt)
+    
+    async def delete_expired(self, batch_size: int = 10000) -> int:
+        """
+        Deletes up to ``batch_size`` expired keys and returns how many went.
+        Callers repeat until it returns 0, committing in between, so no single
+        transaction holds many row locks.
+        """
+        expired = sa.select(
+            IdempotencyKeyModel.id
+        ).where(
+            IdempotencyKeyModel.expires_at <= sa.func.now()
+        ).limit(
+            batch_size
+        ).scalar_subquery()
+        stmt = sa.delete(IdempotencyKeyModel).where(IdempotencyKeyModel.id.in_(expired))
+        return (await self.session.execute(stmt)).rowcount
+
+
+class PromotionEventCrud(BaseCrud, _PromotionEventCrud):
+    # Retry delays double per failed attempt, up to 2 ** MAX_BACKOFF_STEPS times the first
+    MAX_BACKOFF_STEPS = 8
+    
+    def __init__(self, session: AsyncSession, Model = PromotionEventModel):
+        super().__init__(session, Model)
+    
+    async def add_event(self, train_id: int, journey_date: date, ticket_id: int):
+        now = utc_now()
+        await self.session.execute(
+            sa.insert(PromotionEventModel).values(train_id=train_id, journey_date=journey_date, ticket_id=ticket_id, created_at=now, updated_at=now)
+        )
+    
+    async def get_due_runs(self, limit: int = 100) -> List[Tuple[int, date]]:
+        # Oldest owed promotion first
+        stmt = sa.select(
+            PromotionEventModel.train_id,
+            PromotionEventModel.journey_date
+        ).where(
+            PromotionEventModel.available_at <= sa.func.now()
+        ).group_by(
+            PromotionEventModel.train_id,
+            PromotionEventModel.journey_date
+        ).order_by(
+            sa.func.min(PromotionEventModel.id)
+        ).limit(
+            limit
+        )
+        return list((await self.session.execute(stmt)).tuples())
+    
+    async def lock_due_events(self, train_id: int, journey_date: date) -> List[int]:
+        """
+        Locks the due events of a run until commit. Events another worker
+        already holds are skipped, that worker's pass covers them.
+        """
+        stmt = sa.select(
+            PromotionEventModel.id
+        ).where(
+            PromotionEventModel.train_id == train_id,
+            PromotionEventModel.journey_date == journey_date,
+            PromotionEventModel.available_at <= sa.func.now()
+        ).with_for_update(
+            skip_locked=True
+        )
+        return list((await self.session.execute(stmt)).scalars())
+    
+    async def delete_events(self, event_ids: List[int]):
+        if not event_ids:
+            return
+        await self.session.execute(
+            sa.delete(PromotionEventModel).where(PromotionEventModel.id.in_(event_ids))
+        )
+    
+    async def defer_events(self, event_ids: List[int], error: str, retry_delay: float):
+        if not event_ids:
+            return
+        backoff = retry_delay * sa.func.power(2, sa.func.least(PromotionEventModel.attempts, self.MAX_BACKOFF_STEPS))
+        stmt = sa.update(
+            PromotionEventModel
+        ).where(
+            PromotionEventModel.id.in_(event_ids)
+        ).values(
+            attempts=PromotionEventModel.attempts + 1,
+            last_error=error,
+            available_at=sa.func.now() + sa.func.make_interval(0, 0, 0, 0, 0, 0, backoff),
+            updated_at=utc_now()
+        ).execution_options(
+            synchronize_session=False
+        )
+        await self.session.execute(stmt)
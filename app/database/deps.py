@@ -1,14 +1,19 @@
 from typing import Annotated
-from .sessions import SessionLocal
+from .sessions import AsyncSessionLocal, replicas
 from fastapi import Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_read_db():
+    # Reads go to a replica that is close enough behind, else to the primary
+    replicas.check_if_stale()
+    async with AsyncSessionLocal(info={'read_only': True}) as db:
         yield db
-    finally:
-        db.close()
         
-db_dependency = Annotated[Session, Depends(get_db)]
\ No newline at end of file
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
@@ -5,6 +5,7 @@ from sqlalchemy import engine_from_config, pool
 
 from app.database.models import *
 from app.database.models.base import Base
+from app.database.partitions import is_partition
 from app.database.sessions import DB_URI
 
 # Set up the Alembic Config object
@@ -14,6 +15,18 @@ fileConfig(config.config_file_name)
 # Define the target metadata
 target_metadata = Base.metadata
 
+def include_name(name, type_, parent_names):
+    # Monthly partitions are created at runtime, see app.database.partitions
+    if type_ == "table":
+        return not is_partition(name)
+    return True
+
+def include_object(object, name, type_, reflected, compare_to):
+    # Postgres clones a foreign key to a partitioned table onto each partition
+    if type_ == "foreign_key_constraint":
+        return not is_partition(object.referred_table.name)
+    return True
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode."""
     url = config.get_main_option("sqlalchemy.url")
@@ -22,6 +35,8 @@ def run_migrations_offline():
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_name=include_name,
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -36,7 +51,8 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(connection=connection, target_metadata=target_metadata, include_name=include_name,
+                          include_object=include_object)
 
         with context.begin_transaction():
             context.run_migrations()
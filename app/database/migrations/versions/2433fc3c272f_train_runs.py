@@ -0,0 +1,272 @@
+"""train runs
+
+Revision ID: 2433fc3c272f
+Revises: d8e9d97dffb1
+Create Date: 2026-10-18 15:44:52.185558
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2433fc3c272f'
+down_revision: Union[str, None] = 'd8e9d97dffb1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Referencing tables first
+PARTITIONED_TABLES = ['passengers', 'tickets', 'berths']
+
+OLD_INDEXES = {
+    'passengers': ['ix_passengers_ticket_id', 'ix_passengers_berth_id'],
+    'tickets': ['ix_tickets_pnr', 'ix_tickets_train_id_status_created_at', 'ix_tickets_booked_train_id_created_at'],
+    'berths': ['ix_berths_train_id', 'ix_berths_available_train_id_type'],
+}
+
+PARTITIONED_DDL = {
+    'berths': """
+        CREATE TABLE berths (
+            journey_date DATE NOT NULL,
+            train_id INTEGER NOT NULL,
+            berth_number VARCHAR NOT NULL,
+            type berthtypeenum NOT NULL,
+            coach VARCHAR NOT NULL,
+            is_available BOOLEAN NOT NULL,
+            occupied_segments BIGINT DEFAULT '0' NOT NULL,
+            id INTEGER DEFAULT nextval('berths_id_seq') NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id, journey_date)
+        ) PARTITION BY RANGE (journey_date)
+    """,
+    'tickets': """
+        CREATE TABLE tickets (
+            journey_date DATE NOT NULL,
+            pnr VARCHAR NOT NULL,
+            status ticketstatusenum NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+            train_id INTEGER NOT NULL,
+            from_stop INTEGER DEFAULT '0' NOT NULL,
+            to_stop INTEGER DEFAULT '1' NOT NULL,
+            id INTEGER DEFAULT nextval('tickets_id_seq') NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id, journey_date)
+        ) PARTITION BY RANGE (journey_date)
+    """,
+    'passengers': """
+        CREATE TABLE passengers (
+            journey_date DATE NOT NULL,
+            ticket_id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            age INTEGER NOT NULL,
+            gender genderenum NOT NULL,
+            berth_id INTEGER,
+            needs_berth BOOLEAN NOT NULL,
+            id INTEGER DEFAULT nextval('passengers_id_seq') NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id, journey_date),
+            CONSTRAINT age_berth_constraint CHECK ((age >= 5 AND needs_berth = TRUE) OR (age < 5 AND needs_berth = FALSE))
+        ) PARTITION BY RANGE (journey_date)
+    """,
+}
+
+# Rows of the old tables, with the journey date of their train's run
+COPY_ROWS = {
+    'berths': """
+        INSERT INTO berths (journey_date, train_id, berth_number, type, coach, is_available, occupied_segments, id, created_at, updated_at)
+        SELECT r.journey_date, b.train_id, b.berth_number, b.type, b.coach, b.is_available, b.occupied_segments, b.id, b.created_at, b.updated_at
+        FROM berths_old b JOIN train_runs r ON r.train_id = b.train_id
+    """,
+    'tickets': """
+        INSERT INTO tickets (journey_date, pnr, status, created_at, train_id, from_stop, to_stop, id, updated_at)
+        SELECT r.journey_date, t.pnr, t.status, t.created_at, t.train_id, t.from_stop, t.to_stop, t.id, t.updated_at
+        FROM tickets_old t JOIN train_runs r ON r.train_id = t.train_id
+    """,
+    'passengers': """
+        INSERT INTO passengers (journey_date, ticket_id, name, age, gender, berth_id, needs_berth, id, created_at, updated_at)
+        SELECT t.journey_date, p.ticket_id, p.name, p.age, p.gender, p.berth_id, p.needs_berth, p.id, p.created_at, p.updated_at
+        FROM passengers_old p JOIN tickets t ON t.id = p.ticket_id
+    """,
+}
+
+
+def create_partitions() -> None:
+    # One partition a month, for the months runs exist in; later ones are
+    # created by app.database.partitions.ensure_partitions
+    op.execute("""
+        DO $$
+        DECLARE
+            parent text;
+            month date;
+        BEGIN
+            FOR month IN SELECT DISTINCT date_trunc('month', journey_date)::date FROM train_runs LOOP
+                FOREACH parent IN ARRAY ARRAY['berths', 'tickets', 'passengers'] LOOP
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                        parent || to_char(month, '"_y"YYYY"m"MM'), parent, month, (month + interval '1 month')::date
+                    );
+                END LOOP;
+            END LOOP;
+        END $$
+    """)
+
+
+def upgrade() -> None:
+    op.create_table('train_runs',
+    sa.Column('train_id', sa.Integer(), nullable=False),
+    sa.Column('journey_date', sa.Date(), nullable=False),
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['train_id'], ['trains.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('train_id', 'journey_date', name='uq_train_runs_train_id_journey_date')
+    )
+    op.create_index('ix_train_runs_journey_date', 'train_runs', ['journey_date'], unique=False)
+
+    # Everything booked so far belongs to one run per train, today's
+    op.execute("""
+        INSERT INTO train_runs (train_id, journey_date, created_at, updated_at)
+        SELECT id, (now() AT TIME ZONE 'utc')::date, now() AT TIME ZONE 'utc', now() AT TIME ZONE 'utc'
+        FROM trains
+    """)
+
+    for table in ['train_counters', 'promotion_events']:
+        op.add_column(table, sa.Column('journey_date', sa.Date(), nullable=True))
+        op.execute(f"UPDATE {table} x SET journey_date = r.journey_date FROM train_runs r WHERE r.train_id = x.train_id")
+        op.alter_column(table, 'journey_date', nullable=False)
+        op.drop_constraint(f'{table}_train_id_fkey', table, type_='foreignkey')
+    op.drop_constraint('train_counters_train_id_key', 'train_counters', type_='unique')
+    op.create_unique_constraint('uq_train_counters_train_id_journey_date', 'train_counters', ['train_id', 'journey_date'])
+    op.drop_constraint('promotion_events_ticket_id_fkey', 'promotion_events', type_='foreignkey')
+    op.drop_index('ix_promotion_events_train_id', table_name='promotion_events')
+    op.create_index('ix_promotion_events_train_id_journey_date', 'promotion_events', ['train_id', 'journey_date'], unique=False)
+    for table in ['train_counters', 'promotion_events']:
+        op.create_foreign_key(None, table, 'train_runs', ['train_id', 'journey_date'], ['train_id', 'journey_date'], ondelete='CASCADE')
+
+    # Tables cannot be partitioned in place: the old ones are set aside, their
+    # rows copied into partitioned ones, ids and sequences carried over
+    for table in PARTITIONED_TABLES:
+        op.rename_table(table, f'{table}_old')
+        op.execute(f"ALTER TABLE {table}_old RENAME CONSTRAINT {table}_pkey TO {table}_old_pkey")
+        for index in OLD_INDEXES[table]:
+            op.drop_index(index, table_name=f'{table}_old')
+        op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+    for table in reversed(PARTITIONED_TABLES):
+        op.execute(PARTITIONED_DDL[table])
+    create_partitions()
+    for table in reversed(PARTITIONED_TABLES):
+        op.execute(COPY_ROWS[table])
+    for table in PARTITIONED_TABLES:
+        op.drop_table(f'{table}_old')
+        op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+
+    op.create_index('ix_berths_train_id_journey_date', 'berths', ['train_id', 'journey_date'], unique=False)
+    op.create_index('ix_berths_available_train_id_journey_date_type', 'berths', ['train_id', 'journey_date', 'type', 'id'], unique=False, postgresql_where=sa.text('is_available'))
+    op.create_index('ix_tickets_pnr_journey_date', 'tickets', ['pnr', 'journey_date'], unique=True)
+    op.create_index('ix_tickets_train_id_journey_date_status_created_at', 'tickets', ['train_id', 'journey_date', 'status', 'created_at'], unique=False)
+    op.create_index('ix_tickets_booked_train_id_journey_date_created_at', 'tickets', ['train_id', 'journey_date', 'created_at', 'id'], unique=False, postgresql_where=sa.text("status <> 'CANCELLED'"))
+    op.create_index('ix_passengers_ticket_id', 'passengers', ['ticket_id'], unique=False)
+    op.create_index('ix_passengers_berth_id', 'passengers', ['berth_id'], unique=False)
+    for table in ['berths', 'tickets']:
+        op.create_foreign_key(None, table, 'train_runs', ['train_id', 'journey_date'], ['train_id', 'journey_date'], ondelete='CASCADE')
+    op.create_foreign_key(None, 'passengers', 'tickets', ['ticket_id', 'journey_date'], ['id', 'journey_date'], ondelete='CASCADE')
+    op.create_foreign_key(None, 'passengers', 'berths', ['berth_id', 'journey_date'], ['id', 'journey_date'], ondelete='CASCADE')
+
+
+def downgrade() -> None:
+    # Back to one set of berths and counters per train: each train keeps
+    # its earliest run, the tickets of later runs are dropped
+    op.execute("""
+        DELETE FROM train_runs r USING train_runs e
+        WHERE e.train_id = r.train_id AND e.journey_date < r.journey_date
+    """)
+
+    for table in PARTITIONED_TABLES:
+        op.rename_table(table, f'{table}_partitioned')
+        op.execute(f"ALTER TABLE {table}_partitioned RENAME CONSTRAINT {table}_pkey TO {table}_partitioned_pkey")
+        op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+    op.execute("""
+        CREATE TABLE berths (
+            train_id INTEGER NOT NULL REFERENCES trains (id) ON DELETE CASCADE,
+            berth_number VARCHAR NOT NULL,
+            type berthtypeenum NOT NULL,
+            coach VARCHAR NOT NULL,
+            is_available BOOLEAN NOT NULL,
+            id INTEGER DEFAULT nextval('berths_id_seq') NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            occupied_segments BIGINT DEFAULT '0' NOT NULL,
+            CONSTRAINT berths_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("""
+        CREATE TABLE tickets (
+            pnr VARCHAR NOT NULL,
+            status ticketstatusenum NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL,
+            train_id INTEGER NOT NULL REFERENCES trains (id) ON DELETE CASCADE,
+            id INTEGER DEFAULT nextval('tickets_id_seq') NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            from_stop INTEGER DEFAULT '0' NOT NULL,
+            to_stop INTEGER DEFAULT '1' NOT NULL,
+            CONSTRAINT tickets_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("""
+        CREATE TABLE passengers (
+            ticket_id INTEGER NOT NULL REFERENCES tickets (id) ON DELETE CASCADE,
+            name VARCHAR NOT NULL,
+            age INTEGER NOT NULL,
+            gender genderenum NOT NULL,
+            berth_id INTEGER REFERENCES berths (id),
+            needs_berth BOOLEAN NOT NULL,
+            id INTEGER DEFAULT nextval('passengers_id_seq') NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            CONSTRAINT passengers_pkey PRIMARY KEY (id),
+            CONSTRAINT age_berth_constraint CHECK ((age >= 5 AND needs_berth = TRUE) OR (age < 5 AND needs_berth = FALSE))
+        )
+    """)
+    op.execute("""
+        INSERT INTO berths (train_id, berth_number, type, coach, is_available, id, created_at, updated_at, occupied_segments)
+        SELECT train_id, berth_number, type, coach, is_available, id, created_at, updated_at, occupied_segments FROM berths_partitioned
+    """)
+    op.execute("""
+        INSERT INTO tickets (pnr, status, created_at, train_id, id, updated_at, from_stop, to_stop)
+        SELECT pnr, status, created_at, train_id, id, updated_at, from_stop, to_stop FROM tickets_partitioned
+    """)
+    op.execute("""
+        INSERT INTO passengers (ticket_id, name, age, gender, berth_id, needs_berth, id, created_at, updated_at)
+        SELECT ticket_id, name, age, gender, berth_id, needs_berth, id, created_at, updated_at FROM passengers_partitioned
+    """)
+    for table in PARTITIONED_TABLES:
+        # Drops the partitions along with it
+        op.drop_table(f'{table}_partitioned')
+        op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.create_index('ix_tickets_pnr', 'tickets', ['pnr'], unique=True)
+    op.create_index('ix_tickets_train_id_status_created_at', 'tickets', ['train_id', 'status', 'created_at'], unique=False)
+    op.create_index('ix_tickets_booked_train_id_created_at', 'tickets', ['train_id', 'created_at', 'id'], unique=False, postgresql_where=sa.text("status <> 'CANCELLED'"))
+    op.create_index('ix_berths_train_id', 'berths', ['train_id'], unique=False)
+    op.create_index('ix_berths_available_train_id_type', 'berths', ['train_id', 'type', 'id'], unique=False, postgresql_where=sa.text('is_available'))
+    op.create_index('ix_passengers_ticket_id', 'passengers', ['ticket_id'], unique=False)
+    op.create_index('ix_passengers_berth_id', 'passengers', ['berth_id'], unique=False)
+
+    op.drop_constraint('uq_train_counters_train_id_journey_date', 'train_counters', type_='unique')
+    op.create_unique_constraint('train_counters_train_id_key', 'train_counters', ['train_id'])
+    op.drop_index('ix_promotion_events_train_id_journey_date', table_name='promotion_events')
+    op.create_index('ix_promotion_events_train_id', 'promotion_events', ['train_id'], unique=False)
+    for table in ['train_counters', 'promotion_events']:
+        op.drop_constraint(f'{table}_train_id_journey_date_fkey', table, type_='foreignkey')
+        op.drop_column(table, 'journey_date')
+        op.create_foreign_key(f'{table}_train_id_fkey', table, 'trains', ['train_id'], ['id'], ondelete='CASCADE')
+    op.execute("DELETE FROM promotion_events WHERE ticket_id NOT IN (SELECT id FROM tickets)")
+    op.create_foreign_key('promotion_events_ticket_id_fkey', 'promotion_events', 'tickets', ['ticket_id'], ['id'], ondelete='CASCADE')
+
+    op.drop_index('ix_train_runs_journey_date', table_name='train_runs')
+    op.drop_table('train_runs')
@@ -0,0 +1,28 @@
+"""pnr blocks
+
+Revision ID: a876f2fd63f3
+Revises: da7157989f61
+Create Date: 2026-10-18 14:45:07.177400
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a876f2fd63f3'
+down_revision: Union[str, None] = 'da7157989f61'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(
+        sa.Sequence('pnr_blocks', start=1, minvalue=1, maxvalue=(1 << 24) - 1)
+    ))
+
+
+def downgrade() -> None:
+    op.execute(sa.schema.DropSequence(sa.Sequence('pnr_blocks')))
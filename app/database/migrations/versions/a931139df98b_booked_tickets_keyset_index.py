@@ -0,0 +1,28 @@
+"""booked tickets keyset index
+
+Revision ID: a931139df98b
+Revises: b5fe33167a90
+Create Date: 2026-10-18 14:24:36.382230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a931139df98b'
+down_revision: Union[str, None] = 'b5fe33167a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tickets_booked_train_id_created_at', 'tickets', ['train_id', 'created_at', 'id'], unique=False, postgresql_where=sa.text("status <> 'CANCELLED'"), postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_tickets_booked_train_id_created_at', table_name='tickets', postgresql_concurrently=True, if_exists=True)
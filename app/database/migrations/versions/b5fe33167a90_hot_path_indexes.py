@@ -0,0 +1,51 @@
+"""hot path indexes
+
+Revision ID: b5fe33167a90
+Revises: 61cca0bd15ad
+Create Date: 2026-10-18 14:20:35.279088
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5fe33167a90'
+down_revision: Union[str, None] = '61cca0bd15ad'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY builds don't block writes on live tables, but can't run
+    # inside a transaction. if_not_exists lets a failed build be re-run.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_berths_train_id', 'berths', ['train_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_berths_available_train_id_type', 'berths', ['train_id', 'type', 'id'], unique=False, postgresql_where=sa.text('is_available'), postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_tickets_train_id_status_created_at', 'tickets', ['train_id', 'status', 'created_at'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_passengers_ticket_id', 'passengers', ['ticket_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_passengers_berth_id', 'passengers', ['berth_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+        # Primary keys are indexed already
+        op.drop_index(op.f('ix_trains_id'), table_name='trains', postgresql_concurrently=True, if_exists=True)
+        op.drop_index(op.f('ix_train_counters_id'), table_name='train_counters', postgresql_concurrently=True, if_exists=True)
+        op.drop_index(op.f('ix_berths_id'), table_name='berths', postgresql_concurrently=True, if_exists=True)
+        op.drop_index(op.f('ix_tickets_id'), table_name='tickets', postgresql_concurrently=True, if_exists=True)
+        op.drop_index(op.f('ix_passengers_id'), table_name='passengers', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_passengers_id'), 'passengers', ['id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index(op.f('ix_tickets_id'), 'tickets', ['id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index(op.f('ix_berths_id'), 'berths', ['id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index(op.f('ix_train_counters_id'), 'train_counters', ['id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index(op.f('ix_trains_id'), 'trains', ['id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+        op.drop_index('ix_passengers_berth_id', table_name='passengers', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_passengers_ticket_id', table_name='passengers', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_tickets_train_id_status_created_at', table_name='tickets', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_berths_available_train_id_type', table_name='berths', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_berths_train_id', table_name='berths', postgresql_concurrently=True, if_exists=True)
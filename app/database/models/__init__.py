@@ -1 +1 @@
-from .tickets import TrainModel, TicketModel, BerthModel, PassengerModel
\ No newline at end of file
+from .tickets import TrainModel, TrainRunModel, TrainCounterModel, TicketModel, BerthModel, PassengerModel, IdempotencyKeyModel, PromotionEventModel
\ No newline at end of file
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from pytz import UTC
 
 import inflect
@@ -9,12 +9,23 @@ from sqlalchemy.ext.declarative import as_declarative, declared_attr
 import sqlalchemy as sa
 
 
+# asyncpg rejects tz-aware values for TIMESTAMP WITHOUT TIME ZONE columns,
+# so audit timestamps are stored as naive UTC, computed per row.
+def utc_now() -> datetime:
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+# Journey dates default to the current UTC day
+def utc_today() -> date:
+    return datetime.now(UTC).date()
+
+
 @as_declarative()
 class Base:
-    id: Mapped[int]  = mapped_column(sa.Integer, primary_key=True, index=True, autoincrement=True)
-    created_at: Mapped[datetime] = mapped_column(sa.DateTime, default=datetime.now(UTC))
+    id: Mapped[int]  = mapped_column(sa.Integer, primary_key=True, autoincrement=True)
+    created_at: Mapped[datetime] = mapped_column(sa.DateTime, default=utc_now)
     updated_at: Mapped[datetime] = mapped_column(
-        sa.DateTime, default=datetime.now(UTC), onupdate=datetime.now(UTC)
+        sa.DateTime, default=utc_now, onupdate=utc_now
     )
     __name__: str
 
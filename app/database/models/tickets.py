@@ -1,4 +1,6 @@
+from datetime import date, datetime
 import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Mapped, mapped_column, relationship, backref
 from app.database.models.base import Base
 from enum import Enum
@@ -30,67 +32,179 @@ class TrainModel(Base):
     # berths_per_coach: Mapped[int] = mapped_column(default=9)
     total_rac_berths: Mapped[int] = mapped_column(default=9)
     total_waiting_list: Mapped[int] = mapped_column(default=10)
+    # Station codes of the route in running order. Segment i runs from
+    # stations[i] to stations[i + 1]; a train without stations has a single
+    # segment, origin to destination
+    stations: Mapped[List[str]] = mapped_column(ARRAY(sa.String), default=list, server_default='{}')
     
     @property
     def total_coaches(self):
         return self.total_confirmed_berths // self.total_rac_berths
     
+    @property
+    def total_segments(self):
+        return max(1, len(self.stations or ()) - 1)
+    
+    runs: Mapped[List["TrainRunModel"]] = relationship(
+        "TrainRunModel", 
+        backref=backref("train"),
+        cascade="all, delete",
+        passive_deletes=True
+    )
+
+
+# Run-keyed tables reference their run by its natural key, so that queries
+# filter on journey_date, the partition key, without looking the run up
+RUN_KEY = ['train_id', 'journey_date']
+RUN_REFERENCE = ['train_runs.train_id', 'train_runs.journey_date']
+
+
+class TrainRunModel(Base):
+    """
+    One departure of a train, on ``journey_date``: the unit berths are sold
+    for. Each run has berths, tickets and counters of its own; a train is
+    only bookable on the dates it has a run for, see TrainRunCrud.open_runs.
+    """
+    __tablename__ = "train_runs"
+    train_id: Mapped[int] = mapped_column(sa.ForeignKey("trains.id", ondelete='CASCADE'), nullable=False)
+    journey_date: Mapped[date] = mapped_column(sa.Date, nullable=False)
+    
     berths: Mapped[List["BerthModel"]] = relationship(
         "BerthModel", 
-        backref=backref("train_berths", cascade="all, delete"),
+        backref=backref("run"),
         cascade="all, delete",
         passive_deletes=True
     )
     tickets: Mapped[List["TicketModel"]] = relationship(
         "TicketModel", 
-        backref=backref("train_ticket", cascade="all, delete"),
+        backref=backref("run"),
         cascade="all, delete",
         passive_deletes=True
     )
+    
+    __table_args__ = (
+        sa.UniqueConstraint(*RUN_KEY, name='uq_train_runs_train_id_journey_date'),
+        sa.Index('ix_train_runs_journey_date', 'journey_date'),
+    )
+
+
+class TrainCounterModel(Base):
+    """
+    Tickets held per status on a run, maintained in the same transaction
+    as every booking, cancellation and promotion. Bookings read it unlocked
+    and move it with a conditional update, ``apply_deltas`` with ``limits``,
+    which is refused when another writer used the places up meanwhile.
+    """
+    __tablename__ = "train_counters"
+    train_id: Mapped[int] = mapped_column(nullable=False)
+    journey_date: Mapped[date] = mapped_column(sa.Date, nullable=False)
+    confirmed_used: Mapped[int] = mapped_column(default=0)
+    rac_used: Mapped[int] = mapped_column(default=0)
+    waiting_used: Mapped[int] = mapped_column(default=0)
+    # Tickets held per segment of the route, one element per segment: the
+    # capacity left for a journey is the total less the busiest segment it covers
+    confirmed_segments: Mapped[List[int]] = mapped_column(ARRAY(sa.Integer), server_default='{0}')
+    rac_segments: Mapped[List[int]] = mapped_column(ARRAY(sa.Integer), server_default='{0}')
+    waiting_segments: Mapped[List[int]] = mapped_column(ARRAY(sa.Integer), server_default='{0}')
+    # Bumped by every write to the run's tickets or berths
+    version: Mapped[int] = mapped_column(default=0, server_default='0')
+    
+    __table_args__ = (
+        sa.ForeignKeyConstraint(RUN_KEY, RUN_REFERENCE, ondelete='CASCADE'),
+        sa.UniqueConstraint(*RUN_KEY, name='uq_train_counters_train_id_journey_date'),
+    )
 
 
 class BerthModel(Base):
+    """Berths of a run. Range partitioned by journey_date, one partition a month."""
     __tablename__ = "berths"
-    train_id: Mapped[int] = mapped_column(sa.ForeignKey("trains.id", ondelete='CASCADE'), nullable=False)
+    # Part of the primary key, as partitioned tables require
+    journey_date: Mapped[date] = mapped_column(sa.Date, primary_key=True)
+    train_id: Mapped[int] = mapped_column(nullable=False)
     berth_number: Mapped[str] = mapped_column(sa.String, nullable=False)
     type: Mapped[BerthTypeEnum] = mapped_column(sa.Enum(BerthTypeEnum), nullable=False)
     coach: Mapped[str] = mapped_column(sa.String, nullable=False)
+    # Free over the whole route, i.e. no segment occupied
     is_available: Mapped[bool] = mapped_column(default=True)
+    # Bit i is set while segment i of the route is sold on this berth
+    occupied_segments: Mapped[int] = mapped_column(sa.BigInteger, default=0, server_default='0')
     
     passengers: Mapped[list["PassengerModel"]] = relationship(
         "PassengerModel", 
-        backref=backref("berth_passengers"), 
-        cascade= "all, delete", 
-        passive_deletes=True
+        viewonly=True
         )
+    
+    __table_args__ = (
+        # id first, so lookups by id alone still use it
+        sa.PrimaryKeyConstraint('id', 'journey_date'),
+        sa.ForeignKeyConstraint(RUN_KEY, RUN_REFERENCE, ondelete='CASCADE'),
+        sa.Index('ix_berths_train_id_journey_date', 'train_id', 'journey_date'),
+        # Free berths only: the index shrinks as the run fills up
+        sa.Index('ix_berths_available_train_id_journey_date_type', 'train_id', 'journey_date', 'type', 'id',
+                 postgresql_where=sa.text('is_available')),
+        {'postgresql_partition_by': 'RANGE (journey_date)'},
+    )
+
+
+# PNR blocks, one per reservation by a worker: see app.api.views.tickets.pnr
+pnr_blocks = sa.Sequence('pnr_blocks', start=1, minvalue=1, maxvalue=(1 << 24) - 1, metadata=Base.metadata)
 
 
 class TicketModel(Base):
+    """Tickets of a run. Range partitioned by journey_date, one partition a month."""
     __tablename__ = "tickets"
-    pnr: Mapped[str] = mapped_column(sa.String, unique=True, index=True, nullable=False)
+    # Part of the primary key, as partitioned tables require
+    journey_date: Mapped[date] = mapped_column(sa.Date, primary_key=True)
+    pnr: Mapped[str] = mapped_column(sa.String, nullable=False)
     status: Mapped[TicketStatusEnum] = mapped_column(sa.Enum(TicketStatusEnum), nullable=False)
     created_at: Mapped[sa.DateTime] = mapped_column(sa.DateTime(timezone=True), server_default=sa.func.now())
-    train_id: Mapped[int] = mapped_column(sa.ForeignKey("trains.id", ondelete='CASCADE'), nullable=False)
+    train_id: Mapped[int] = mapped_column(nullable=False)
+    # Boarding and alighting stops, as indexes into the train's stations:
+    # the ticket holds segments from_stop up to to_stop - 1
+    from_stop: Mapped[int] = mapped_column(default=0, server_default='0')
+    to_stop: Mapped[int] = mapped_column(default=1, server_default='1')
     
+    # Serialized on every ticket response: must be loaded explicitly, see
+    # TicketCrud.LOAD_PROFILES, instead of silently issuing a query per ticket
     passengers: Mapped[List["PassengerModel"]] = relationship(
         "PassengerModel", 
         backref=backref("ticket_passengers", cascade="all, delete"), 
-        passive_deletes=True
+        passive_deletes=True,
+        lazy="raise_on_sql"
         )
+    
+    __table_args__ = (
+        sa.PrimaryKeyConstraint('id', 'journey_date'),
+        sa.ForeignKeyConstraint(RUN_KEY, RUN_REFERENCE, ondelete='CASCADE'),
+        # Unique indexes of a partitioned table must hold the partition key;
+        # PNRs are unique anyway, see app.api.views.tickets.pnr
+        sa.Index('ix_tickets_pnr_journey_date', 'pnr', 'journey_date', unique=True),
+        sa.Index('ix_tickets_train_id_journey_date_status_created_at', 'train_id', 'journey_date', 'status', 'created_at'),
+        # Keyset pagination of booked tickets, in (created_at, id) order
+        sa.Index('ix_tickets_booked_train_id_journey_date_created_at', 'train_id', 'journey_date', 'created_at', 'id',
+                 postgresql_where=sa.text("status <> 'CANCELLED'")),
+        {'postgresql_partition_by': 'RANGE (journey_date)'},
+    )
 
 
 class PassengerModel(Base):
+    """Passengers of a run's tickets, partitioned like them."""
     __tablename__ = "passengers"
-    ticket_id: Mapped[int] = mapped_column(sa.ForeignKey("tickets.id", ondelete='CASCADE'), nullable=False)
+    # The ticket's, part of the primary key as partitioned tables require
+    journey_date: Mapped[date] = mapped_column(sa.Date, primary_key=True)
+    ticket_id: Mapped[int] = mapped_column(nullable=False)
     name: Mapped[str] = mapped_column(sa.String, nullable=False)
     age: Mapped[int] = mapped_column(nullable=False)
     gender: Mapped[GenderEnum] = mapped_column(sa.Enum(GenderEnum), nullable=False)
-    berth_id: Mapped[int | None] = mapped_column(sa.ForeignKey("berths.id", ondelete='CASCADE'), nullable=True)
+    berth_id: Mapped[int | None] = mapped_column(nullable=True)
     needs_berth: Mapped[bool] = mapped_column(default=True)
     
+    # Read only: journey_date is the ticket's to write, and berth_id is set
+    # by the booking and promotion statements
     berth: Mapped["BerthModel"] = relationship(
         "BerthModel",
-        backref=backref('passenger_berth')
+        viewonly=True,
+        lazy="raise_on_sql"
     )
     
     # train: Mapped["TrainModel"] = relationship(
@@ -101,4 +215,53 @@ class PassengerModel(Base):
     __table_args__ = (
         sa.CheckConstraint('(age >= 5 AND needs_berth = TRUE) OR (age < 5 AND needs_berth = FALSE)', 
                        name='age_berth_constraint'),
-    )
\ No newline at end of file
+        sa.PrimaryKeyConstraint('id', 'journey_date'),
+        sa.ForeignKeyConstraint(['ticket_id', 'journey_date'], ['tickets.id', 'tickets.journey_date'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['berth_id', 'journey_date'], ['berths.id', 'berths.journey_date'], ondelete='CASCADE'),
+        sa.Index('ix_passengers_ticket_id', 'ticket_id'),
+        sa.Index('ix_passengers_berth_id', 'berth_id'),
+        {'postgresql_partition_by': 'RANGE (journey_date)'},
+    )
+
+class IdempotencyKeyModel(Base):
+    """
+    First response to a booking sent with an ``Idempotency-Key`` header,
+    replayed to retries of the same request until ``expires_at``. A row
+    without a response is a claim: the first request is still booking, and
+    the claim lapses at ``expires_at`` if that request never finishes.
+    """
+    __tablename__ = "idempotency_keys"
+    key: Mapped[str] = mapped_column(sa.String(255), unique=True, nullable=False)
+    # SHA-256 of the request body: a key reused for another request is rejected
+    request_hash: Mapped[str] = mapped_column(sa.String(64), nullable=False)
+    status_code: Mapped[int | None] = mapped_column(nullable=True)
+    response: Mapped[str | None] = mapped_column(sa.Text, nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(sa.DateTime(timezone=True), nullable=False)
+    
+    __table_args__ = (
+        sa.Index('ix_idempotency_keys_expires_at', 'expires_at'),
+    )
+
+
+class PromotionEventModel(Base):
+    """
+    Outbox of promotions owed to a run. Every cancellation that frees
+    capacity writes one in its own transaction; the promotion worker drains
+    them with a single promotion pass per run, however many it finds.
+    """
+    __tablename__ = "promotion_events"
+    train_id: Mapped[int] = mapped_column(nullable=False)
+    journey_date: Mapped[date] = mapped_column(sa.Date, nullable=False)
+    # The cancelled ticket, kept for tracing only: no foreign key, which
+    # would tie the outbox to the tickets partitions
+    ticket_id: Mapped[int] = mapped_column(nullable=False)
+    attempts: Mapped[int] = mapped_column(default=0, server_default='0')
+    last_error: Mapped[str | None] = mapped_column(sa.Text, nullable=True)
+    # Not picked up before then: pushed back after every failed attempt
+    available_at: Mapped[datetime] = mapped_column(sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False)
+    
+    __table_args__ = (
+        sa.ForeignKeyConstraint(RUN_KEY, RUN_REFERENCE, ondelete='CASCADE'),
+        sa.Index('ix_promotion_events_train_id_journey_date', 'train_id', 'journey_date'),
+        sa.Index('ix_promotion_events_available_at', 'available_at'),
+    )
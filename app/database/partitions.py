@@ -0,0 +1,99 @@
+import re
+from datetime import date
+from typing import Iterator, List
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+# Tables range partitioned by journey_date, one partition a month. Referencing
+# tables come first: that is the order partitions are detached in
+PARTITIONED_TABLES = ['passengers', 'tickets', 'berths']
+
+PARTITION_NAME = re.compile(r'^(%s)_y(\d{4})m(\d{2})$' % '|'.join(PARTITIONED_TABLES))
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def months(first: date, last: date) -> Iterator[date]:
+    """First days of the months from ``first`` up to ``last``, both included."""
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = next_month(month)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_y{month.year}m{month.month:02d}"
+
+
+def is_partition(name: str) -> bool:
+    return PARTITION_NAME.match(name) is not None
+
+
+async def get_partitions(session: AsyncSession) -> List[str]:
+    stmt = sa.text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = ANY(:tables)
+    """)
+    return list((await session.execute(stmt, {'tables': PARTITIONED_TABLES})).scalars())
+
+
+async def ensure_partitions(session: AsyncSession, first: date, last: date) -> List[str]:
+    """
+    Creates the missing partitions of the months from ``first`` to ``last``
+    and returns their names. Creating a partition locks its parent table
+    until commit, so callers commit right after, before any bulk write.
+    """
+    existing = set(await get_partitions(session))
+    created = []
+    for month in months(first, last):
+        for table in PARTITIONED_TABLES:
+            name = partition_name(table, month)
+            if name in existing:
+                continue
+            await session.execute(sa.text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+            ))
+            created.append(name)
+    return created
+
+
+async def detach_partitions(session: AsyncSession, before: date) -> List[str]:
+    """
+    Detaches the partitions of the months wholly before ``before`` and
+    returns their names. Detaching is a catalog change, however many rows
+    the partitions hold. The detached tables keep their rows but lose their
+    foreign keys, so deleting the runs they belonged to, or the tables
+    themselves, never cascades back into the live ones.
+    """
+    cutoff = month_start(before)
+    partitions = {}
+    for name in await get_partitions(session):
+        match = PARTITION_NAME.match(name)
+        if match and date(int(match[2]), int(match[3]), 1) < cutoff:
+            partitions.setdefault(match[1], []).append(name)
+
+    foreign_keys = sa.text("""
+        SELECT conname FROM pg_constraint
+        WHERE contype = 'f' AND conrelid = CAST(:name AS regclass)
+    """)
+    detached = []
+    for table in PARTITIONED_TABLES:
+        for name in sorted(partitions.get(table, ())):
+            await session.execute(sa.text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            # Right away: the partitions it references are detached next, and
+            # must not be referenced by a table holding rows of theirs then
+            for constraint in (await session.execute(foreign_keys, {'name': name})).scalars().all():
+                await session.execute(sa.text(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"'))
+            detached.append(name)
+    return detached
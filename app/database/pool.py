@@ -0,0 +1,104 @@
+from dataclasses import asdict, dataclass
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    # Queue wait plus pre-ping, from asking the pool to holding a connection
+    checkout_seconds_total: float = 0.0
+    checkout_seconds_max: float = 0.0
+    timeouts: int = 0
+    connects: int = 0
+    # Connections opened beyond pool_size, out of max_overflow
+    overflow_connects: int = 0
+    invalidations: int = 0
+    max_checked_out: int = 0
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that keeps ``PoolStats`` of this worker. The stats carry over
+    when the engine recreates its pool, on ``dispose()``. They are counted
+    by the listeners of ``instrument_pool``, except the checkout wait: no
+    pool event fires before a checkout starts waiting, so it is timed
+    around ``connect()``.
+    """
+    def __init__(self, *args, **kw) -> None:
+        super().__init__(*args, **kw)
+        self.stats = PoolStats()
+
+    def recreate(self) -> 'InstrumentedPool':
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        elapsed = time.perf_counter() - started
+        self.stats.checkout_seconds_total += elapsed
+        self.stats.checkout_seconds_max = max(self.stats.checkout_seconds_max, elapsed)
+        return connection
+
+    def snapshot(self) -> dict:
+        return {
+            'size': self.size(),
+            'max_overflow': self._max_overflow,
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': max(self.overflow(), 0),
+            **asdict(self.stats)
+        }
+
+
+def instrument_pool(engine: AsyncEngine) -> AsyncEngine:
+    """
+    Counts the connects, closes, checkouts and invalidations of the
+    ``InstrumentedPool`` of ``engine`` through pool events. The listeners are
+    set on the engine and look its pool up on every event, so they follow the
+    pool when ``dispose()`` recreates it.
+    """
+    sync_engine = engine.sync_engine
+    # Connections still open, counted from the events rather than overflow():
+    # concurrent checkouts reserve their overflow slots before any connects
+    opened = 0
+
+    def on_connect(dbapi_connection, connection_record):
+        nonlocal opened
+        pool = sync_engine.pool
+        opened += 1
+        pool.stats.connects += 1
+        if opened > pool.size():
+            pool.stats.overflow_connects += 1
+
+    def on_close(dbapi_connection, connection_record):
+        nonlocal opened
+        opened -= 1
+
+    def on_close_detached(dbapi_connection):
+        nonlocal opened
+        opened -= 1
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool = sync_engine.pool
+        pool.stats.checkouts += 1
+        pool.stats.max_checked_out = max(pool.stats.max_checked_out, pool.checkedout())
+
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        sync_engine.pool.stats.invalidations += 1
+
+    event.listen(sync_engine, 'connect', on_connect)
+    event.listen(sync_engine, 'close', on_close)
+    event.listen(sync_engine, 'close_detached', on_close_detached)
+    event.listen(sync_engine, 'checkout', on_checkout)
+    event.listen(sync_engine, 'invalidate', on_invalidate)
+    event.listen(sync_engine, 'soft_invalidate', on_invalidate)
+    return engine
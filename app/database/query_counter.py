@@ -0,0 +1,35 @@
+from typing import List
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+
+class QueryCounter:
+    """
+    Counts the statements sent to the database inside a ``with`` block.
+
+        with QueryCounter(connection) as queries:
+            ...
+        queries.assert_count(2)
+    """
+    def __init__(self, bind: AsyncConnection | AsyncEngine) -> None:
+        self.target = bind.sync_engine if isinstance(bind, AsyncEngine) else bind.sync_connection
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def assert_count(self, expected: int, label: str = "") -> None:
+        if self.count != expected:
+            statements = "\n".join(f"  {' '.join(statement.split())}" for statement in self.statements)
+            raise AssertionError(f"{label or 'block'}: expected {expected} queries, got {self.count}\n{statements}")
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(self.target, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        event.remove(self.target, 'before_cursor_execute', self._record)
@@ -0,0 +1,98 @@
+import asyncio
+import itertools
+import time
+from typing import List
+import sqlalchemy as sa
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+
+# Seconds of replay the replica is behind, 0 when it has replayed all it received
+# (after a restart the receive position starts back at its segment, hence <=).
+# A server that is not in recovery is treated as current.
+LAG_QUERY = sa.text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica:
+    def __init__(self, engine: AsyncEngine) -> None:
+        self.engine = engine
+        # Unknown until the first check: not used before then
+        self.lag: float | None = None
+
+    async def check(self, timeout: float) -> None:
+        try:
+            async with asyncio.timeout(timeout):
+                async with self.engine.connect() as connection:
+                    self.lag = float((await connection.execute(LAG_QUERY)).scalar_one())
+        except Exception:
+            self.lag = None
+
+
+class ReplicaSet:
+    """
+    Streaming replicas of this worker with their last measured lag. Lag is
+    measured in the background at most every ``check_interval`` seconds, so
+    picking a replica never waits on the network. Replicas that are
+    unreachable or more than ``max_lag`` seconds behind are skipped, and with
+    none left reads go to the primary.
+    """
+    def __init__(self, engines: List[AsyncEngine], max_lag: float, check_interval: float) -> None:
+        self.replicas = [Replica(engine) for engine in engines]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._turns = itertools.count()
+        self._checked_at = float('-inf')
+        self._check: asyncio.Task | None = None
+
+    def pick(self) -> Engine | None:
+        fresh = [replica for replica in self.replicas if replica.lag is not None and replica.lag <= self.max_lag]
+        if not fresh:
+            return None
+        return fresh[next(self._turns) % len(fresh)].engine.sync_engine
+
+    def check_if_stale(self) -> None:
+        if not self.replicas or (self._check and not self._check.done()):
+            return
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        self._checked_at = time.monotonic()
+        self._check = asyncio.create_task(self.check())
+
+    async def check(self) -> None:
+        await asyncio.gather(*[replica.check(timeout=max(self.check_interval, 1)) for replica in self.replicas])
+
+    def status(self) -> List[dict]:
+        return [
+            {'url': replica.engine.url.render_as_string(hide_password=True), 'lag': replica.lag,
+             'in_use': replica.lag is not None and replica.lag <= self.max_lag}
+            for replica in self.replicas
+        ]
+
+
+class RoutingSession(Session):
+    """
+    Session that sends the reads of read-only sessions, created with
+    ``info={'read_only': True}``, to a replica, and everything else to the
+    primary. A read-only session sticks to one replica for its lifetime, and
+    to the primary from its first write or locking read on, so a request
+    always sees its own writes.
+    """
+    def get_bind(self, mapper=None, *, clause=None, **kw):
+        primary = super().get_bind(mapper, clause=clause, **kw)
+        if not self.info.get('read_only') or self.info.get('wrote'):
+            return primary
+
+        if self._flushing or isinstance(clause, UpdateBase) or getattr(clause, '_for_update_arg', None) is not None:
+            self.info['wrote'] = True
+            return primary
+
+        if 'replica' not in self.info:
+            self.info['replica'] = self.info['replicas'].pick()
+        return self.info['replica'] or primary
@@ -1,9 +1,41 @@
 from app.conf.settings import settings
+from app.database.pool import InstrumentedPool, instrument_pool
+from app.database.routing import ReplicaSet, RoutingSession
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 
+# Sync engine, kept for Alembic migrations and maintenance scripts
 DB_URI = settings.SQLALCHEMY_DATABASE_URL
 engine = create_engine(DB_URI, pool_pre_ping=True, pool_size=10)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+POOL_OPTIONS = {
+    'poolclass': InstrumentedPool,
+    'pool_size': settings.DB_POOL_SIZE,
+    'max_overflow': settings.DB_MAX_OVERFLOW,
+    'pool_timeout': settings.DB_POOL_TIMEOUT,
+    'pool_recycle': settings.DB_POOL_RECYCLE,
+    'pool_pre_ping': settings.DB_POOL_PRE_PING,
+}
+
+ASYNC_DB_URI = settings.SQLALCHEMY_ASYNC_DATABASE_URL
+async_engine = instrument_pool(create_async_engine(ASYNC_DB_URI, **POOL_OPTIONS))
+
+# Without POSTGRES_REPLICAS every session simply uses the primary
+replicas = ReplicaSet(
+    [
+        instrument_pool(create_async_engine(url, **POOL_OPTIONS))
+        for url in settings.SQLALCHEMY_ASYNC_REPLICA_URLS
+    ],
+    max_lag=settings.REPLICA_MAX_LAG,
+    check_interval=settings.REPLICA_CHECK_INTERVAL
+)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+    sync_session_class=RoutingSession,
+    info={'replicas': replicas}
+)
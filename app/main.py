@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -5,10 +6,23 @@ from fastapi.middleware.cors import CORSMiddleware
 import os
 
 from app.api.views import api_router
+from app.api.views.tickets.promotions import promotion_worker
+from app.api.views.trains.availability import availability_hub
 from app.conf.settings import settings
+from app.metrics import MetricsMiddleware, metrics
 
 
-app = FastAPI(title="Fastapi app", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Drains promotions owed since the last shutdown without waiting for a cancellation
+    if settings.PROMOTION_WORKER:
+        promotion_worker.start()
+    yield
+    await promotion_worker.stop()
+    await availability_hub.close()
+
+
+app = FastAPI(title="Fastapi app", version="1.0.0", lifespan=lifespan)
 
 for folder in ['app/static', 'app/templates']:
     os.makedirs(folder, exist_ok=True)
@@ -25,6 +39,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
+app.add_api_route('/metrics', metrics, include_in_schema=False)
+
 app.include_router(
     api_router,
     prefix='/api'
@@ -0,0 +1,170 @@
+"""
+Prometheus metrics of the app, served on /metrics.
+
+Under several uvicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty,
+writable directory before starting them: every worker then writes its
+samples there and /metrics, whichever worker answers it, adds them up.
+"""
+from contextvars import ContextVar
+from dataclasses import dataclass
+import functools
+import inspect
+import os
+import time
+from app.conf.settings import settings  # noqa: F401 loads .env, PROMETHEUS_MULTIPROC_DIR included
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'Time to answer a request, streamed bodies included',
+    ['method', 'route', 'status']
+)
+
+SQL_STATEMENT_SECONDS = Histogram(
+    'db_statement_duration_seconds',
+    'Time of one SQL statement, by the CRUD method that issued it',
+    ['crud_method'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+SQL_STATEMENTS_PER_CALL = Histogram(
+    'db_statements_per_call',
+    'SQL statements issued by one call of a CRUD method',
+    ['crud_method'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+
+BOOKINGS = Counter(
+    'bookings_total',
+    'Booking requests by outcome: the ticket status, no_tickets or error',
+    ['outcome']
+)
+
+PROMOTION_PASSES = Counter(
+    'promotion_passes_total',
+    'Promotion passes run by the promotion worker, by outcome: done or failed',
+    ['outcome']
+)
+
+PROMOTION_EVENTS_PER_PASS = Histogram(
+    'promotion_events_per_pass',
+    'Cancellations covered by one promotion pass',
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 500)
+)
+
+
+@dataclass
+class CrudCall:
+    label: str
+    statements: int = 0
+
+
+# The outermost CRUD method running in this task: nested calls count towards it
+_crud_call: ContextVar[CrudCall | None] = ContextVar('crud_call', default=None)
+
+
+def _observe_call(call: CrudCall) -> None:
+    SQL_STATEMENTS_PER_CALL.labels(call.label).observe(call.statements)
+
+
+def crud_method(label: str):
+    """Tags the SQL statements of a CRUD method, coroutine or async generator, with ``label``."""
+    def decorate(function):
+        if inspect.isasyncgenfunction(function):
+            @functools.wraps(function)
+            async def generator(*args, **kwargs):
+                if _crud_call.get() is not None:
+                    async for item in function(*args, **kwargs):
+                        yield item
+                    return
+                call = CrudCall(label)
+                items = function(*args, **kwargs)
+                try:
+                    while True:
+                        # Set per step: the consumer may resume us from another context
+                        token = _crud_call.set(call)
+                        try:
+                            item = await items.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            _crud_call.reset(token)
+                        yield item
+                finally:
+                    await items.aclose()
+                    _observe_call(call)
+            return generator
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            if _crud_call.get() is not None:
+                return await function(*args, **kwargs)
+            call = CrudCall(label)
+            token = _crud_call.set(call)
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                _crud_call.reset(token)
+                _observe_call(call)
+        return wrapper
+    return decorate
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    call = _crud_call.get()
+    if call is not None:
+        call.statements += 1
+    SQL_STATEMENT_SECONDS.labels(call.label if call else 'unscoped').observe(elapsed)
+
+
+class MetricsMiddleware:
+    """
+    Times every HTTP request by route template, so ``/v1/tickets/cancel/{ticket_id}``
+    is one series whatever the id. Requests that match no route share one.
+    """
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            REQUEST_SECONDS.labels(
+                scope['method'],
+                route.path if route else 'unmatched',
+                str(status_code)
+            ).observe(time.perf_counter() - started)
+
+
+def metrics(request: Request) -> Response:
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
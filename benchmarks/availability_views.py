@@ -0,0 +1,101 @@
+"""
+Payload size and latency of the /v1/tickets/available views: counts,
+compact and full (with FAST_SERIALIZATION off and on).
+
+Creates one train, books a share of it with scattered bookings so the free
+berths are fragmented, then fetches each view in turn:
+
+    python -m benchmarks.availability_views --berths 630 --booked 0.3 --requests 500
+
+Against a running server pass --base-url http://localhost:8000/api; the
+full-fast view then reflects whatever FAST_SERIALIZATION the server runs with.
+"""
+import argparse
+import asyncio
+import gzip
+import random
+import statistics
+import time
+
+import httpx
+
+
+async def fetch(client: httpx.AsyncClient, train_id: int, view: str, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, sizes = [], set()
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get('/v1/tickets/available', params={'train_id': train_id, 'view': view})
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+            sizes.add(len(response.content))
+            return response.content
+
+    started = time.perf_counter()
+    bodies = await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'bytes': max(sizes),
+        'gzip_bytes': len(gzip.compress(bodies[-1])),
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'per_second': requests / elapsed,
+    }
+
+
+async def main(args):
+    if args.base_url:
+        transport, base_url, settings = None, args.base_url, None
+    else:
+        from app.conf.settings import settings
+        from app.main import app
+        transport, base_url = httpx.ASGITransport(app=app), 'http://benchmark/api'
+
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120) as client:
+        response = await client.post('/v1/trains', json={
+            'name': 'Availability views',
+            'total_confirmed_berths': args.berths,
+            'total_rac_berths': max(1, args.berths // 14),
+            'total_waiting_list': 0
+        })
+        response.raise_for_status()
+        train_id = response.json()['id']
+
+        # Mixed ages and group sizes spread the bookings over berth types and coaches
+        rng = random.Random(0)
+        remaining = int(args.berths * args.booked)
+        while remaining > 0:
+            size = min(remaining, rng.randint(1, 4))
+            await client.post('/v1/tickets/book', json={
+                'train_id': train_id,
+                'passengers': [{'name': 'Seat filler', 'age': rng.choice([25, 40, 65]), 'gender': 'male'}] * size
+            })
+            remaining -= size
+
+        views = [('counts', 'counts'), ('compact', 'compact'), ('full', 'full')]
+        if settings is not None:
+            views.append(('full-fast', 'full'))
+
+        print(f"train {train_id}: {args.berths} berths, {args.booked:.0%} booked, "
+              f"{args.requests} requests per view at concurrency {args.concurrency}")
+        print(f"{'view':10} {'bytes':>8} {'gzip':>7} {'p50 ms':>8} {'p95 ms':>8} {'req/s':>8}")
+        for label, view in views:
+            if settings is not None:
+                settings.FAST_SERIALIZATION = label == 'full-fast'
+            result = await fetch(client, train_id, view, args.requests, args.concurrency)
+            print(f"{label:10} {result['bytes']:8} {result['gzip_bytes']:7} {result['p50_ms']:8.2f} "
+                  f"{result['p95_ms']:8.2f} {result['per_second']:8.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default=None)
+    parser.add_argument('--berths', type=int, default=630)
+    parser.add_argument('--booked', type=float, default=0.3, help="Share of the berths to book first")
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,66 @@
+"""
+Concurrent-request throughput of a single app worker.
+
+Start one worker of the build under test and point the script at it:
+
+    uvicorn app.main:app --port 8000 --workers 1
+    python -m benchmarks.concurrent_requests --train-id 1 --concurrency 50
+
+Run it once against the sync-session build and once against the asyncio
+build to compare requests per second at the same concurrency.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+
+async def _worker(client: httpx.AsyncClient, paths: list, deadline: float, latencies: list, errors: list):
+    index = 0
+    while time.perf_counter() < deadline:
+        path = paths[index % len(paths)]
+        index += 1
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            errors.append(repr(e))
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(base_url: str, train_id: int, concurrency: int, duration: float):
+    paths = [
+        f"/api/v1/tickets/available?train_id={train_id}",
+        f"/api/v1/tickets/booked?train_id={train_id}",
+        f"/api/v1/trains/{train_id}",
+    ]
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[
+            _worker(client, paths, deadline, latencies, errors) for _ in range(concurrency)
+        ])
+
+    latencies.sort()
+    completed = len(latencies)
+    print(f"concurrency:    {concurrency}")
+    print(f"requests:       {completed} ok, {len(errors)} failed")
+    print(f"throughput:     {completed / duration:.1f} req/s")
+    if completed:
+        print(f"latency p50:    {latencies[completed // 2] * 1000:.1f} ms")
+        print(f"latency p99:    {latencies[int(completed * 0.99)] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--train-id', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=20.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.base_url, args.train_id, args.concurrency, args.duration))
@@ -0,0 +1,84 @@
+"""
+Booking throughput on a single hot train, with and without booking actors.
+
+Creates one large train and fires concurrent single-passenger bookings at it.
+By default the app runs in-process and the script flips BOOKING_ACTORS itself:
+
+    python -m benchmarks.hot_train --mode inline --requests 2000 --concurrency 200
+    python -m benchmarks.hot_train --mode actors --requests 2000 --concurrency 200
+
+Against a running server, start it with BOOKING_ACTORS=true or false and pass
+--base-url http://localhost:8000/api instead.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def book(client: httpx.AsyncClient, train_id: int, semaphore: asyncio.Semaphore, latencies: list, outcomes: dict):
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            response = await client.post('/v1/tickets/book', json={
+                'train_id': train_id,
+                'passengers': [{'name': 'Rush passenger', 'age': 30, 'gender': 'male'}]
+            })
+            outcome = response.status_code
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        latencies.append(time.perf_counter() - started)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+
+async def main(args):
+    if args.base_url:
+        transport, base_url = None, args.base_url
+    else:
+        from app.conf.settings import settings
+        from app.main import app
+        settings.BOOKING_ACTORS = args.mode == 'actors'
+        transport, base_url = httpx.ASGITransport(app=app), 'http://benchmark/api'
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120, limits=limits) as client:
+        response = await client.post('/v1/trains', json={
+            'name': 'Hot train',
+            'total_confirmed_berths': 78000,
+            'total_rac_berths': 1000,
+            'total_waiting_list': 0
+        })
+        response.raise_for_status()
+        train_id = response.json()['id']
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, outcomes = [], {}
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            book(client, train_id, semaphore, latencies, outcomes) for _ in range(args.requests)
+        ])
+        elapsed = time.perf_counter() - started
+
+        available = (await client.get('/v1/tickets/available', params={'train_id': train_id})).json()
+
+    latencies.sort()
+    print(f"mode:          {args.mode if not args.base_url else args.base_url}")
+    print(f"requests:      {args.requests} at concurrency {args.concurrency}")
+    print(f"outcomes:      {outcomes}")
+    print(f"throughput:    {args.requests / elapsed:.1f} bookings/s")
+    print(f"latency p50:   {statistics.median(latencies) * 1000:.1f} ms")
+    print(f"latency p95:   {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+    print(f"latency p99:   {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms")
+    print(f"confirmed:     {available['total']['confirmed'] - available['available']['confirmed']} tickets booked")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hot-train booking load test")
+    parser.add_argument('--mode', choices=['inline', 'actors'], default='actors')
+    parser.add_argument('--base-url', default=None)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,341 @@
+"""
+End-to-end load test of the ticket API: concurrent mixes of bookings,
+cancellations, availability and booked-list reads, followed by oversell and
+double-allocation checks against the database.
+
+Seeds fresh trains, each with today's run, through TrainCrud.create_train,
+drives the chosen mix for a fixed duration and writes the results as JSON, so
+runs can be compared across commits:
+
+    python -m benchmarks.load --scenario mixed --trains 20 --duration 30 --output load.json
+    python -m benchmarks.load --scenario hot-train --concurrency 200 --output hot.json
+    python -m benchmarks.load --mix book=70,cancel=30 --duration 60
+
+By default the app runs in-process. Against a running server pass
+--base-url http://localhost:8000/api; trains are still seeded and checked
+through the database in .env, which must be the one the server uses.
+
+Every check must pass in every scenario, multi-passenger tickets included
+(--max-passengers 4 by default): a failure is a bug in the booking path,
+and the exit status is then 1.
+"""
+import argparse
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone
+import json
+import random
+import subprocess
+import time
+from typing import Dict, List
+
+import httpx
+import sqlalchemy as sa
+
+from app.database.crud.tickets import TrainCrud
+from app.database.sessions import AsyncSessionLocal
+
+
+SCENARIOS = {
+    'mixed': {'mix': {'book': 40, 'cancel': 10, 'available': 35, 'booked': 15}},
+    'booking': {'mix': {'book': 80, 'cancel': 20}},
+    'browse': {'mix': {'available': 60, 'booked': 40}},
+    # Every request on one train: the worst case for its counters row and berths
+    'hot-train': {'mix': {'book': 60, 'cancel': 15, 'available': 20, 'booked': 5}, 'trains': 1},
+}
+
+# Checks run once the load stops, over the runs of the seeded trains only.
+# Each query returns the violations, so an empty result is a pass.
+CHECKS = {
+    # More tickets in a status on a segment than the run has room for
+    'oversold': sa.text("""
+        SELECT r.train_id, r.journey_date, g.segment, s.status, s.tickets, s.capacity
+        FROM train_runs r
+        JOIN trains t ON t.id = r.train_id
+        CROSS JOIN generate_series(0, greatest(cardinality(t.stations) - 1, 1) - 1) AS g(segment)
+        CROSS JOIN LATERAL (
+            SELECT 'confirmed' AS status, t.total_confirmed_berths AS capacity,
+                   (SELECT count(*) FROM tickets WHERE train_id = r.train_id AND journey_date = r.journey_date
+                      AND status = 'CONFIRMED' AND from_stop <= g.segment AND to_stop > g.segment) AS tickets
+            UNION ALL
+            SELECT 'rac', t.total_rac_berths * 2,
+                   (SELECT count(*) FROM tickets WHERE train_id = r.train_id AND journey_date = r.journey_date
+                      AND status = 'RAC' AND from_stop <= g.segment AND to_stop > g.segment)
+            UNION ALL
+            SELECT 'waiting_list', t.total_waiting_list,
+                   (SELECT count(*) FROM tickets WHERE train_id = r.train_id AND journey_date = r.journey_date
+                      AND status = 'WAITING_LIST' AND from_stop <= g.segment AND to_stop > g.segment)
+        ) s
+        WHERE r.train_id = ANY(:train_ids) AND s.tickets > s.capacity
+    """),
+    # One berth held by several passengers of live tickets on a common segment
+    'double_allocated': sa.text("""
+        SELECT p1.berth_id, ARRAY[p1.ticket_id, p2.ticket_id] AS ticket_ids
+        FROM passengers p1
+        JOIN tickets t1 ON t1.id = p1.ticket_id AND t1.journey_date = p1.journey_date
+        JOIN passengers p2 ON p2.berth_id = p1.berth_id AND p2.journey_date = p1.journey_date AND p2.id > p1.id
+        JOIN tickets t2 ON t2.id = p2.ticket_id AND t2.journey_date = p2.journey_date
+        WHERE t1.train_id = ANY(:train_ids) AND t1.status <> 'CANCELLED' AND t2.status <> 'CANCELLED'
+          AND t1.from_stop < t2.to_stop AND t2.from_stop < t1.to_stop
+    """),
+    # A berth held by a live ticket yet offered as free
+    'held_but_available': sa.text("""
+        SELECT p.berth_id, p.ticket_id
+        FROM passengers p
+        JOIN tickets t ON t.id = p.ticket_id AND t.journey_date = p.journey_date
+        JOIN berths b ON b.id = p.berth_id AND b.journey_date = p.journey_date
+        WHERE t.train_id = ANY(:train_ids) AND t.status <> 'CANCELLED' AND b.is_available
+    """),
+    # Berth segments taken out of sale that no live ticket holds
+    'leaked': sa.text("""
+        SELECT b.id AS berth_id, b.train_id, b.journey_date, b.occupied_segments, coalesce(h.segments, 0) AS held_segments
+        FROM berths b
+        LEFT JOIN LATERAL (
+            SELECT bit_or(((1::bigint << (t.to_stop - t.from_stop)) - 1) << t.from_stop) AS segments
+            FROM passengers p JOIN tickets t ON t.id = p.ticket_id AND t.journey_date = p.journey_date
+            WHERE p.berth_id = b.id AND p.journey_date = b.journey_date AND t.status <> 'CANCELLED'
+        ) h ON TRUE
+        WHERE b.train_id = ANY(:train_ids) AND b.occupied_segments & ~coalesce(h.segments, 0) <> 0
+    """),
+    # A confirmed passenger who needs a berth but has none
+    'confirmed_unseated': sa.text("""
+        SELECT p.ticket_id, p.id AS passenger_id
+        FROM passengers p
+        JOIN tickets t ON t.id = p.ticket_id AND t.journey_date = p.journey_date
+        WHERE t.train_id = ANY(:train_ids) AND t.status = 'CONFIRMED' AND p.needs_berth AND p.berth_id IS NULL
+    """),
+    # Counters that disagree with the tickets they count
+    'counter_drift': sa.text("""
+        SELECT c.train_id, c.journey_date, c.confirmed_used, c.rac_used, c.waiting_used, s.confirmed, s.rac, s.waiting_list
+        FROM train_counters c
+        CROSS JOIN LATERAL (
+            SELECT count(*) FILTER (WHERE status = 'CONFIRMED') AS confirmed,
+                   count(*) FILTER (WHERE status = 'RAC') AS rac,
+                   count(*) FILTER (WHERE status = 'WAITING_LIST') AS waiting_list
+            FROM tickets WHERE train_id = c.train_id AND journey_date = c.journey_date
+        ) s
+        WHERE c.train_id = ANY(:train_ids)
+          AND (c.confirmed_used, c.rac_used, c.waiting_used) <> (s.confirmed, s.rac, s.waiting_list)
+    """),
+}
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(','):
+        operation, _, weight = part.partition('=')
+        if operation.strip() not in SCENARIOS['mixed']['mix']:
+            raise argparse.ArgumentTypeError(f"Unknown operation {operation.strip()!r}")
+        mix[operation.strip()] = int(weight or 1)
+    return mix
+
+
+def percentile(latencies: List[float], q: float) -> float | None:
+    """Nearest-rank percentile of sorted ``latencies``, in milliseconds."""
+    if not latencies:
+        return None
+    return round(latencies[max(0, min(len(latencies) - 1, round(q * len(latencies)) - 1))] * 1000, 2)
+
+
+def git_revision() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+    return {'commit': commit, 'dirty': dirty}
+
+
+async def seed_trains(count: int, berths: int, rac_berths: int, waiting_list: int) -> List[int]:
+    train_ids = []
+    async with AsyncSessionLocal() as session:
+        crud = TrainCrud(session)
+        for index in range(count):
+            run = await crud.create_train({
+                'name': f'Load test train {index + 1}',
+                'total_confirmed_berths': berths,
+                'total_rac_berths': rac_berths,
+                'total_waiting_list': waiting_list
+            })
+            train_ids.append(run.train_id)
+    return train_ids
+
+
+async def run_checks(train_ids: List[int]) -> dict:
+    checks = {}
+    async with AsyncSessionLocal() as session:
+        for name, query in CHECKS.items():
+            rows = (await session.execute(query, {'train_ids': train_ids})).mappings().all()
+            checks[name] = {'ok': not rows, 'violations': len(rows), 'sample': [dict(row) for row in rows[:10]]}
+    return checks
+
+
+class Load:
+    """
+    Drives one mix of operations. Each booking that succeeds adds its ticket
+    to the pool cancellations draw from, so only tickets booked by this run
+    are cancelled, and each at most once; with nothing to cancel yet a
+    cancellation turns into a booking.
+    """
+    def __init__(self, client: httpx.AsyncClient, train_ids: List[int], mix: Dict[str, int],
+                 max_passengers: int, seed: int) -> None:
+        self.client = client
+        self.train_ids = train_ids
+        self.operations = list(mix)
+        self.weights = [mix[operation] for operation in self.operations]
+        self.max_passengers = max_passengers
+        self.random = random.Random(seed)
+        self.tickets: List[int] = []
+        self.latencies: Dict[str, List[float]] = {operation: [] for operation in SCENARIOS['mixed']['mix']}
+        self.outcomes: Dict[str, Counter] = {operation: Counter() for operation in SCENARIOS['mixed']['mix']}
+        self.failures: Counter = Counter()
+
+    def passengers(self) -> List[dict]:
+        return [
+            {
+                'name': f'Passenger {index + 1}',
+                # A few infants, who travel without a berth
+                'age': self.random.randint(1, 4) if self.random.random() < 0.05 else self.random.randint(5, 85),
+                'gender': self.random.choice(['male', 'female', 'other'])
+            }
+            for index in range(self.random.randint(1, self.max_passengers))
+        ]
+
+    async def book(self) -> str:
+        response = await self.client.post('/v1/tickets/book', json={
+            'train_id': self.random.choice(self.train_ids),
+            'passengers': self.passengers()
+        })
+        if response.status_code == 201:
+            self.tickets.append(response.json()['id'])
+            return response.json()['status']
+        if response.status_code == 200:
+            # NoTicketsAvailable is answered with a 200
+            return 'sold_out'
+        return str(response.status_code)
+
+    async def cancel(self) -> str:
+        ticket_id = self.tickets.pop(self.random.randrange(len(self.tickets)))
+        response = await self.client.patch(f'/v1/tickets/cancel/{ticket_id}')
+        return 'cancelled' if response.is_success else str(response.status_code)
+
+    async def available(self) -> str:
+        response = await self.client.get('/v1/tickets/available', params={'train_id': self.random.choice(self.train_ids)})
+        return 'ok' if response.is_success else str(response.status_code)
+
+    async def booked(self) -> str:
+        response = await self.client.get('/v1/tickets/booked', params={
+            'train_id': self.random.choice(self.train_ids), 'page_size': 20
+        })
+        return 'ok' if response.is_success else str(response.status_code)
+
+    async def worker(self, deadline: float) -> None:
+        while time.perf_counter() < deadline:
+            operation, = self.random.choices(self.operations, self.weights)
+            if operation == 'cancel' and not self.tickets:
+                operation = 'book'
+            started = time.perf_counter()
+            try:
+                outcome = await getattr(self, operation)()
+            except httpx.HTTPError as e:
+                outcome = type(e).__name__
+                self.failures[operation] += 1
+            self.latencies[operation].append(time.perf_counter() - started)
+            self.outcomes[operation][outcome] += 1
+
+    def report(self, elapsed: float) -> dict:
+        operations = {}
+        for operation, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            latencies.sort()
+            outcomes = self.outcomes[operation]
+            # Sold out is a normal answer: errors are 5xx and transport failures
+            errors = self.failures[operation] + sum(
+                count for outcome, count in outcomes.items() if outcome.isdigit() and outcome.startswith('5')
+            )
+            operations[operation] = {
+                'requests': len(latencies),
+                'throughput': round(len(latencies) / elapsed, 1),
+                'p50_ms': percentile(latencies, 0.50),
+                'p95_ms': percentile(latencies, 0.95),
+                'p99_ms': percentile(latencies, 0.99),
+                'max_ms': round(latencies[-1] * 1000, 2),
+                'outcomes': dict(outcomes),
+                'error_rate': round(errors / len(latencies), 4)
+            }
+        requests = sum(len(latencies) for latencies in self.latencies.values())
+        return {'requests': requests, 'throughput': round(requests / elapsed, 1), 'operations': operations}
+
+
+async def main(args):
+    scenario = SCENARIOS[args.scenario]
+    mix = args.mix or scenario['mix']
+    trains = scenario.get('trains', args.trains)
+    train_ids = await seed_trains(trains, args.berths, args.rac_berths, args.waiting_list)
+
+    if args.base_url:
+        transport, base_url = None, args.base_url
+    else:
+        from app.main import app
+        transport, base_url = httpx.ASGITransport(app=app), 'http://benchmark/api'
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120, limits=limits) as client:
+        load = Load(client, train_ids, mix, args.max_passengers, args.seed)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*[load.worker(deadline) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+
+    checks = await run_checks(train_ids)
+    result = {
+        **git_revision(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'target': args.base_url or 'in-process',
+        'scenario': args.scenario if not args.mix else 'custom',
+        'config': {
+            'mix': mix, 'trains': trains, 'concurrency': args.concurrency, 'duration': args.duration,
+            'berths': args.berths, 'rac_berths': args.rac_berths, 'waiting_list': args.waiting_list,
+            'max_passengers': args.max_passengers, 'seed': args.seed
+        },
+        'train_ids': train_ids,
+        'elapsed': round(elapsed, 3),
+        **load.report(elapsed),
+        'checks': checks,
+        'ok': all(check['ok'] for check in checks.values())
+    }
+
+    print(f"scenario:    {result['scenario']} {mix} on {trains} trains at concurrency {args.concurrency}")
+    print(f"throughput:  {result['throughput']} req/s over {result['elapsed']} s")
+    for operation, stats in result['operations'].items():
+        print(f"{operation:11}  {stats['throughput']:8.1f}/s  p50 {stats['p50_ms']:8.1f} ms  p95 {stats['p95_ms']:8.1f} ms  "
+              f"p99 {stats['p99_ms']:8.1f} ms  errors {stats['error_rate']:.2%}  {stats['outcomes']}")
+    for name, check in checks.items():
+        print(f"check {name:18} " + ('ok' if check['ok'] else f"FAILED, {check['violations']} violations"))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2, default=str)
+        print(f"results written to {args.output}")
+    return result['ok']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=list(SCENARIOS), default='mixed')
+    parser.add_argument('--mix', type=parse_mix, default=None,
+                        help="Operation weights overriding the scenario's, e.g. book=60,cancel=10,available=30")
+    parser.add_argument('--base-url', default=None)
+    parser.add_argument('--trains', type=int, default=10)
+    parser.add_argument('--berths', type=int, default=630)
+    parser.add_argument('--rac-berths', type=int, default=45)
+    parser.add_argument('--waiting-list', type=int, default=100)
+    parser.add_argument('--max-passengers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="Path of the JSON results")
+    args = parser.parse_args()
+    raise SystemExit(0 if asyncio.run(main(args)) else 1)
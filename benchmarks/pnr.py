@@ -0,0 +1,73 @@
+"""
+Insert throughput and index size of the pnr unique index, uuid4 PNRs
+against block-allocated ones.
+
+Each scheme fills a temporary table shaped like tickets.pnr through several
+simulated workers taking turns, as gunicorn workers would. Block-allocated
+workers each draw from their own block; blocks are numbered locally, the
+pnr_blocks sequence is left alone:
+
+    python -m benchmarks.pnr --rows 1000000 --workers 8 --batch-size 50
+"""
+import argparse
+import asyncio
+import itertools
+import time
+import uuid
+
+from app.api.views.tickets.pnr import BLOCK_SIZE, encode_pnr
+from app.database.sessions import async_engine
+
+
+def uuid_pnrs():
+    while True:
+        yield str(uuid.uuid4()).replace('-', '').upper()[:8]
+
+
+def block_pnrs(first_block: int, workers: int):
+    block = first_block
+    while True:
+        for offset in range(BLOCK_SIZE):
+            yield encode_pnr(block, offset)
+        block += workers
+
+
+async def fill(connection, table: str, generators, rows: int, batch_size: int):
+    await connection.execute(f"CREATE TEMPORARY TABLE {table} (id serial PRIMARY KEY, pnr varchar NOT NULL)")
+    await connection.execute(f"CREATE UNIQUE INDEX {table}_pnr ON {table} (pnr)")
+    workers = itertools.cycle(generators)
+    collisions = 0
+    started = time.perf_counter()
+    for inserted in range(0, rows, batch_size):
+        batch = list(itertools.islice(next(workers), min(batch_size, rows - inserted)))
+        # What would have been a failed booking: counted instead of raised
+        status = await connection.execute(
+            f"INSERT INTO {table} (pnr) SELECT unnest($1::varchar[]) ON CONFLICT (pnr) DO NOTHING", batch
+        )
+        collisions += len(batch) - int(status.split()[-1])
+    return time.perf_counter() - started, collisions
+
+
+async def main(args):
+    async with async_engine.connect() as connection:
+        raw = (await connection.get_raw_connection()).driver_connection
+        schemes = {
+            'uuid4': [uuid_pnrs() for _ in range(args.workers)],
+            'block': [block_pnrs(worker + 1, args.workers) for worker in range(args.workers)],
+        }
+        for scheme, generators in schemes.items():
+            table = f"pnr_bench_{scheme}"
+            elapsed, collisions = await fill(raw, table, generators, args.rows, args.batch_size)
+            index_size = await raw.fetchval("SELECT pg_relation_size($1::regclass)", f"{table}_pnr")
+            print(f"{scheme:6} {args.rows / elapsed:10.0f} rows/s   pnr index {index_size / 2 ** 20:7.1f} MiB   "
+                  f"{collisions} collisions")
+            await raw.execute(f"DROP TABLE {table}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare uuid4 and block-allocated PNRs")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args))
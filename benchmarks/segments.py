@@ -0,0 +1,153 @@
+"""
+Segment-aware berth inventory on long routes.
+
+First in memory: random journeys over a route of --stops stops are seated
+one at a time, by TrainBerthInventory (one big-int AND per segment) and by
+a scan of every berth's occupancy mask, the row by row search it replaced.
+Both follow the same policy, so they must seat the same journeys; the
+difference is the time per lookup. Seated journeys are compared with the
+--berths an end to end only train could sell.
+
+Then through the API: random journeys are booked concurrently on a fresh
+train with that route until it sells out, followed by the load test's
+oversell and double allocation checks:
+
+    python -m benchmarks.segments --stops 32 --berths 630 --journeys 5000
+    python -m benchmarks.segments --stops 64 --skip-api
+
+Against a running server pass --base-url http://localhost:8000/api; checks
+read the database in .env, which must be the one the server uses.
+"""
+import argparse
+import asyncio
+from collections import Counter
+import random
+import statistics
+import time
+from typing import List, Tuple
+
+import httpx
+
+from app.api.views.tickets.inventory import TrainBerthInventory
+from app.database.crud.tickets import segment_mask
+from app.database.models.tickets import BerthTypeEnum
+
+
+def random_journeys(rng: random.Random, stops: int, count: int) -> List[Tuple[int, int]]:
+    journeys = []
+    for _ in range(count):
+        from_stop = rng.randrange(stops - 1)
+        journeys.append((from_stop, rng.randrange(from_stop + 1, stops)))
+    return journeys
+
+
+def scan_take(occupied: List[int], segments: int) -> int | None:
+    # Same policy as the inventory: berths already sold elsewhere first
+    first_free = None
+    for position, mask in enumerate(occupied):
+        if mask & segments:
+            continue
+        if mask:
+            occupied[position] |= segments
+            return position
+        if first_free is None:
+            first_free = position
+    if first_free is not None:
+        occupied[first_free] |= segments
+    return first_free
+
+
+def in_memory(args, journeys: List[Tuple[int, int]]) -> None:
+    segments = args.stops - 1
+    masks = [segment_mask(from_stop, to_stop) for from_stop, to_stop in journeys]
+
+    inventory = TrainBerthInventory([(berth_id, BerthTypeEnum.LOWER, 0) for berth_id in range(args.berths)], segments)
+    started = time.perf_counter()
+    bitset_seats = [inventory.take(None, mask) for mask in masks]
+    bitset_seconds = time.perf_counter() - started
+
+    occupied = [0] * args.berths
+    started = time.perf_counter()
+    scan_seats = [scan_take(occupied, mask) for mask in masks]
+    scan_seconds = time.perf_counter() - started
+
+    seated = sum(seat is not None for seat in bitset_seats)
+    sold = sum(to_stop - from_stop for (from_stop, to_stop), seat in zip(journeys, bitset_seats) if seat is not None)
+    print(f"in memory: {args.berths} berths, {segments} segments, {len(journeys)} random journeys")
+    print(f"  seated {seated} journeys, {seated / args.berths:.2f}x the {args.berths} an end to end train sells, "
+          f"{sold / (args.berths * segments):.1%} of berth segments sold")
+    print(f"  bitset  {len(masks) / bitset_seconds:10.0f} lookups/s")
+    print(f"  scan    {len(masks) / scan_seconds:10.0f} lookups/s")
+    print(f"  same seats: {[seat for seat in bitset_seats] == [seat for seat in scan_seats]}")
+
+
+async def through_api(args, journeys: List[Tuple[int, int]]) -> bool:
+    if args.base_url:
+        transport, base_url = None, args.base_url
+    else:
+        from app.main import app
+        transport, base_url = httpx.ASGITransport(app=app), 'http://benchmark/api'
+    from benchmarks.load import run_checks
+
+    stations = [f"ST{index:02d}" for index in range(args.stops)]
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120) as client:
+        response = await client.post('/v1/trains', json={
+            'name': 'Long route',
+            'total_confirmed_berths': args.berths,
+            'total_rac_berths': max(1, args.berths // 14),
+            'total_waiting_list': args.berths // 10,
+            'stations': stations
+        })
+        response.raise_for_status()
+        train_id = response.json()['id']
+
+        pending = iter(journeys)
+        latencies, outcomes = [], Counter()
+
+        async def worker():
+            for from_stop, to_stop in pending:
+                started = time.perf_counter()
+                response = await client.post('/v1/tickets/book', json={
+                    'train_id': train_id,
+                    'from_station': stations[from_stop],
+                    'to_station': stations[to_stop],
+                    'passengers': [{'name': 'Long haul', 'age': 30, 'gender': 'female'}]
+                })
+                latencies.append(time.perf_counter() - started)
+                outcomes[response.json().get('status', 'sold_out') if response.status_code < 300 else str(response.status_code)] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    checks = await run_checks([train_id])
+    print(f"API: train {train_id}, {len(latencies)} bookings at concurrency {args.concurrency}, {len(latencies) / elapsed:.1f}/s")
+    print(f"  p50 {statistics.median(latencies) * 1000:.1f} ms  p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+    print(f"  {dict(outcomes)}: {outcomes['confirmed']} confirmed on {args.berths} berths")
+    for name, check in checks.items():
+        print(f"  check {name:18} " + ('ok' if check['ok'] else f"FAILED, {check['violations']} violations"))
+    return all(check['ok'] for check in checks.values())
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    in_memory(args, random_journeys(rng, args.stops, args.journeys))
+    if not args.skip_api:
+        return await through_api(args, random_journeys(rng, args.stops, args.journeys))
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default=None)
+    parser.add_argument('--stops', type=int, default=32)
+    parser.add_argument('--berths', type=int, default=630)
+    parser.add_argument('--journeys', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-api', action='store_true')
+    args = parser.parse_args()
+    if not 2 <= args.stops <= 64:
+        parser.error("--stops must be between 2 and 64")
+    raise SystemExit(0 if asyncio.run(main(args)) else 1)
@@ -0,0 +1,100 @@
+"""
+Serialization cost of a /v1/tickets/booked page, per 1,000 tickets.
+
+Compares the response-model path (ORM objects validated into
+BookedTicketsOut by FastAPI, then JSON-encoded) with the fast path
+(FAST_SERIALIZATION: plain rows built into dicts and encoded with orjson).
+No database is needed, both paths get the same in-memory data:
+
+    python -m benchmarks.serialization --tickets 1000 --passengers 2
+"""
+import argparse
+import asyncio
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import statistics
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from app.api.responses import FastJSONResponse
+from app.api.views.tickets.schema import BookedTicketsOut
+from app.api.views.tickets.serializers import ticket_dicts
+from app.database.models.tickets import BerthModel, BerthTypeEnum, GenderEnum, PassengerModel, TicketModel, TicketStatusEnum
+
+
+TicketRow = namedtuple('TicketRow', 'pnr status id created_at train_id journey_date from_stop to_stop')
+PassengerRow = namedtuple(
+    'PassengerRow',
+    'ticket_id name age gender id needs_berth berth_id berth_number berth_type coach is_available berth_train_id'
+)
+
+
+def build_data(tickets: int, passengers: int):
+    started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    journey_date = started.date()
+    orm_tickets, ticket_rows, passenger_rows = [], [], []
+    passenger_id = 0
+    for ticket_id in range(1, tickets + 1):
+        created_at = started + timedelta(seconds=ticket_id)
+        ticket_passengers = []
+        for _ in range(passengers):
+            passenger_id += 1
+            berth = BerthModel(id=passenger_id, train_id=1, journey_date=journey_date, berth_number=f"A{passenger_id}", type=BerthTypeEnum.LOWER,
+                               coach='A', is_available=False)
+            ticket_passengers.append(PassengerModel(id=passenger_id, ticket_id=ticket_id, journey_date=journey_date, name=f"Passenger {passenger_id}",
+                                                    age=30, gender=GenderEnum.FEMALE, needs_berth=True, berth=berth))
+            passenger_rows.append(PassengerRow(ticket_id, f"Passenger {passenger_id}", 30, GenderEnum.FEMALE, passenger_id,
+                                               True, passenger_id, f"A{passenger_id}", BerthTypeEnum.LOWER, 'A', False, 1))
+        orm_tickets.append(TicketModel(id=ticket_id, pnr=f"{ticket_id:08d}", status=TicketStatusEnum.CONFIRMED,
+                                       created_at=created_at, train_id=1, journey_date=journey_date,
+                                       from_stop=0, to_stop=1, passengers=ticket_passengers))
+        ticket_rows.append(TicketRow(f"{ticket_id:08d}", TicketStatusEnum.CONFIRMED, ticket_id, created_at, 1, journey_date, 0, 1))
+    return orm_tickets, ticket_rows, passenger_rows
+
+
+async def response_model_path(field, orm_tickets) -> bytes:
+    content = {'tickets': orm_tickets, 'count': len(orm_tickets), 'next_cursor': None}
+    # What FastAPI does for a response_model route, without the network
+    return JSONResponse(None).render(await serialize_response(field=field, response_content=content))
+
+
+async def fast_path(ticket_rows, passenger_rows) -> bytes:
+    tickets = ticket_dicts(ticket_rows, passenger_rows)
+    return FastJSONResponse(None).render({'tickets': tickets, 'count': len(tickets), 'next_cursor': None, 'total': None})
+
+
+async def measure(function, *args, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await function(*args)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+async def main(args):
+    orm_tickets, ticket_rows, passenger_rows = build_data(args.tickets, args.passengers)
+    field = create_model_field(name='Response', type_=BookedTicketsOut, mode='serialization')
+
+    slow = await response_model_path(field, orm_tickets)
+    fast = await fast_path(ticket_rows, passenger_rows)
+    assert slow == fast, "both paths must produce the same document"
+
+    per_thousand = 1000 / args.tickets
+    baseline = await measure(response_model_path, field, orm_tickets, repeat=args.repeat) * per_thousand
+    optimized = await measure(fast_path, ticket_rows, passenger_rows, repeat=args.repeat) * per_thousand
+    print(f"response_model + json: {baseline * 1000:8.2f} ms per 1,000 tickets")
+    print(f"rows + orjson:         {optimized * 1000:8.2f} ms per 1,000 tickets")
+    print(f"speedup:               {baseline / optimized:8.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare /booked serialization paths")
+    parser.add_argument('--tickets', type=int, default=1000)
+    parser.add_argument('--passengers', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args))